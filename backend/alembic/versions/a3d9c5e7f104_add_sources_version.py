@@ -0,0 +1,27 @@
+"""add version to sources
+
+Revision ID: a3d9c5e7f104
+Revises: f8b1d4c6e2a7
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'a3d9c5e7f104'
+down_revision: Union[str, None] = 'f8b1d4c6e2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('sources', sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+    op.create_index('ix_sources_version', 'sources', ['version'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_sources_version', table_name='sources')
+    op.drop_column('sources', 'version')
@@ -0,0 +1,25 @@
+"""add value to param_stamps
+
+Revision ID: a7c3e9d1f524
+Revises: d2f8b6a4e930
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'a7c3e9d1f524'
+down_revision: Union[str, None] = 'd2f8b6a4e930'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('param_stamps', sa.Column('value', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('param_stamps', 'value')
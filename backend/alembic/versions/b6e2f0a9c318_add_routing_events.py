@@ -0,0 +1,41 @@
+"""add routing_events journal
+
+Revision ID: b6e2f0a9c318
+Revises: a3d9c5e7f104
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'b6e2f0a9c318'
+down_revision: Union[str, None] = 'a3d9c5e7f104'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'routing_events',
+        sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), primary_key=True),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('output', sa.Integer(), nullable=False),
+        sa.Column('old_input', sa.Integer(), nullable=True),
+        sa.Column('new_input', sa.Integer(), nullable=True),
+        sa.Column('origin', sa.String(length=20), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index('ix_routing_events_version', 'routing_events', ['version'])
+    op.create_index('ix_routing_events_output_version', 'routing_events', ['output', 'version'])
+    op.create_index('ix_routing_events_created_at', 'routing_events', ['created_at'], postgresql_using='brin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_routing_events_created_at', table_name='routing_events')
+    op.drop_index('ix_routing_events_output_version', table_name='routing_events')
+    op.drop_index('ix_routing_events_version', table_name='routing_events')
+    op.drop_table('routing_events')
@@ -0,0 +1,27 @@
+"""add recent refresh jobs to refresh_status
+
+Revision ID: c9e4a2f7d815
+Revises: b6e2f0a9c318
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c9e4a2f7d815'
+down_revision: Union[str, None] = 'b6e2f0a9c318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('refresh_status', sa.Column('job_id', sa.String(32), nullable=True))
+    op.add_column('refresh_status', sa.Column('jobs_json', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('refresh_status', 'jobs_json')
+    op.drop_column('refresh_status', 'job_id')
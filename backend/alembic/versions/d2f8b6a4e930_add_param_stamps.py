@@ -0,0 +1,30 @@
+"""add param_stamps table
+
+Revision ID: d2f8b6a4e930
+Revises: c9e4a2f7d815
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'd2f8b6a4e930'
+down_revision: Union[str, None] = 'c9e4a2f7d815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'param_stamps',
+        sa.Column('frame', sa.String(255), primary_key=True),
+        sa.Column('varid', sa.String(64), primary_key=True),
+        sa.Column('stamp', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('param_stamps')
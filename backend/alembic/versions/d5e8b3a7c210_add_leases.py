@@ -0,0 +1,30 @@
+"""add leases table
+
+Revision ID: d5e8b3a7c210
+Revises: a7f3e2c14d90
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'd5e8b3a7c210'
+down_revision: Union[str, None] = 'a7f3e2c14d90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'leases',
+        sa.Column('name', sa.String(100), primary_key=True),
+        sa.Column('owner', sa.String(100), nullable=True),
+        sa.Column('expires_at', sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('leases')
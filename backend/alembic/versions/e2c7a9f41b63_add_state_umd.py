@@ -0,0 +1,94 @@
+"""move window UMD state from umd_json into state_umd
+
+Revision ID: e2c7a9f41b63
+Revises: d5e8b3a7c210
+Create Date: 2026-10-18
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'e2c7a9f41b63'
+down_revision: Union[str, None] = 'd5e8b3a7c210'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Varid → column, frozen here so later model changes don't alter this migration
+UMD_COLUMNS = {
+    "2708": "selection",
+    "2709": "text",
+    "2710": "box_colour",
+    "2711": "box_alpha",
+    "2712": "box_x",
+    "2713": "box_y",
+    "2714": "text_colour",
+    "2715": "text_alpha",
+    "2717": "text_size",
+    "2733": "padding",
+}
+
+
+def _typed(column: str, value):
+    if column == "text":
+        return None if value is None else str(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    state_umd = op.create_table(
+        'state_umd',
+        sa.Column('mv_id', sa.Integer(), primary_key=True),
+        sa.Column('window_index', sa.Integer(), primary_key=True),
+        sa.Column('layer', sa.Integer(), primary_key=True),
+        sa.Column('selection', sa.Integer(), nullable=True),
+        sa.Column('text', sa.Text(), nullable=True),
+        sa.Column('box_colour', sa.Integer(), nullable=True),
+        sa.Column('box_alpha', sa.Integer(), nullable=True),
+        sa.Column('box_x', sa.Integer(), nullable=True),
+        sa.Column('box_y', sa.Integer(), nullable=True),
+        sa.Column('text_colour', sa.Integer(), nullable=True),
+        sa.Column('text_alpha', sa.Integer(), nullable=True),
+        sa.Column('text_size', sa.Integer(), nullable=True),
+        sa.Column('padding', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now()),
+    )
+    op.create_index('ix_state_umd_selection', 'state_umd', ['selection'])
+
+    conn = op.get_bind()
+    rows = []
+    for mv_id, window_index, umd_json in conn.execute(sa.text(
+        "SELECT mv_id, window_index, umd_json FROM state_windows WHERE umd_json IS NOT NULL"
+    )):
+        for layer, data in enumerate(json.loads(umd_json)[:3]):
+            row = {column: _typed(column, data.get(varid)) for varid, column in UMD_COLUMNS.items()}
+            rows.append({"mv_id": mv_id, "window_index": window_index, "layer": layer, **row})
+    if rows:
+        op.bulk_insert(state_umd, rows)
+
+    op.drop_column('state_windows', 'umd_json')
+
+
+def downgrade() -> None:
+    op.add_column('state_windows', sa.Column('umd_json', sa.Text(), nullable=True))
+
+    conn = op.get_bind()
+    layers: dict[tuple[int, int], list[dict]] = {}
+    for row in conn.execute(sa.text("SELECT * FROM state_umd")).mappings():
+        umd = layers.setdefault((row["mv_id"], row["window_index"]), [{}, {}, {}])
+        if row["layer"] < 3:
+            umd[row["layer"]] = {varid: row[column] for varid, column in UMD_COLUMNS.items()}
+    for (mv_id, window_index), umd in layers.items():
+        conn.execute(
+            sa.text("UPDATE state_windows SET umd_json = :umd WHERE mv_id = :mv AND window_index = :win"),
+            {"umd": json.dumps(umd), "mv": mv_id, "win": window_index},
+        )
+
+    op.drop_index('ix_state_umd_selection', table_name='state_umd')
+    op.drop_table('state_umd')
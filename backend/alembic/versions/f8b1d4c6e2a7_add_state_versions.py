@@ -0,0 +1,39 @@
+"""add state version counter and per-row versions
+
+Revision ID: f8b1d4c6e2a7
+Revises: e2c7a9f41b63
+Create Date: 2026-10-18
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'f8b1d4c6e2a7'
+down_revision: Union[str, None] = 'e2c7a9f41b63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+STATE_TABLES = ('state_mv', 'state_windows', 'state_umd', 'state_routing')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'state_version',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('value', sa.BigInteger(), nullable=False, server_default='0'),
+    )
+    op.execute("INSERT INTO state_version (id, value) VALUES (1, 0)")
+
+    for table in STATE_TABLES:
+        op.add_column(table, sa.Column('version', sa.BigInteger(), nullable=False, server_default='0'))
+        op.create_index(f'ix_{table}_version', table, ['version'])
+
+
+def downgrade() -> None:
+    for table in STATE_TABLES:
+        op.drop_index(f'ix_{table}_version', table_name=table)
+        op.drop_column(table, 'version')
+    op.drop_table('state_version')
@@ -0,0 +1,195 @@
+"""
+Circuit breakers for device connections.
+
+Every device (Quartz router, NEXX frame) has one breaker shared by all clients in the
+process. Connection failures (refused, timed out, reset) count against it, once per
+call after its retries are used up; replies from the device, even error replies,
+count as success. After `threshold` consecutive
+failures the breaker opens and calls fail at once with DeviceUnavailableError instead
+of each waiting for its own timeout. After `reset_timeout` it lets a single probe
+through (half-open): success closes it, failure opens it again for twice as long, up
+to `max_reset_timeout`.
+
+`guarded()` runs a call through a breaker; idempotent reads may pass `retries` to be
+retried with jittered exponential backoff while the breaker stays closed. A failed
+half-open probe is not retried.
+"""
+import asyncio
+import math
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from app.config import settings
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DeviceUnavailableError(Exception):
+    """Raised without contacting the device while its breaker is open."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int, reset_timeout: float, max_reset_timeout: float):
+        self.name = name
+        self.threshold = threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._reset_timeout = reset_timeout
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _remaining(self) -> float:
+        return self._opened_at + self._reset_timeout - time.monotonic()
+
+    def _error(self, error: type[DeviceUnavailableError], remaining: float) -> DeviceUnavailableError:
+        return error(f"{self.name} is unreachable, retrying in {math.ceil(max(remaining, 1))}s", max(remaining, 1.0))
+
+    def check(self, error: type[DeviceUnavailableError] = DeviceUnavailableError) -> None:
+        """Raise `error` if calls to the device are blocked; otherwise let this call through."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            remaining = self._remaining()
+            if self._state == OPEN and remaining <= 0:
+                self._state = HALF_OPEN
+                self._probing = False
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+        raise self._error(error, remaining)
+
+    def precheck(self, error: type[DeviceUnavailableError] = DeviceUnavailableError) -> None:
+        """Raise `error` if a call now would be rejected, without taking the half-open probe."""
+        with self._lock:
+            remaining = self._remaining()
+            blocked = ((self._state == OPEN and remaining > 0)
+                       or (self._state == HALF_OPEN and self._probing))
+        if blocked:
+            raise self._error(error, remaining)
+
+    def success(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._reset_timeout = self.base_reset_timeout
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            if self._state == OPEN:
+                # A call that was already in flight when the breaker opened
+                return
+            self._failures += 1
+            if self._state == HALF_OPEN:
+                self._reset_timeout = min(self._reset_timeout * 2, self.max_reset_timeout)
+            elif self._failures < self.threshold:
+                return
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def release(self) -> None:
+        """Give up a probe that ended without an answer either way (e.g. cancelled)."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self._state, "failures": self._failures, "reset_timeout": self._reset_timeout}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(
+                name, settings.device_breaker_threshold,
+                settings.device_breaker_reset_timeout, settings.device_breaker_max_reset_timeout,
+            )
+        return breaker
+
+
+def breaker_stats() -> dict:
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, base * 2**attempt]."""
+    return random.uniform(0, settings.device_retry_backoff * 2 ** attempt)
+
+
+async def guarded(breaker: CircuitBreaker, call: Callable[[], Awaitable[T]],
+                  failure: type[Exception] | tuple[type[Exception], ...],
+                  unavailable: type[DeviceUnavailableError] = DeviceUnavailableError, retries: int = 0) -> T:
+    """Await `call()` through `breaker`; `failure` exceptions are retried `retries` times, then count against it."""
+    attempt = 0
+    while True:
+        breaker.check(unavailable)
+        try:
+            result = await call()
+        except failure:
+            if attempt >= retries or breaker.state != CLOSED:
+                breaker.failure()
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        except Exception:
+            # Any other error came from a device that answered
+            breaker.success()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.success()
+        return result
+
+
+def guarded_sync(breaker: CircuitBreaker, call: Callable[[], T],
+                 failure: type[Exception] | tuple[type[Exception], ...],
+                 unavailable: type[DeviceUnavailableError] = DeviceUnavailableError, retries: int = 0) -> T:
+    """Blocking counterpart of guarded()."""
+    attempt = 0
+    while True:
+        breaker.check(unavailable)
+        try:
+            result = call()
+        except failure:
+            if attempt >= retries or breaker.state != CLOSED:
+                breaker.failure()
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        except Exception:
+            breaker.success()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.success()
+        return result
@@ -0,0 +1,73 @@
+"""
+Dedicated event loop for device I/O.
+
+Pooled transports and schedulers that must be shared by every caller in the process
+live on this loop. Sync code (route handlers, services) submits coroutines with
+`run_sync`; coroutines running on any other loop hop over with `run_async`.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_loop: asyncio.AbstractEventLoop | None = None
+_thread: threading.Thread | None = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _thread = threading.Thread(target=_loop.run_forever, name="device-loop", daemon=True)
+            _thread.start()
+            logger.info("[Device Loop] Started")
+        return _loop
+
+
+def in_loop() -> bool:
+    try:
+        return asyncio.get_running_loop() is _loop
+    except RuntimeError:
+        return False
+
+
+def run_sync(coro: Coroutine[Any, Any, T], timeout: float | None = None) -> T:
+    """Run a coroutine on the device loop from a thread without a running event loop."""
+    if in_loop():
+        coro.close()
+        raise RuntimeError("run_sync() called from the device loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result(timeout)
+
+
+def submit(coro: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+    """Schedule a coroutine on the device loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+
+async def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    """Await a coroutine on the device loop from any event loop."""
+    if in_loop():
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, get_loop()))
+
+
+def stop() -> None:
+    global _loop, _thread
+    with _lock:
+        loop, thread = _loop, _thread
+        _loop, _thread = None, None
+    if loop is None:
+        return
+    loop.call_soon_threadsafe(loop.stop)
+    if thread:
+        thread.join(timeout=5)
+    loop.close()
+    logger.info("[Device Loop] Stopped")
@@ -1,8 +1,19 @@
 from urllib.parse import quote
+import asyncio
+import base64
+import copy
+import json
 import logging
+from typing import Any
 
 import httpx
 
+from app.clients import device_loop
+from app.clients.breaker import DeviceUnavailableError, get_breaker, guarded
+from app.clients.ratelimit import Priority, TokenBucketScheduler
+from app.config import settings
+from app.protocol_mappings import MAX_BATCH_PARAMS
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,8 +21,116 @@ class NEXXError(Exception):
     pass
 
 
-class NEXXClient:
-    def __init__(self, host: str, api_key: str | None = None, jwt: str | None = None):
+class NEXXConnectionError(NEXXError):
+    """The frame could not be reached; counts against its circuit breaker."""
+
+
+class NEXXUnavailableError(NEXXConnectionError, DeviceUnavailableError):
+    """The frame's circuit breaker is open; nothing was sent."""
+
+
+# One keep-alive connection pool for every NEXX client in the process. It lives on the
+# device loop and is closed from the app lifespan.
+_transport: httpx.AsyncClient | None = None
+
+
+def _get_transport() -> httpx.AsyncClient:
+    global _transport
+    if _transport is None or _transport.is_closed:
+        _transport = httpx.AsyncClient(
+            timeout=settings.nexx_timeout,
+            verify=False,
+            follow_redirects=False,
+            limits=httpx.Limits(
+                max_connections=settings.nexx_max_connections,
+                max_keepalive_connections=settings.nexx_max_keepalive_connections,
+                keepalive_expiry=30,
+            ),
+        )
+    return _transport
+
+
+async def _close_transport() -> None:
+    global _transport
+    if _transport is not None:
+        await _transport.aclose()
+        _transport = None
+    _limiters.clear()
+
+
+async def close_transport() -> None:
+    await device_loop.run_async(_close_transport())
+
+
+# Request budget per NEXX frame, shared by every client talking to it (device loop only)
+_limiters: dict[str, TokenBucketScheduler] = {}
+# This process's share of each frame's budget; app.worker switches to the worker share
+_rate_share = settings.nexx_web_rate_share
+
+
+def set_rate_share(share: float) -> None:
+    """Limit this process to `share` of each frame's request budget (call before any request)."""
+    global _rate_share
+    _rate_share = share
+
+
+def _get_limiter(base_url: str) -> TokenBucketScheduler:
+    limiter = _limiters.get(base_url)
+    if limiter is None:
+        limiter = _limiters[base_url] = TokenBucketScheduler(
+            settings.nexx_rate_limit * _rate_share, max(1, round(settings.nexx_rate_burst * _rate_share)),
+        )
+    return limiter
+
+
+async def _rate_limit_stats() -> dict:
+    return {base_url: limiter.stats() for base_url, limiter in _limiters.items()}
+
+
+def rate_limit_stats() -> dict:
+    """Queue depth and wait-time metrics of the NEXX rate limiters, per frame."""
+    return device_loop.run_sync(_rate_limit_stats())
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _parse_parameter(data: Any, varid: str) -> str | int:
+    # Handle different response formats from quartz_dump.py
+    if isinstance(data, dict):
+        if "value" in data:
+            # Format: {"id": "2700@...", "value": 120}
+            return data["value"]
+        elif varid in data:
+            # Format: {"2700": 120}
+            return data[varid]
+    # Fallback
+    return str(data) if data is not None else ""
+
+
+def _parse_parameters(data: Any) -> dict[str, str | int]:
+    # Parse response: could be list or dict (from quartz_dump.py)
+    if isinstance(data, list):
+        result = {}
+        for item in data:
+            if isinstance(item, dict):
+                varid = item.get("id", "").split("@")[0] if "@" in item.get("id", "") else item.get("id", "")
+                # Keep original type (int or str)
+                result[varid] = item.get("value")
+        return result
+    elif isinstance(data, dict):
+        # Direct dict format: {"2700": 120, "2701": 100}
+        return data
+    return {}
+
+
+class AsyncNEXXClient:
+    """NEXX REST client. Every request waits for a slot from the frame's rate limiter
+    at the client's priority (see with_priority)."""
+
+    def __init__(self, host: str, api_key: str | None = None, jwt: str | None = None,
+                 priority: Priority = Priority.INTERACTIVE):
         host = host.rstrip('/')
         if host.startswith('http://'):
             host = host[7:]
@@ -20,9 +139,15 @@ class NEXXClient:
         self.base_url = f"http://{host}/v.api/apis"
         self.api_key = api_key
         self.jwt = jwt
-        self._client = httpx.Client(timeout=10, verify=False, follow_redirects=False)
+        self.priority = priority
+        self.breaker = get_breaker(f"NEXX {host}")
         logger.info(f"[NEXX] Initialized with base_url: {self.base_url}")
 
+    def with_priority(self, priority: Priority) -> "AsyncNEXXClient":
+        clone = copy.copy(self)
+        clone.priority = priority
+        return clone
+
     def _headers(self) -> dict:
         headers = {}
         if self.api_key:
@@ -31,108 +156,144 @@ class NEXXClient:
             headers["jwt"] = self.jwt
         return headers
 
-    def get_parameter(self, varid: str) -> str | int:
-        url = f"{self.base_url}/EV/GET/parameter/{varid}"
-        logger.debug(f"[NEXX] GET {url}")
+    async def _get(self, url: str, check_error: bool = True, idempotent: bool = False) -> Any:
+        # Only reads are retried; a write that timed out may still have been applied
+        retries = settings.device_read_retries if idempotent else 0
+        return await guarded(self.breaker, lambda: device_loop.run_async(self._request(url, check_error)),
+                             NEXXConnectionError, NEXXUnavailableError, retries)
+
+    async def _request(self, url: str, check_error: bool) -> Any:
+        await _get_limiter(self.base_url).acquire(self.priority)
         try:
-            r = self._client.get(url, headers=self._headers())
+            r = await _get_transport().get(url, headers=self._headers())
             r.raise_for_status()
             data = r.json()
-            logger.debug(f"[NEXX] Response: {data}")
-            if isinstance(data, dict) and "error" in data:
-                raise NEXXError(data["error"])
-            # Handle different response formats from quartz_dump.py
-            if isinstance(data, dict):
-                if "value" in data:
-                    # Format: {"id": "2700@...", "value": 120}
-                    return data["value"]
-                elif varid in data:
-                    # Format: {"2700": 120}
-                    return data[varid]
-            # Fallback
-            return str(data) if data is not None else ""
         except httpx.HTTPStatusError as e:
             raise NEXXError(f"HTTP {e.response.status_code}: {e.response.text[:200]}")
+        except httpx.TransportError as e:
+            raise NEXXConnectionError(f"Request failed: {str(e) or type(e).__name__}")
         except Exception as e:
             raise NEXXError(f"Request failed: {str(e)}")
+        logger.debug(f"[NEXX] Response: {data}")
+        if check_error and isinstance(data, dict) and "error" in data:
+            raise NEXXError(data["error"])
+        return data
 
-    def get_parameters(self, varids: list[str]) -> dict[str, str | int]:
+    async def get_parameter(self, varid: str) -> str | int:
+        url = f"{self.base_url}/EV/GET/parameter/{varid}"
+        logger.debug(f"[NEXX] GET {url}")
+        return _parse_parameter(await self._get(url, idempotent=True), varid)
+
+    async def get_parameters(self, varids: list[str]) -> dict[str, str | int]:
+        """Read any number of parameters; lists over MAX_BATCH_PARAMS are split into
+        concurrent batch requests and the results merged."""
+        chunks = _chunks(list(dict.fromkeys(varids)), MAX_BATCH_PARAMS)
+        if len(chunks) == 1:
+            return await self._get_parameters_batch(chunks[0])
+        result: dict[str, str | int] = {}
+        for part in await asyncio.gather(*(self._get_parameters_batch(c) for c in chunks)):
+            result.update(part)
+        return result
+
+    async def _get_parameters_batch(self, varids: list[str]) -> dict[str, str | int]:
         joined = ",".join(varids)
         url = f"{self.base_url}/EV/GET/parameters/{joined}"
         logger.debug(f"[NEXX] GET {url}")
-        try:
-            r = self._client.get(url, headers=self._headers())
-            r.raise_for_status()
-            data = r.json()
-            logger.debug(f"[NEXX] Response: {data}")
-            if isinstance(data, dict) and "error" in data:
-                raise NEXXError(data["error"])
-            # Parse response: could be list or dict (from quartz_dump.py)
-            if isinstance(data, list):
-                result = {}
-                for item in data:
-                    if isinstance(item, dict):
-                        varid = item.get("id", "").split("@")[0] if "@" in item.get("id", "") else item.get("id", "")
-                        # Keep original type (int or str)
-                        result[varid] = item.get("value")
-                return result
-            elif isinstance(data, dict):
-                # Direct dict format: {"2700": 120, "2701": 100}
-                return data
-            return {}
-        except httpx.HTTPStatusError as e:
-            raise NEXXError(f"HTTP {e.response.status_code}: {e.response.text[:200]}")
-        except Exception as e:
-            raise NEXXError(f"Request failed: {str(e)}")
+        return _parse_parameters(await self._get(url, idempotent=True))
 
-    def set_parameter(self, varid: str, value: str) -> dict:
+    async def set_parameter(self, varid: str, value: str) -> dict:
         encoded_value = quote(str(value), safe="")
         url = f"{self.base_url}/EV/SET/parameter/{varid}/{encoded_value}"
         logger.info(f"[NEXX] SET {varid} = {value}")
-        try:
-            r = self._client.get(url, headers=self._headers())
-            r.raise_for_status()
-            data = r.json()
-            logger.debug(f"[NEXX] Response: {data}")
-            return data
-        except httpx.HTTPStatusError as e:
-            raise NEXXError(f"HTTP {e.response.status_code}: {e.response.text[:200]}")
-        except Exception as e:
-            raise NEXXError(f"Request failed: {str(e)}")
+        return await self._get(url, check_error=False)
 
-    def set_parameters(self, varids: list[str], values: list[str]) -> dict:
-        joined_ids = ",".join(varids)
-        joined_vals = ",".join(quote(str(v), safe="") for v in values)
+    async def set_parameters(self, varids: list[str], values: list[str]) -> dict:
+        """Write any number of parameters; a repeated varid keeps its last value. Lists over
+        MAX_BATCH_PARAMS are split into concurrent batch requests and the responses merged."""
+        changes = dict(zip(varids, values))
+        chunks = _chunks(list(changes.items()), MAX_BATCH_PARAMS)
+        if not chunks:
+            return {}
+        responses = await asyncio.gather(*(self._set_parameters_batch(c) for c in chunks))
+        if len(responses) == 1:
+            return responses[0]
+        merged: dict = {}
+        for response in responses:
+            if isinstance(response, dict):
+                merged.update(response)
+        return merged
+
+    async def _set_parameters_batch(self, changes: list[tuple[str, str]]) -> dict:
+        joined_ids = ",".join(varid for varid, _ in changes)
+        joined_vals = ",".join(quote(str(v), safe="") for _, v in changes)
         url = f"{self.base_url}/EV/SET/parameters/{joined_ids}/{joined_vals}"
-        logger.info(f"[NEXX] SET batch: {len(varids)} parameters")
-        try:
-            r = self._client.get(url, headers=self._headers())
-            r.raise_for_status()
-            data = r.json()
-            logger.debug(f"[NEXX] Response: {data}")
-            return data
-        except httpx.HTTPStatusError as e:
-            raise NEXXError(f"HTTP {e.response.status_code}: {e.response.text[:200]}")
-        except Exception as e:
-            raise NEXXError(f"Request failed: {str(e)}")
+        logger.info(f"[NEXX] SET batch: {len(changes)} parameters")
+        return await self._get(url, check_error=False)
 
-    def jwt_create(self, username: str, password: str) -> str:
-        import base64, json
+    async def jwt_create(self, username: str, password: str) -> str:
         creds = json.dumps({"username": username, "password": password})
         b64 = base64.b64encode(creds.encode()).decode()
-        r = self._client.get(f"{self.base_url}/BT/JWTCREATE/{b64}")
-        data = r.json()
+        data = await self._get(f"{self.base_url}/BT/JWTCREATE/{b64}", check_error=False)
         if data.get("status") != "success":
             raise NEXXError(f"JWT creation failed: {data}")
         self.jwt = data["jwt"]
         return data["jwt"]
 
-    def jwt_refresh(self) -> str:
+    async def jwt_refresh(self) -> str:
         if not self.jwt:
             raise NEXXError("No JWT to refresh")
-        r = self._client.get(f"{self.base_url}/BT/JWTREFRESH/{self.jwt}")
-        data = r.json()
+        data = await self._get(f"{self.base_url}/BT/JWTREFRESH/{self.jwt}", check_error=False)
         if data.get("status") != "success":
             raise NEXXError(f"JWT refresh failed: {data}")
         self.jwt = data["jwt"]
         return data["jwt"]
+
+
+class NEXXClient:
+    """Blocking facade over AsyncNEXXClient for sync route handlers and services.
+
+    Calls run on the device loop, so sync and async callers share one connection pool.
+    """
+
+    def __init__(self, host: str, api_key: str | None = None, jwt: str | None = None,
+                 priority: Priority = Priority.INTERACTIVE):
+        self.aio = AsyncNEXXClient(host, api_key=api_key, jwt=jwt, priority=priority)
+
+    def with_priority(self, priority: Priority) -> "NEXXClient":
+        clone = copy.copy(self)
+        clone.aio = self.aio.with_priority(priority)
+        return clone
+
+    @property
+    def base_url(self) -> str:
+        return self.aio.base_url
+
+    def check_available(self) -> None:
+        """Raise NEXXUnavailableError while the frame's circuit breaker is open."""
+        self.aio.breaker.precheck(NEXXUnavailableError)
+
+    @property
+    def api_key(self) -> str | None:
+        return self.aio.api_key
+
+    @property
+    def jwt(self) -> str | None:
+        return self.aio.jwt
+
+    def get_parameter(self, varid: str) -> str | int:
+        return device_loop.run_sync(self.aio.get_parameter(varid))
+
+    def get_parameters(self, varids: list[str]) -> dict[str, str | int]:
+        return device_loop.run_sync(self.aio.get_parameters(varids))
+
+    def set_parameter(self, varid: str, value: str) -> dict:
+        return device_loop.run_sync(self.aio.set_parameter(varid, value))
+
+    def set_parameters(self, varids: list[str], values: list[str]) -> dict:
+        return device_loop.run_sync(self.aio.set_parameters(varids, values))
+
+    def jwt_create(self, username: str, password: str) -> str:
+        return device_loop.run_sync(self.aio.jwt_create(username, password))
+
+    def jwt_refresh(self) -> str:
+        return device_loop.run_sync(self.aio.jwt_refresh())
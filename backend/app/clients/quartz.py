@@ -1,5 +1,13 @@
+import asyncio
+import queue
+import re
 import socket
 import logging
+import weakref
+from collections import deque
+
+from app.clients.breaker import DeviceUnavailableError, get_breaker, guarded, guarded_sync
+from app.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -8,61 +16,636 @@ class QuartzError(Exception):
     pass
 
 
+class QuartzConnectionError(QuartzError):
+    """The router could not be reached; counts against its circuit breaker."""
+
+
+class QuartzUnavailableError(QuartzConnectionError, DeviceUnavailableError):
+    """The router's circuit breaker is open; nothing was sent."""
+
+
+def _is_read(command: str) -> bool:
+    # Everything but .SV (switch) only reads, so it is safe to retry
+    return not command.startswith(".S")
+
+
+def _parse_name(response: str, error: str) -> str:
+    if not response:
+        # Timed out, or closed without a reply
+        raise QuartzError(f"{error}: no reply")
+    if response.startswith(".E"):
+        raise QuartzError(error)
+    # .RAD{n},{name} / .RAS{n},{name}
+    parts = response.split(",", 1)
+    return parts[1] if len(parts) > 1 else ""
+
+
+def _parse_routing(response: str, error: str) -> int:
+    if not response:
+        raise QuartzError(f"{error}: no reply")
+    if response.startswith(".E"):
+        raise QuartzError(error)
+    # .AV{output},{input}
+    parts = response.split(",", 1)
+    try:
+        return int(parts[1])
+    except (IndexError, ValueError):
+        raise QuartzError(f"{error}: unexpected reply {response!r}")
+
+
+def _check_switch(response: str, output: int, input_number: int) -> None:
+    if response.startswith(".E"):
+        raise QuartzError(f"Switch failed: output={output}, input={input_number}")
+    if response.startswith(".B"):
+        raise QuartzError(f"Output {output} is locked")
+
+
+_TERMINATOR_RE = re.compile(rb"[\r\n]")
+
+
+class QuartzFramer:
+    """Incremental splitter for router output.
+
+    Routers terminate replies with CR, LF or CRLF; all three are accepted and blank
+    lines are skipped. A bare .A/.E/.B sent without terminator is split from a reply
+    that follows it. Data is appended in place and consumed lines are trimmed from
+    the front, so the buffer only ever holds the unparsed tail.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes | memoryview) -> None:
+        self._buf.extend(data)
+
+    def next_line(self) -> str | None:
+        while True:
+            if self._buf[:3] in (b".A.", b".E.", b".B."):
+                line = self._buf[:2].decode("ascii")
+                del self._buf[:2]
+                return line
+            m = _TERMINATOR_RE.search(self._buf)
+            if not m:
+                return None
+            end = m.start()
+            skip = end
+            while skip < len(self._buf) and self._buf[skip] in (0x0D, 0x0A):
+                skip += 1
+            line = self._buf[:end].decode("ascii", errors="replace").strip()
+            del self._buf[:skip]
+            if line:
+                return line
+
+    def partial(self) -> str:
+        return self._buf.decode("ascii", errors="replace").strip()
+
+    def take_partial(self) -> str:
+        data = self.partial()
+        self._buf.clear()
+        return data
+
+
+def _is_reply(command: str, line: str) -> bool:
+    """Whether a complete line answers `command` rather than being an unsolicited update."""
+    if line.startswith(".U"):
+        # Some routers confirm a take with the resulting update instead of .A
+        return command.startswith(".SV") and line[3:] == command[3:]
+    return True
+
+
+# Replies that name what they answer: .IV{n} → .AV{n},..., .RS{n} → .RAS{n},..., .RD{n} → .RAD{n},...
+_ADDRESSED_REPLIES = {".IV": ".AV", ".RS": ".RAS", ".RD": ".RAD"}
+
+
+def _answers(command: str, line: str) -> bool:
+    """Whether `line` is the numbered reply to `command`."""
+    prefix = _ADDRESSED_REPLIES.get(command[:3])
+    return bool(prefix) and line.startswith(prefix) and line[len(prefix):].split(",", 1)[0] == command[3:]
+
+
+def _answers_other(command: str, line: str) -> bool:
+    """Whether `line` is the reply to the same kind of command for another number."""
+    prefix = _ADDRESSED_REPLIES.get(command[:3])
+    return bool(prefix) and line.startswith(prefix) and not _answers(command, line)
+
+
+def _is_partial_reply(command: str, data: str) -> bool:
+    """Whether unterminated data is already a complete reply (.E/.B for any command, .A for .SV)."""
+    if data in (".E", ".B"):
+        return True
+    return command.startswith(".SV") and data == ".A"
+
+
+class _Connection:
+    """Single TCP connection to the router with a framed reader."""
+
+    def __init__(self, host: str, port: int, connect_timeout: float, read_timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=connect_timeout)
+        self.sock.settimeout(read_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.framer = QuartzFramer()
+        self._chunk = bytearray(4096)
+        self._view = memoryview(self._chunk)
+        self.closed = False
+        self.reused = False
+
+    def send(self, commands: list[str]) -> None:
+        self.sock.sendall("".join(f"{c}\r\n" for c in commands).encode("ascii"))
+
+    def read_reply(self, command: str) -> str | None:
+        """Reply to `command`, or None once the router has closed the connection without one."""
+        while True:
+            line = self.framer.next_line()
+            if line is not None:
+                if _is_reply(command, line):
+                    return line
+                continue
+            partial = self.framer.partial()
+            if partial and _is_partial_reply(command, partial):
+                return self.framer.take_partial()
+            if self.closed:
+                return self.framer.take_partial() or None
+            n = self.sock.recv_into(self._chunk)
+            if n == 0:
+                self.closed = True
+            else:
+                self.framer.feed(self._view[:n])
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
 class QuartzClient:
-    def __init__(self, host: str, port: int = 6543, timeout: float = 1.0):
+    def __init__(self, host: str, port: int = 6543, timeout: float = 1.0,
+                 pool_size: int = 10, pipeline_depth: int = 32,
+                 connect_timeout: float | None = None, read_timeout: float | None = None):
         self.host = host
         self.port = port
         self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.pool_size = pool_size
+        self.pipeline_depth = pipeline_depth
+        self._idle: queue.LifoQueue[_Connection] = queue.LifoQueue(maxsize=pool_size)
+        self.breaker = get_breaker(f"Quartz {host}:{port}")
+        # None until the router shows whether it keeps connections open after a reply.
+        # Routers that follow the "one command per connection" mode fall back to one-shot sockets.
+        self._keepalive: bool | None = None
+
+    def _connect(self) -> _Connection:
+        try:
+            return _Connection(self.host, self.port, self.connect_timeout, self.read_timeout)
+        except OSError as e:
+            raise QuartzConnectionError(f"Connection to {self.host}:{self.port} failed: {e}")
+
+    def _acquire(self) -> _Connection:
+        try:
+            conn = self._idle.get_nowait()
+            conn.reused = True
+            return conn
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn: _Connection) -> None:
+        if conn.closed or self._keepalive is False:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
 
     def _send(self, command: str) -> str:
-        logger.debug(f"[Quartz] CMD: {command}")
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.settimeout(self.timeout)
-            sock.connect((self.host, self.port))
-            sock.sendall(f"{command}\r\n".encode("ascii"))
-            data = b""
-            while True:
+        return self._send_many([command])[0]
+
+    def _send_many(self, commands: list[str]) -> list[str]:
+        retries = settings.device_read_retries if all(_is_read(c) for c in commands) else 0
+        return guarded_sync(self.breaker, lambda: self._send_many_once(commands),
+                            QuartzConnectionError, QuartzUnavailableError, retries)
+
+    def _send_many_once(self, commands: list[str]) -> list[str]:
+        """Send commands and return one reply per command, in order.
+
+        Commands are pipelined over a pooled connection in groups of `pipeline_depth`;
+        replies are matched to commands line by line.
+        """
+        replies: list[str] = []
+        pending = list(commands)
+        while pending:
+            if self._keepalive is False:
+                replies.append(self._send_oneshot(pending.pop(0)))
+                continue
+            batch = pending[:self.pipeline_depth]
+            got = self._pipeline(batch)
+            replies.extend(got)
+            del pending[:len(got)]
+        return replies
+
+    def _pipeline(self, batch: list[str]) -> list[str]:
+        conn = self._acquire()
+        try:
+            try:
+                conn.send(batch)
+            except OSError:
+                if not conn.reused:
+                    raise
+                # Idle connection was dropped by the router; retry once on a fresh socket
+                conn.close()
+                conn = self._connect()
+                conn.send(batch)
+
+            replies: list[str] = []
+            carried: str | None = None
+            for i, command in enumerate(batch):
+                logger.debug(f"[Quartz] CMD: {command}")
                 try:
-                    chunk = sock.recv(1024)
-                    if not chunk:
-                        break
-                    data += chunk
-                    if b"\r\n" in data:
-                        break
+                    line = carried if carried is not None else conn.read_reply(command)
+                    carried = None
+                    if line is not None and _answers_other(command, line) \
+                            and any(_answers(c, line) for c in batch[i + 1:]):
+                        # The router skipped this command; the line answers a later one
+                        replies.append("")
+                        carried = line
+                        continue
                 except socket.timeout:
+                    # Connection state is unknown after a missed reply; drop it
+                    replies.append("")
+                    conn.close()
+                    break
+                if line is None:
+                    if not replies and conn.reused:
+                        # Stale pooled connection closed before answering: resend on a new one
+                        conn.close()
+                        return self._pipeline(batch)
+                    if not replies:
+                        # Closed without a reply: acknowledged by close (e.g. .SV)
+                        replies.append("")
+                    if self._keepalive is None:
+                        logger.info(f"[Quartz] {self.host}:{self.port} closes connections after each command, using one-shot mode")
+                    self._keepalive = False
                     break
-        response = data.decode("ascii").strip()
+                logger.debug(f"[Quartz] RSP: {line}")
+                replies.append(line)
+            else:
+                if self._keepalive is None:
+                    self._keepalive = True
+            return replies
+        except OSError as e:
+            conn.close()
+            raise QuartzConnectionError(f"Connection to {self.host}:{self.port} failed: {e}")
+        finally:
+            self._release(conn)
+
+    def _send_oneshot(self, command: str) -> str:
+        logger.debug(f"[Quartz] CMD: {command}")
+        conn = self._connect()
+        try:
+            conn.send([command])
+            line = conn.read_reply(command)
+        except socket.timeout:
+            line = ""
+        except OSError as e:
+            raise QuartzConnectionError(f"Connection to {self.host}:{self.port} failed: {e}")
+        finally:
+            conn.close()
+        response = line or ""
         logger.debug(f"[Quartz] RSP: {response}")
         return response
 
     def read_input_name(self, input_number: int) -> str:
-        response = self._send(f".RD{input_number}")
-        if response.startswith(".E"):
-            raise QuartzError(f"Error reading input {input_number}")
-        # .RAD{n},{name}
-        parts = response.split(",", 1)
-        return parts[1] if len(parts) > 1 else ""
+        return _parse_name(self._send(f".RD{input_number}"), f"Error reading input {input_number}")
 
     def read_output_name(self, output_number: int) -> str:
-        response = self._send(f".RS{output_number}")
-        if response.startswith(".E"):
-            raise QuartzError(f"Error reading output {output_number}")
-        # .RAS{n},{name}
-        parts = response.split(",", 1)
-        return parts[1] if len(parts) > 1 else ""
+        return _parse_name(self._send(f".RS{output_number}"), f"Error reading output {output_number}")
 
     def read_routing(self, output_number: int) -> int:
-        response = self._send(f".IV{output_number}")
-        if response.startswith(".E"):
-            raise QuartzError(f"Error reading routing for output {output_number}")
-        # .AV{output},{input}
-        parts = response.split(",", 1)
-        return int(parts[1]) if len(parts) > 1 else -1
+        return _parse_routing(self._send(f".IV{output_number}"),
+                                   f"Error reading routing for output {output_number}")
+
+    def read_output_names(self, output_numbers: list[int]) -> dict[int, str | QuartzError]:
+        """Pipelined .RS for many outputs; per-output failures are returned, not raised."""
+        replies = self._send_many([f".RS{n}" for n in output_numbers])
+        results: dict[int, str | QuartzError] = {}
+        for n, response in zip(output_numbers, replies):
+            try:
+                results[n] = _parse_name(response, f"Error reading output {n}")
+            except QuartzError as e:
+                results[n] = e
+        return results
+
+    def read_routings(self, output_numbers: list[int]) -> dict[int, int | QuartzError]:
+        """Pipelined .IV for many outputs; per-output failures are returned, not raised."""
+        replies = self._send_many([f".IV{n}" for n in output_numbers])
+        results: dict[int, int | QuartzError] = {}
+        for n, response in zip(output_numbers, replies):
+            try:
+                results[n] = _parse_routing(response, f"Error reading routing for output {n}")
+            except QuartzError as e:
+                results[n] = e
+        return results
 
     def switch(self, output: int, input_number: int) -> bool:
-        response = self._send(f".SV{output},{input_number}")
-        if response.startswith(".E"):
-            raise QuartzError(f"Switch failed: output={output}, input={input_number}")
-        if response.startswith(".B"):
-            raise QuartzError(f"Output {output} is locked")
+        _check_switch(self._send(f".SV{output},{input_number}"), output, input_number)
+        return True
+
+
+class _AsyncConnection:
+    """Pipelined asyncio connection: replies resolve pending commands in FIFO order.
+
+    The router answers in order, so only the command at the front of the pipeline is
+    timed: it gets `timeout` from when it reaches the front. If it runs out it resolves
+    to "" (no reply) and the connection is closed, since later replies can no longer be
+    matched. A pending command resolves to None when the connection closes before its reply.
+    """
+
+    def __init__(self, client: "AsyncQuartzClient", reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 timeout: float):
+        self.client = client
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.framer = QuartzFramer()
+        self.pending: deque[tuple[str, asyncio.Future]] = deque()
+        self.replies = 0
+        self.closed = False
+        self._timer: asyncio.TimerHandle | None = None
+        self._task = asyncio.create_task(self._read_loop())
+
+    async def request(self, command: str) -> str | None:
+        if self.closed:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((command, future))
+        if len(self.pending) == 1:
+            self._start_timer()
+        self.writer.write(f"{command}\r\n".encode("ascii"))
+        try:
+            await self.writer.drain()
+            return await future
+        except OSError:
+            self.close()
+            return None
+
+    def _start_timer(self) -> None:
+        self._timer = asyncio.get_running_loop().call_later(self.timeout, self._timed_out)
+
+    def _timed_out(self) -> None:
+        self._timer = None
+        logger.warning(f"[Quartz] No reply to {self.pending[0][0]} within {self.timeout}s, dropping connection")
+        self._resolve("")
+        self.close()
+
+    def _resolve(self, reply: str | None) -> None:
+        _, future = self.pending.popleft()
+        if not future.done():
+            future.set_result(reply)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.pending and not self.closed:
+            self._start_timer()
+
+    def _drain_framer(self) -> None:
+        while True:
+            line = self.framer.next_line()
+            if line is None:
+                break
+            # Lines that arrive with nothing pending, or that are not the reply, are unsolicited updates
+            if self.pending and _is_reply(self.pending[0][0], line):
+                if _answers_other(self.pending[0][0], line) \
+                        and any(_answers(c, line) for c, _ in list(self.pending)[1:]):
+                    # The router skipped the commands before the one this line answers
+                    while not _answers(self.pending[0][0], line):
+                        self._resolve("")
+                self.replies += 1
+                self._resolve(line)
+        if self.pending:
+            partial = self.framer.partial()
+            if partial and _is_partial_reply(self.pending[0][0], partial):
+                self.replies += 1
+                self._resolve(self.framer.take_partial())
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                data = await self.reader.read(4096)
+                if not data:
+                    break
+                self.framer.feed(data)
+                self._drain_framer()
+        except OSError:
+            pass
+        finally:
+            if self.pending:
+                # Closed with commands outstanding: the router works one command per connection
+                self.client._mark_oneshot()
+                if self.replies == 0:
+                    # Acknowledged by close (e.g. .SV), or a final reply without terminator
+                    self._resolve(self.framer.take_partial())
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while self.pending:
+            self._resolve(None)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.writer.close()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    async def wait_closed(self) -> None:
+        """Wait for the reader task and the socket after close()."""
+        await asyncio.gather(self._task, self.writer.wait_closed(), return_exceptions=True)
+
+
+class _LoopState:
+    """Connections and limits of an AsyncQuartzClient within one event loop."""
+
+    def __init__(self, max_in_flight: int):
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.connect_lock = asyncio.Lock()
+        self.pool: list[_AsyncConnection] = []
+
+
+class AsyncQuartzClient:
+    """asyncio counterpart of QuartzClient.
+
+    Commands are pipelined over a few persistent connections, each taking the next command
+    while it has fewer than `pipeline_depth` outstanding; `max_in_flight` bounds the number
+    of outstanding commands overall. Connections belong to the event loop that opened them,
+    so each loop using the client (e.g. asyncio.run in a worker thread) gets its own set.
+    """
+
+    def __init__(self, host: str, port: int = 6543, timeout: float = 1.0,
+                 max_in_flight: int = 200, connections: int = 4, pipeline_depth: int = 64,
+                 connect_timeout: float | None = None, read_timeout: float | None = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.max_in_flight = max_in_flight
+        self.connections = connections
+        self.pipeline_depth = pipeline_depth
+        self._states: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState] = weakref.WeakKeyDictionary()
+        self._keepalive: bool | None = None
+        self.breaker = get_breaker(f"Quartz {host}:{port}")
+
+    async def __aenter__(self) -> "AsyncQuartzClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.aclose()
+
+    def _state(self) -> _LoopState:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = _LoopState(min(self.max_in_flight, self.connections * self.pipeline_depth))
+        return state
+
+    def _mark_oneshot(self) -> None:
+        if self._keepalive is not False:
+            logger.info(f"[Quartz] {self.host}:{self.port} closes connections after each command, using one-shot mode")
+        self._keepalive = False
+
+    async def aclose(self) -> None:
+        """Close the connections opened from the running loop."""
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state:
+            for conn in state.pool:
+                conn.close()
+            await asyncio.gather(*(conn.wait_closed() for conn in state.pool))
+
+    async def _open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise QuartzConnectionError(f"Connection to {self.host}:{self.port} failed: {e or 'timeout'}")
+
+    async def _get_connection(self, state: _LoopState) -> _AsyncConnection:
+        async with state.connect_lock:
+            state.pool = [c for c in state.pool if not c.closed]
+            # The semaphore keeps the least loaded connection below pipeline_depth
+            conn = min(state.pool, key=lambda c: len(c.pending), default=None)
+            if conn is None or (conn.pending and len(state.pool) < self.connections):
+                reader, writer = await self._open()
+                conn = _AsyncConnection(self, reader, writer, self.read_timeout)
+                state.pool.append(conn)
+            return conn
+
+    def check_available(self) -> None:
+        """Raise QuartzUnavailableError while the router's circuit breaker is open."""
+        self.breaker.precheck(QuartzUnavailableError)
+
+    async def _send(self, command: str) -> str:
+        retries = settings.device_read_retries if _is_read(command) else 0
+        return await guarded(self.breaker, lambda: self._send_once(command),
+                             QuartzConnectionError, QuartzUnavailableError, retries)
+
+    async def _send_once(self, command: str) -> str:
+        state = self._state()
+        async with state.semaphore:
+            logger.debug(f"[Quartz] CMD: {command}")
+            response = None
+            for _ in range(2):
+                if self._keepalive is False:
+                    break
+                conn = await self._get_connection(state)
+                response = await conn.request(command)
+                if response is not None:
+                    if self._keepalive is None and not conn.closed:
+                        self._keepalive = True
+                    break
+                # Connection dropped before the reply (e.g. another command timed out): resend once
+            if response is None:
+                if self._keepalive is not False:
+                    raise QuartzConnectionError(f"Connection to {self.host}:{self.port} lost")
+                response = await self._send_oneshot(command)
+            logger.debug(f"[Quartz] RSP: {response}")
+            return response
+
+    async def _send_oneshot(self, command: str) -> str:
+        reader, writer = await self._open()
+        try:
+            writer.write(f"{command}\r\n".encode("ascii"))
+            await writer.drain()
+            framer = QuartzFramer()
+            deadline = asyncio.get_running_loop().time() + self.read_timeout
+            while True:
+                line = framer.next_line()
+                if line is not None:
+                    if _is_reply(command, line):
+                        return line
+                    continue
+                partial = framer.partial()
+                if partial and _is_partial_reply(command, partial):
+                    return partial
+                remaining = deadline - asyncio.get_running_loop().time()
+                data = await asyncio.wait_for(reader.read(4096), max(remaining, 0))
+                if not data:
+                    # Closed by the router: acknowledgement by close, or a final unterminated reply
+                    return framer.take_partial()
+                framer.feed(data)
+        except (asyncio.TimeoutError, OSError):
+            return ""
+        finally:
+            writer.close()
+
+    async def _gather(self, commands: list[str]) -> list[str | QuartzError]:
+        return await asyncio.gather(*(self._send(c) for c in commands), return_exceptions=True)
+
+    async def read_input_name(self, input_number: int) -> str:
+        return _parse_name(await self._send(f".RD{input_number}"), f"Error reading input {input_number}")
+
+    async def read_output_name(self, output_number: int) -> str:
+        return _parse_name(await self._send(f".RS{output_number}"), f"Error reading output {output_number}")
+
+    async def read_routing(self, output_number: int) -> int:
+        return _parse_routing(await self._send(f".IV{output_number}"),
+                              f"Error reading routing for output {output_number}")
+
+    async def read_output_names(self, output_numbers: list[int]) -> dict[int, str | QuartzError]:
+        """Concurrent .RS for many outputs; per-output failures are returned, not raised."""
+        replies = await self._gather([f".RS{n}" for n in output_numbers])
+        results: dict[int, str | QuartzError] = {}
+        for n, response in zip(output_numbers, replies):
+            try:
+                if isinstance(response, BaseException):
+                    raise response
+                results[n] = _parse_name(response, f"Error reading output {n}")
+            except QuartzError as e:
+                results[n] = e
+        return results
+
+    async def read_routings(self, output_numbers: list[int]) -> dict[int, int | QuartzError]:
+        """Concurrent .IV for many outputs; per-output failures are returned, not raised."""
+        replies = await self._gather([f".IV{n}" for n in output_numbers])
+        results: dict[int, int | QuartzError] = {}
+        for n, response in zip(output_numbers, replies):
+            try:
+                if isinstance(response, BaseException):
+                    raise response
+                results[n] = _parse_routing(response, f"Error reading routing for output {n}")
+            except QuartzError as e:
+                results[n] = e
+        return results
+
+    async def switch(self, output: int, input_number: int) -> bool:
+        _check_switch(await self._send(f".SV{output},{input_number}"), output, input_number)
         return True
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from collections import deque
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class _ClassStats:
+    def __init__(self):
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float) -> None:
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class TokenBucketScheduler:
+    """Token bucket that hands out request slots in strict priority order.
+
+    Tokens refill at `rate` per second up to `burst`. Waiters are queued per priority;
+    an INTERACTIVE waiter is always served before any BACKGROUND one. Must be used from
+    a single event loop.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._queues: dict[Priority, deque[tuple[asyncio.Future, float]]] = {p: deque() for p in Priority}
+        self._stats = {p: _ClassStats() for p in Priority}
+        self._dispatcher: asyncio.Task | None = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _waiting(self) -> bool:
+        return any(self._queues[p] for p in Priority)
+
+    async def acquire(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        self._refill()
+        if self._tokens >= 1 and not self._waiting():
+            self._tokens -= 1
+            self._stats[priority].record(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic())
+        self._queues[priority].append(entry)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        try:
+            await future
+        except asyncio.CancelledError:
+            if entry in self._queues[priority]:
+                self._queues[priority].remove(entry)
+            raise
+
+    async def _dispatch(self) -> None:
+        while self._waiting():
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            for priority in Priority:
+                if self._queues[priority]:
+                    future, queued_at = self._queues[priority].popleft()
+                    if not future.done():
+                        self._tokens -= 1
+                        self._stats[priority].record(time.monotonic() - queued_at)
+                        future.set_result(None)
+                    break
+
+    def stats(self) -> dict:
+        self._refill()
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "tokens": round(self._tokens, 2),
+            "classes": {
+                p.name.lower(): {
+                    "queue_depth": len(self._queues[p]),
+                    "granted": self._stats[p].granted,
+                    "wait_avg_ms": round(self._stats[p].total_wait / self._stats[p].granted * 1000, 1)
+                    if self._stats[p].granted else 0.0,
+                    "wait_max_ms": round(self._stats[p].max_wait * 1000, 1),
+                }
+                for p in Priority
+            },
+        }
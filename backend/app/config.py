@@ -5,6 +5,38 @@ class Settings(BaseSettings):
     database_url: str = "postgresql://mvcontrol:mvcontrol@db:5432/mvcontrol"
     secret_key: str = "change-me-in-production"
     session_expire_hours: int = 24
+    quartz_max_in_flight: int = 200
+    quartz_connections: int = 4
+    quartz_listener_enabled: bool = True
+    nexx_timeout: float = 10.0
+    nexx_max_connections: int = 8
+    nexx_max_keepalive_connections: int = 8
+    # Request budget of a NEXX frame (req/s and burst), split between the processes that
+    # talk to it: the web app uses the web share and app.worker the worker share, so
+    # together they stay within the budget. Shares should add up to at most 1.
+    nexx_rate_limit: float = 8.0
+    nexx_rate_burst: int = 4
+    nexx_web_rate_share: float = 0.6
+    nexx_worker_rate_share: float = 0.4
+    nexx_sync_concurrency: int = 4
+    # Background refresh intervals in seconds (app.worker); 0 disables a subsystem
+    refresh_quartz_labels_interval: float = 300.0
+    refresh_quartz_routing_interval: float = 60.0
+    refresh_nexx_params_interval: float = 60.0
+    refresh_nexx_windows_interval: float = 300.0
+    refresh_stagger_seconds: float = 5.0
+    refresh_lease_ttl: float = 30.0
+    # Circuit breaker per device: opens after this many consecutive connection failures,
+    # probes again after the reset timeout (doubling up to the max while probes fail)
+    device_breaker_threshold: int = 3
+    device_breaker_reset_timeout: float = 5.0
+    device_breaker_max_reset_timeout: float = 60.0
+    # Retries of idempotent reads after a connection failure, with jittered backoff from this base (s)
+    device_read_retries: int = 2
+    device_retry_backoff: float = 0.2
+    # routing_events older than this are purged every purge interval (app.worker); 0 keeps them
+    routing_journal_retention_days: int = 30
+    routing_journal_purge_interval: float = 3600.0
 
     class Config:
         env_file = ".env"
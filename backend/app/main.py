@@ -1,10 +1,22 @@
 import logging
+import math
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pathlib import Path
 
-from app.routers import auth, users, sources, multiviewers, routing, refresh, integrations, presets
+from app.clients import device_loop
+from app.clients.breaker import DeviceUnavailableError
+from app.clients.nexx import NEXXConnectionError, close_transport as close_nexx_transport
+from app.clients.quartz import QuartzConnectionError
+from app.config import settings
+from app.services import notify, routing_journal
+from app.services.events import hub as event_hub
+from app.services.integration import registry as client_registry
+from app.services.quartz_listener import QuartzListener
+from app.routers import auth, users, sources, multiviewers, routing, refresh, integrations, presets, events
 
 # Configure logging
 logging.basicConfig(
@@ -12,7 +24,35 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-app = FastAPI(title="MV-Control", version="0.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    notify.start()
+    event_hub.start()
+    listener = QuartzListener() if settings.quartz_listener_enabled else None
+    if listener:
+        listener.start()
+    yield
+    if listener:
+        await listener.stop()
+    await client_registry.aclose()
+    await close_nexx_transport()
+    device_loop.stop()
+    routing_journal.writer.stop()
+    event_hub.stop()
+    notify.stop()
+
+
+app = FastAPI(title="MV-Control", version="0.1.0", lifespan=lifespan)
+
+
+@app.exception_handler(QuartzConnectionError)
+@app.exception_handler(NEXXConnectionError)
+@app.exception_handler(DeviceUnavailableError)
+async def device_unreachable(request: Request, exc: Exception):
+    # An open circuit breaker answers at once and says when the device is tried again
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if isinstance(exc, DeviceUnavailableError) else None
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers=headers)
 
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -22,6 +62,7 @@ app.include_router(routing.router)
 app.include_router(refresh.router)
 app.include_router(integrations.router)
 app.include_router(presets.router)
+app.include_router(events.router)
 
 static_dir = Path(__file__).parent.parent / "static"
 if static_dir.exists():
@@ -1,4 +1,4 @@
-from sqlalchemy import String
+from sqlalchemy import BigInteger, String
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database import Base
@@ -10,6 +10,7 @@ class Source(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     quartz_input: Mapped[int] = mapped_column(unique=True)
     label: Mapped[str] = mapped_column(String(100), default="")
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", index=True)
 
 
 class UserAccessSource(Base):
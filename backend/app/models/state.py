@@ -1,9 +1,28 @@
 from datetime import datetime
 
-from sqlalchemy import Text, DateTime, Boolean, String, func
+from sqlalchemy import BigInteger, Integer, Text, DateTime, Boolean, String, Index, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database import Base
+from app.protocol_mappings import (
+    VARID_UMD_SELECTION, VARID_UMD_TEXT, VARID_UMD_BOX_COLOUR, VARID_UMD_BOX_ALPHA,
+    VARID_UMD_BOX_X, VARID_UMD_BOX_Y, VARID_UMD_TEXT_COLOUR, VARID_UMD_TEXT_ALPHA,
+    VARID_UMD_TEXT_SIZE, VARID_UMD_PADDING,
+)
+
+# UMD varid → StateUMD column
+UMD_COLUMNS = {
+    VARID_UMD_SELECTION: "selection",
+    VARID_UMD_TEXT: "text",
+    VARID_UMD_BOX_COLOUR: "box_colour",
+    VARID_UMD_BOX_ALPHA: "box_alpha",
+    VARID_UMD_BOX_X: "box_x",
+    VARID_UMD_BOX_Y: "box_y",
+    VARID_UMD_TEXT_COLOUR: "text_colour",
+    VARID_UMD_TEXT_ALPHA: "text_alpha",
+    VARID_UMD_TEXT_SIZE: "text_size",
+    VARID_UMD_PADDING: "padding",
+}
 
 
 class StateMV(Base):
@@ -15,6 +34,7 @@ class StateMV(Base):
     outer_border: Mapped[int | None] = mapped_column(nullable=True)
     inner_border: Mapped[int | None] = mapped_column(nullable=True)
     output_format: Mapped[int | None] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", index=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
@@ -24,18 +44,71 @@ class StateWindow(Base):
     mv_id: Mapped[int] = mapped_column(primary_key=True)
     window_index: Mapped[int] = mapped_column(primary_key=True)
     pcm_bars: Mapped[int | None] = mapped_column(nullable=True)
-    umd_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", index=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
+class StateUMD(Base):
+    """One UMD layer of a window; columns map to varids through UMD_COLUMNS."""
+    __tablename__ = "state_umd"
+    __table_args__ = (Index("ix_state_umd_selection", "selection"),)
+
+    mv_id: Mapped[int] = mapped_column(primary_key=True)
+    window_index: Mapped[int] = mapped_column(primary_key=True)
+    layer: Mapped[int] = mapped_column(primary_key=True)
+    selection: Mapped[int | None] = mapped_column(nullable=True)
+    text: Mapped[str | None] = mapped_column(Text, nullable=True)
+    box_colour: Mapped[int | None] = mapped_column(nullable=True)
+    box_alpha: Mapped[int | None] = mapped_column(nullable=True)
+    box_x: Mapped[int | None] = mapped_column(nullable=True)
+    box_y: Mapped[int | None] = mapped_column(nullable=True)
+    text_colour: Mapped[int | None] = mapped_column(nullable=True)
+    text_alpha: Mapped[int | None] = mapped_column(nullable=True)
+    text_size: Mapped[int | None] = mapped_column(nullable=True)
+    padding: Mapped[int | None] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", index=True)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    def to_varids(self) -> dict:
+        return {varid: getattr(self, column) for varid, column in UMD_COLUMNS.items()}
+
+
 class StateRouting(Base):
     __tablename__ = "state_routing"
 
     output: Mapped[int] = mapped_column(primary_key=True)
     input: Mapped[int | None] = mapped_column(nullable=True)
+    version: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", index=True)
     updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
+class RoutingEvent(Base):
+    """Append-only journal of crosspoint changes, written by app.services.routing_journal."""
+    __tablename__ = "routing_events"
+    __table_args__ = (
+        Index("ix_routing_events_output_version", "output", "version"),
+        # Rows are appended in time order, so a BRIN index stays tiny and still serves the retention purge
+        Index("ix_routing_events_created_at", "created_at", postgresql_using="brin"),
+    )
+
+    id: Mapped[int] = mapped_column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, index=True)
+    output: Mapped[int] = mapped_column()
+    old_input: Mapped[int | None] = mapped_column(nullable=True)
+    new_input: Mapped[int | None] = mapped_column(nullable=True)
+    origin: Mapped[str] = mapped_column(String(20))
+    user_id: Mapped[int | None] = mapped_column(nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+
+class StateVersion(Base):
+    """Single-row counter stamped as `version` on the state rows each transaction writes."""
+    __tablename__ = "state_version"
+
+    id: Mapped[int] = mapped_column(primary_key=True, default=1)
+    value: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
 class RefreshStatus(Base):
     __tablename__ = "refresh_status"
 
@@ -45,3 +118,25 @@ class RefreshStatus(Base):
     finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     started_by: Mapped[str | None] = mapped_column(String(100), nullable=True)
     result_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+    # Recent manual refresh jobs by id (RefreshJob.to_dict()), so every worker can serve
+    # them; job_id is the latest
+    job_id: Mapped[str | None] = mapped_column(String(32), nullable=True)
+    jobs_json: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+
+class Lease(Base):
+    __tablename__ = "leases"
+
+    name: Mapped[str] = mapped_column(String(100), primary_key=True)
+    owner: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    expires_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class ParamStamp(Base):
+    """Stamp and value of the latest write sent to a NEXX varid, ordering writes across workers."""
+    __tablename__ = "param_stamps"
+
+    frame: Mapped[str] = mapped_column(String(255), primary_key=True)
+    varid: Mapped[str] = mapped_column(String(64), primary_key=True)
+    stamp: Mapped[int] = mapped_column(BigInteger, default=0)
+    value: Mapped[str | None] = mapped_column(Text, nullable=True)
@@ -0,0 +1,27 @@
+import hashlib
+
+from fastapi import Request, Response
+
+STATE_VERSION_HEADER = "X-State-Version"
+
+
+def etag_for(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def _matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+
+
+def state_response(request: Request, body: bytes, version: int) -> Response:
+    """JSON state body with a strong ETag and its state version; 304 if the client has it already."""
+    etag = etag_for(body)
+    # no-cache: browsers keep the body and revalidate it with If-None-Match on every poll
+    headers = {"ETag": etag, STATE_VERSION_HEADER: str(version), "Cache-Control": "no-cache"}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
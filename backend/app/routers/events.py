@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+
+from app.database import SessionLocal
+from app.dependencies import get_current_user
+from app.models.user import User
+from app.services.events import ChangeEvent, hub
+
+router = APIRouter(prefix="/api", tags=["events"])
+
+SSE_INTERVAL = 0.25
+KEEPALIVE_SECONDS = 15.0
+
+
+def _visible_events(events: list[ChangeEvent], user: User) -> list[ChangeEvent]:
+    with SessionLocal() as db:
+        return [event for event in events if event.visible_to(user, db)]
+
+
+@router.get("/events")
+def stream_events(request: Request, since: int | None = None, user: User = Depends(get_current_user)):
+    """Server-sent state change events visible to the user.
+
+    Resumes after `since` (or the Last-Event-ID a reconnecting browser sends), which
+    is the X-State-Version of the state the client has; without it the stream starts
+    now. A `resync` event means the client must reload its state.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def stream():
+        seq = hub.version if since is None else since
+        yield f"id: {seq}\nevent: ready\ndata: {json.dumps({'version': seq})}\n\n"
+        idle = 0.0
+        while not await request.is_disconnected():
+            events = hub.since(seq)
+            if events is None:
+                seq = hub.version
+                yield f"id: {seq}\nevent: resync\ndata: {json.dumps({'version': seq})}\n\n"
+                continue
+            if events:
+                # Access lookups may hit the database; keep them off the event loop
+                visible = events if user.role == "admin" else await run_in_threadpool(_visible_events, events, user)
+                for event in visible:
+                    yield event.to_sse()
+                # An id-only message moves the browser's Last-Event-ID past the whole batch
+                seq = events[-1].seq
+                yield f"id: {seq}\n\n"
+                idle = 0.0
+            elif idle >= KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(SSE_INTERVAL)
+            idle += SSE_INTERVAL
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
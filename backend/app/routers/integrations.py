@@ -7,9 +7,11 @@ from app.database import get_db
 from app.dependencies import require_admin
 from app.models.integration import Integration
 from app.schemas.integration import IntegrationRequest, IntegrationResponse
+from app.clients.breaker import breaker_stats
 from app.clients.quartz import QuartzClient, QuartzError
-from app.clients.nexx import NEXXClient, NEXXError
+from app.clients.nexx import NEXXClient, NEXXError, rate_limit_stats
 from app.protocol_mappings import VARID_TOTAL_MVS
+from app.services.integration import publish_integration_change
 
 router = APIRouter(prefix="/api/integrations", tags=["integrations"])
 
@@ -27,6 +29,17 @@ def list_integrations(_admin=Depends(require_admin), db: Session = Depends(get_d
     ]
 
 
+@router.get("/nexx/metrics")
+def nexx_metrics(_admin=Depends(require_admin)):
+    return rate_limit_stats()
+
+
+@router.get("/breakers")
+def device_breakers(_admin=Depends(require_admin)):
+    """Circuit breaker state per device in this process."""
+    return breaker_stats()
+
+
 @router.post("")
 def save_integration(body: IntegrationRequest, _admin=Depends(require_admin), db: Session = Depends(get_db)):
     integration = db.query(Integration).filter(Integration.protocol == body.protocol).first()
@@ -43,6 +56,7 @@ def save_integration(body: IntegrationRequest, _admin=Depends(require_admin), db
     if body.jwt_username and body.jwt_password:
         integration.jwt_credentials = json.dumps({"username": body.jwt_username, "password": body.jwt_password})
 
+    publish_integration_change(db, body.protocol)
     db.commit()
     db.refresh(integration)
 
@@ -57,6 +71,7 @@ def delete_integration(protocol: str, _admin=Depends(require_admin), db: Session
     if not integration:
         raise HTTPException(status_code=404, detail="Integration not found")
     db.delete(integration)
+    publish_integration_change(db, protocol)
     db.commit()
     return {"ok": True}
 
@@ -68,7 +83,10 @@ def _test_connection(integration: Integration) -> dict:
     try:
         if integration.protocol == "quartz":
             client = QuartzClient(host=integration.host, port=integration.port or 6543, timeout=3.0)
-            name = client.read_input_name(1)
+            try:
+                name = client.read_input_name(1)
+            finally:
+                client.close()
             return {"ok": True, "message": f"Connected. Input 1: {name}"}
         elif integration.protocol == "nexx":
             logger.info(f"[Integration Test] Testing NEXX connection to {integration.host}")
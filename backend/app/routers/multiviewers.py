@@ -1,30 +1,33 @@
-import json
-
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.dependencies import get_current_user
 from app.models.user import User
 from app.models.multiviewer import Multiviewer, UserAccessMV
-from app.models.state import StateMV, StateWindow
+from app.models.state import UMD_COLUMNS, StateMV, StateWindow, StateUMD
 from app.schemas.mv import MultiviewerResponse, MVStateResponse, SetLayoutRequest, SetMVParamsRequest, SetWindowRequest
+from app.services import param_queue
+from app.clients.nexx import NEXXClient
 from app.services.integration import get_nexx_client
+from app.services.param_queue import ParamWrite
+from app.services.state import umd_value
+from app.responses import state_response
+from app.services.state_cache import (
+    CachedState, cache, current_version, get_user_access,
+)
 from app.protocol_mappings import (
     VARID_MV_LAYOUT, VARID_MV_FONT, VARID_MV_OUTER_BORDER, VARID_MV_INNER_BORDER,
-    VARID_MV_OUTPUT_FORMAT, VARID_PCM_BARS, UMD_VARIDS, pcm_value_to_index,
+    VARID_MV_OUTPUT_FORMAT, VARID_PCM_BARS, pcm_value_to_index,
 )
 
 router = APIRouter(prefix="/api/multiviewers", tags=["multiviewers"])
 
 
-def _check_mv_access(user: User, mv: Multiviewer, db: Session):
+def _check_mv_access(user: User, mv_id: int, db: Session):
     if user.role == "admin":
         return
-    access = db.query(UserAccessMV).filter(
-        UserAccessMV.user_id == user.id, UserAccessMV.mv_id == mv.id
-    ).first()
-    if not access:
+    if mv_id not in get_user_access(db, user.id).mv_ids:
         raise HTTPException(status_code=403, detail="No access to this multiviewer")
 
 
@@ -38,21 +41,36 @@ def list_multiviewers(user: User = Depends(get_current_user), db: Session = Depe
     return [MultiviewerResponse(id=m.id, nexx_index=m.nexx_index, label=m.label, enabled=m.enabled) for m in mvs]
 
 
-@router.get("/{mv_id}", response_model=MVStateResponse)
-def get_multiviewer(mv_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def _load_mv_state(db: Session, mv_id: int, since: int | None = None) -> CachedState | None:
+    """Serialized MV state; with `since`, only the windows changed after that version."""
+    # Version first: rows written after it are included at worst, never missed
+    version = current_version(db)
     mv = db.query(Multiviewer).filter(Multiviewer.id == mv_id).first()
     if not mv:
-        raise HTTPException(status_code=404, detail="Multiviewer not found")
-    _check_mv_access(user, mv, db)
+        return None
 
     state = db.query(StateMV).filter(StateMV.mv_id == mv.id).first()
-    windows_db = db.query(StateWindow).filter(StateWindow.mv_id == mv.id).order_by(StateWindow.window_index).all()
-    windows = []
-    for w in windows_db:
-        umd = json.loads(w.umd_json) if w.umd_json else []
-        windows.append({"window_index": w.window_index, "pcm_bars": w.pcm_bars, "umd": umd})
-
-    return MVStateResponse(
+    windows_q = db.query(StateWindow).filter(StateWindow.mv_id == mv.id)
+    umd_q = db.query(StateUMD).filter(StateUMD.mv_id == mv.id)
+    if since is not None:
+        changed = {w for (w,) in db.query(StateWindow.window_index).filter(
+            StateWindow.mv_id == mv.id, StateWindow.version > since)}
+        changed |= {w for (w,) in db.query(StateUMD.window_index).filter(
+            StateUMD.mv_id == mv.id, StateUMD.version > since)}
+        windows_q = windows_q.filter(StateWindow.window_index.in_(changed))
+        umd_q = umd_q.filter(StateUMD.window_index.in_(changed))
+
+    umd_by_window: dict[int, list[dict]] = {}
+    for row in umd_q.all():
+        layers = umd_by_window.setdefault(row.window_index, [{}, {}, {}])
+        if row.layer < len(layers):
+            layers[row.layer] = row.to_varids()
+    windows = [
+        {"window_index": w.window_index, "pcm_bars": w.pcm_bars, "umd": umd_by_window.get(w.window_index, [])}
+        for w in windows_q.order_by(StateWindow.window_index).all()
+    ]
+
+    response = MVStateResponse(
         id=mv.id,
         nexx_index=mv.nexx_index,
         label=mv.label,
@@ -63,40 +81,83 @@ def get_multiviewer(mv_id: int, user: User = Depends(get_current_user), db: Sess
         output_format=state.output_format if state else None,
         windows=windows,
     )
+    return CachedState(
+        body=response.model_dump_json().encode(),
+        version=version,
+        unchanged=response.model_copy(update={"windows": []}).model_dump_json().encode(),
+    )
 
 
-@router.post("/{mv_id}/layout")
-def set_layout(mv_id: int, body: SetLayoutRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    mv = db.query(Multiviewer).filter(Multiviewer.id == mv_id).first()
-    if not mv:
+@router.get("/{mv_id}", response_model=MVStateResponse)
+def get_multiviewer(mv_id: int, request: Request, since: int | None = None,
+                    user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """MV state; with `since`, `windows` holds only the windows changed after that state version."""
+    state = cache.get("mv", mv_id, lambda: _load_mv_state(db, mv_id))
+    if state is None:
         raise HTTPException(status_code=404, detail="Multiviewer not found")
-    _check_mv_access(user, mv, db)
+    _check_mv_access(user, mv_id, db)
+    if since is None or since > state.version:
+        return state_response(request, state.body, state.version)
+    if since == state.version:
+        return state_response(request, state.unchanged, state.version)
+    delta = _load_mv_state(db, mv_id, since)
+    if delta is None:
+        raise HTTPException(status_code=404, detail="Multiviewer not found")
+    return state_response(request, delta.body, delta.version)
 
-    nexx = get_nexx_client(db)
-    if not nexx:
-        raise HTTPException(status_code=503, detail="NEXX not configured")
 
-    nexx.set_parameter(f"{VARID_MV_LAYOUT}.{mv.nexx_index}", str(body.layout))
+class _QueuedWrites:
+    """The writes of one request that change something, for the frame's param queue."""
 
-    state = db.query(StateMV).filter(StateMV.mv_id == mv.id).first()
-    if state:
-        state.layout = body.layout
-        db.commit()
+    def __init__(self, nexx: NEXXClient):
+        # Fail now rather than queue writes for a frame that is down
+        nexx.check_available()
+        self.queue = param_queue.queue_for(nexx)
+        # Values still on their way to the frame count as current; read them before the cached state
+        self.outstanding = self.queue.outstanding()
+        self.writes: list[ParamWrite] = []
 
-    return {"ok": True}
+    def add(self, varid: str, value: str, model: type, key: tuple, column: str, typed, cached) -> None:
+        unchanged = self.outstanding[varid] == value if varid in self.outstanding else cached == typed
+        if not unchanged:
+            self.writes.append(ParamWrite(varid, value, model, key, column, typed))
 
+    def submit(self) -> dict:
+        self.queue.submit(self.writes)
+        return {"ok": True, "queued": len(self.writes)}
 
-@router.post("/{mv_id}/params")
-def set_mv_params(mv_id: int, body: SetMVParamsRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+
+def _writable_mv(mv_id: int, user: User, db: Session) -> tuple[Multiviewer, NEXXClient]:
     mv = db.query(Multiviewer).filter(Multiviewer.id == mv_id).first()
     if not mv:
         raise HTTPException(status_code=404, detail="Multiviewer not found")
-    _check_mv_access(user, mv, db)
+    _check_mv_access(user, mv.id, db)
 
     nexx = get_nexx_client(db)
     if not nexx:
         raise HTTPException(status_code=503, detail="NEXX not configured")
+    return mv, nexx
+
+
+# Writes below answer once they are queued; the written values reach the state (and the
+# event stream) when the frame acknowledges them.
 
+@router.post("/{mv_id}/layout", status_code=202)
+def set_layout(mv_id: int, body: SetLayoutRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Queue the MV layout for NEXX."""
+    mv, nexx = _writable_mv(mv_id, user, db)
+    writes = _QueuedWrites(nexx)
+    state = db.query(StateMV).filter(StateMV.mv_id == mv.id).first()
+    writes.add(f"{VARID_MV_LAYOUT}.{mv.nexx_index}", str(body.layout),
+               StateMV, (mv.id,), "layout", body.layout, state.layout if state else None)
+    return writes.submit()
+
+
+@router.post("/{mv_id}/params", status_code=202)
+def set_mv_params(mv_id: int, body: SetMVParamsRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Queue the changed MV params for NEXX."""
+    mv, nexx = _writable_mv(mv_id, user, db)
+    writes = _QueuedWrites(nexx)
     state = db.query(StateMV).filter(StateMV.mv_id == mv.id).first()
 
     param_map = {
@@ -105,58 +166,39 @@ def set_mv_params(mv_id: int, body: SetMVParamsRequest, user: User = Depends(get
         "inner_border": (VARID_MV_INNER_BORDER, body.inner_border),
         "output_format": (VARID_MV_OUTPUT_FORMAT, body.output_format),
     }
-
     for attr, (varid, value) in param_map.items():
         if value is not None:
-            nexx.set_parameter(f"{varid}.{mv.nexx_index}", str(value))
-            if state:
-                setattr(state, attr, value)
-
-    if state:
-        db.commit()
+            writes.add(f"{varid}.{mv.nexx_index}", str(value),
+                       StateMV, (mv.id,), attr, value, getattr(state, attr) if state else None)
+    return writes.submit()
 
-    return {"ok": True}
 
-
-@router.post("/{mv_id}/windows/{window_index}")
+@router.post("/{mv_id}/windows/{window_index}", status_code=202)
 def set_window(mv_id: int, window_index: int, body: SetWindowRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    mv = db.query(Multiviewer).filter(Multiviewer.id == mv_id).first()
-    if not mv:
-        raise HTTPException(status_code=404, detail="Multiviewer not found")
-    _check_mv_access(user, mv, db)
-
-    nexx = get_nexx_client(db)
-    if not nexx:
-        raise HTTPException(status_code=503, detail="NEXX not configured")
+    """Queue the changed window params for NEXX."""
+    mv, nexx = _writable_mv(mv_id, user, db)
+    writes = _QueuedWrites(nexx)
 
     if body.pcm_bars is not None:
-        pcm_index = pcm_value_to_index(body.pcm_bars)
-        nexx.set_parameter(f"{VARID_PCM_BARS}.{mv.nexx_index}.{window_index}", str(pcm_index))
-
-    win_state = db.query(StateWindow).filter(
-        StateWindow.mv_id == mv.id, StateWindow.window_index == window_index
-    ).first()
+        win_state = db.query(StateWindow).filter(
+            StateWindow.mv_id == mv.id, StateWindow.window_index == window_index
+        ).first()
+        writes.add(f"{VARID_PCM_BARS}.{mv.nexx_index}.{window_index}", str(pcm_value_to_index(body.pcm_bars)),
+                   StateWindow, (mv.id, window_index), "pcm_bars", body.pcm_bars,
+                   win_state.pcm_bars if win_state else None)
 
     if body.umd is not None:
-        # Merge incoming UMD data with existing data to avoid wiping unchanged layers
-        existing_umd = json.loads(win_state.umd_json) if win_state and win_state.umd_json else [{}, {}, {}]
-        while len(existing_umd) < 3:
-            existing_umd.append({})
-
-        for layer_idx, layer_data in enumerate(body.umd):
-            if layer_idx > 2:
-                break
-            if layer_data:
-                existing_umd[layer_idx].update(layer_data)
+        umd_rows = {r.layer: r for r in db.query(StateUMD).filter(
+            StateUMD.mv_id == mv.id, StateUMD.window_index == window_index
+        ).all()}
+        for layer_idx, layer_data in enumerate(body.umd[:3]):
+            row = umd_rows.get(layer_idx)
             for varid_base, value in layer_data.items():
-                if varid_base in UMD_VARIDS:
-                    nexx.set_parameter(f"{varid_base}.{mv.nexx_index}.{window_index}.{layer_idx}", str(value))
-
-    if win_state:
-        if body.pcm_bars is not None:
-            win_state.pcm_bars = body.pcm_bars
-        if body.umd is not None:
-            win_state.umd_json = json.dumps(existing_umd)
-        db.commit()
-
-    return {"ok": True}
+                column = UMD_COLUMNS.get(varid_base)
+                if column is None:
+                    continue
+                writes.add(f"{varid_base}.{mv.nexx_index}.{window_index}.{layer_idx}", str(value),
+                           StateUMD, (mv.id, window_index, layer_idx), column, umd_value(column, value),
+                           getattr(row, column) if row else None)
+
+    return writes.submit()
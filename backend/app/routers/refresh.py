@@ -1,21 +1,27 @@
+import asyncio
 import json
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
-from app.database import get_db
+from app.config import settings
+from app.database import SessionLocal, get_db
 from app.dependencies import get_current_user
 from app.models.user import User
 from app.models.state import RefreshStatus
 from app.models.multiviewer import Multiviewer, UserAccessMV
 from app.models.source import Source, UserAccessSource
-from app.services.integration import get_nexx_client, get_quartz_client
-from app.services.state import refresh_nexx_state, refresh_quartz_state
+from app.services.integration import get_nexx_client, get_async_quartz_client
+from app.services.lease import LeaseHolder, active_lease
+from app.services.refresh_jobs import REFRESH_LEASE, RefreshScope, jobs
 
 router = APIRouter(prefix="/api", tags=["refresh"])
 
 THROTTLE_SECONDS = 60
+SSE_INTERVAL = 0.5
 
 
 def _get_or_create_status(db: Session) -> RefreshStatus:
@@ -27,84 +33,117 @@ def _get_or_create_status(db: Session) -> RefreshStatus:
     return status
 
 
-@router.post("/refresh")
+def _scope_for(user: User, db: Session) -> RefreshScope:
+    if user.role == "admin":
+        return RefreshScope()
+    mv_ids = [r.mv_id for r in db.query(UserAccessMV.mv_id).filter(UserAccessMV.user_id == user.id).all()]
+    mvs = db.query(Multiviewer).filter(Multiviewer.id.in_(mv_ids)).all() if mv_ids else []
+    mv_indices = [mv.nexx_index for mv in mvs]
+
+    outputs = []
+    for idx in mv_indices:
+        outputs.extend(range(idx * 16 + 1, idx * 16 + 17))
+
+    src_ids = [r.source_id for r in db.query(UserAccessSource.source_id).filter(UserAccessSource.user_id == user.id).all()]
+    sources = db.query(Source).filter(Source.id.in_(src_ids)).all() if src_ids else []
+    return RefreshScope(
+        mv_indices=mv_indices,
+        source_inputs=[s.quartz_input for s in sources],
+        output_range=outputs,
+    )
+
+
+@router.post("/refresh", status_code=202)
 def do_refresh(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    now = datetime.now(timezone.utc)
-    status = _get_or_create_status(db)
+    if not get_nexx_client(db) and not get_async_quartz_client(db):
+        raise HTTPException(status_code=400, detail="No integrations configured. Please configure Quartz and/or NEXX in Admin → Integrations.")
 
-    if status.is_running:
-        raise HTTPException(status_code=423, detail="Refresh is already in progress.")
+    scope = _scope_for(user, db)
 
+    # Served by the refresh in progress, or merged into the one queued behind it
+    job = jobs.join(user.login, scope) or jobs.recent(scope, THROTTLE_SECONDS)
+    if job:
+        job.add_requester(user.login)
+        return {"job_id": job.id, "status": job.status}
+    # ...or by one another worker runs
+    remote = jobs.join_remote(db, user.login, scope, THROTTLE_SECONDS)
+    if remote:
+        return {"job_id": remote["id"], "status": remote["status"]}
+
+    now = datetime.now(timezone.utc)
+    status = _get_or_create_status(db)
     finished = status.finished_at.replace(tzinfo=timezone.utc) if status.finished_at and status.finished_at.tzinfo is None else status.finished_at
     if finished and (now - finished).total_seconds() < THROTTLE_SECONDS:
         raise HTTPException(status_code=429, detail="Refresh throttled. Try again later.")
 
-    status.is_running = True
-    status.started_at = now
-    status.started_by = user.login
-    db.commit()
-
-    results = {"nexx": None, "quartz": None, "timestamp": now.isoformat(), "errors": []}
-
-    try:
-        mv_indices = None
-        source_inputs = None
-        output_range = None
-
-        if user.role != "admin":
-            mv_ids = [r.mv_id for r in db.query(UserAccessMV.mv_id).filter(UserAccessMV.user_id == user.id).all()]
-            mvs = db.query(Multiviewer).filter(Multiviewer.id.in_(mv_ids)).all() if mv_ids else []
-            mv_indices = [mv.nexx_index for mv in mvs]
-
-            outputs = []
-            for idx in mv_indices:
-                outputs.extend(range(idx * 16 + 1, idx * 16 + 17))
-            output_range = outputs if outputs else []
-
-            src_ids = [r.source_id for r in db.query(UserAccessSource.source_id).filter(UserAccessSource.user_id == user.id).all()]
-            sources = db.query(Source).filter(Source.id.in_(src_ids)).all() if src_ids else []
-            source_inputs = [s.quartz_input for s in sources]
-
-        nexx = get_nexx_client(db)
-        if nexx:
-            try:
-                results["nexx"] = refresh_nexx_state(db, nexx, mv_indices=mv_indices)
-            except Exception as e:
-                results["errors"].append(f"NEXX error: {str(e)}")
-                results["nexx"] = {"error": str(e)}
-
-        quartz = get_quartz_client(db)
-        if quartz:
-            try:
-                from app.models.integration import Integration
-                qi = db.query(Integration).filter(Integration.protocol == "quartz").first()
-                max_inputs = qi.max_inputs if qi and qi.max_inputs else 960
-                max_outputs = qi.max_outputs if qi and qi.max_outputs else 960
-                results["quartz"] = refresh_quartz_state(
-                    db, quartz, max_sources=max_inputs, max_outputs=max_outputs,
-                    source_inputs=source_inputs, output_range=output_range,
-                )
-            except Exception as e:
-                results["errors"].append(f"Quartz error: {str(e)}")
-                results["quartz"] = {"error": str(e)}
-
-        if not nexx and not quartz:
-            raise HTTPException(status_code=400, detail="No integrations configured. Please configure Quartz and/or NEXX in Admin → Integrations.")
-
-    finally:
-        status.is_running = False
-        status.finished_at = datetime.now(timezone.utc)
-        status.result_json = json.dumps(results)
-        db.commit()
+    lease = LeaseHolder(REFRESH_LEASE, settings.refresh_lease_ttl)
+    # Held by another worker's refresh that doesn't cover this scope: queue behind it
+    job = jobs.start(user.login, scope, lease, acquired=lease.acquire(db))
+    return {"job_id": job.id, "status": job.status}
+
+
+def _get_job_view(job_id: str, user: User, db: Session) -> dict:
+    view = jobs.view(db, job_id)
+    if not view:
+        raise HTTPException(status_code=404, detail="Refresh job not found")
+    if user.role != "admin" and user.login not in view["requested_by"]:
+        raise HTTPException(status_code=403, detail="No access to this refresh job")
+    return view
+
+
+def _load_job_view(job_id: str) -> dict | None:
+    with SessionLocal() as db:
+        return jobs.view(db, job_id)
+
+
+@router.get("/refresh/jobs/{job_id}")
+def get_refresh_job(job_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return _get_job_view(job_id, user, db)
+
+
+@router.get("/refresh/jobs/{job_id}/events")
+def refresh_job_events(job_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    _get_job_view(job_id, user, db)
+    job = jobs.get(job_id)
+
+    async def stream():
+        last = None
+        while True:
+            # A job run by another worker is followed through its snapshot
+            view = job.to_dict() if job else await run_in_threadpool(_load_job_view, job_id)
+            if view is None:
+                return
+            finished = view["status"] not in ("queued", "running")
+            if finished or view != last:
+                last = view
+                event = "done" if finished else "progress"
+                yield f"event: {event}\ndata: {json.dumps(view)}\n\n"
+            if finished:
+                return
+            await asyncio.sleep(SSE_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 
-    return results
+@router.post("/refresh/jobs/{job_id}/cancel")
+def cancel_refresh_job(job_id: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    _get_job_view(job_id, user, db)
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=409, detail="Refresh is running in another worker and cannot be cancelled here")
+    if user.role != "admin" and job.requested_by != [user.login]:
+        raise HTTPException(status_code=409, detail="Refresh is shared with other users and cannot be cancelled")
+    if not job.finished:
+        job.progress.cancel()
+    return job.to_dict()
 
 
 @router.get("/refresh/status")
 def refresh_status(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     status = _get_or_create_status(db)
     return {
-        "is_running": status.is_running,
+        # The lease, not the is_running flag, tells whether a worker is alive and refreshing
+        "is_running": active_lease(db, REFRESH_LEASE) is not None,
         "started_at": status.started_at.isoformat() if status.started_at else None,
         "started_by": status.started_by,
         "finished_at": status.finished_at.isoformat() if status.finished_at else None,
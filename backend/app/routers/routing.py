@@ -1,22 +1,52 @@
+import asyncio
+import json
+import time
 from datetime import datetime, timezone
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 
+from app.clients import device_loop
+from app.clients.quartz import AsyncQuartzClient
 from app.database import get_db
-from app.dependencies import get_current_user
+from app.dependencies import get_current_user, require_admin
+from app.models.multiviewer import Multiviewer
+from app.models.source import Source
 from app.models.user import User
-from app.models.state import StateRouting
-from app.schemas.mv import SwitchRequest, RoutingEntry
-from app.services.integration import get_quartz_client
+from app.models.state import RoutingEvent, StateRouting
+from app.schemas.mv import SwitchRequest, SalvoRequest, RoutingEntry, RoutingEventEntry
+from app.services import routing_journal
+from app.services.integration import get_async_quartz_client, get_quartz_client
+from app.services.state import apply_routing_updates
+from app.responses import state_response
+from app.services.state_cache import (
+    CachedState, cache, current_version, get_user_access, next_version, publish_state_change,
+)
 
 router = APIRouter(prefix="/api/routing", tags=["routing"])
 
 
+def _load_routing(db: Session, since: int | None = None) -> CachedState:
+    # Version first: rows written after it are included at worst, never missed
+    version = current_version(db)
+    query = db.query(StateRouting)
+    if since is not None:
+        query = query.filter(StateRouting.version > since)
+    routes = query.order_by(StateRouting.output).all()
+    return CachedState(json.dumps([{"output": r.output, "input": r.input} for r in routes]).encode(), version)
+
+
 @router.get("", response_model=list[RoutingEntry])
-def get_routing(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    routes = db.query(StateRouting).order_by(StateRouting.output).all()
-    return [RoutingEntry(output=r.output, input=r.input) for r in routes]
+def get_routing(request: Request, since: int | None = None,
+                user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """All crosspoints, or with `since` only those changed after that state version."""
+    state = cache.get("routing", None, lambda: _load_routing(db))
+    if since is None or since > state.version:
+        return state_response(request, state.body, state.version)
+    if since == state.version:
+        return state_response(request, state.unchanged, state.version)
+    delta = _load_routing(db, since)
+    return state_response(request, delta.body, delta.version)
 
 
 @router.post("/switch")
@@ -27,13 +57,112 @@ def switch_route(body: SwitchRequest, user: User = Depends(get_current_user), db
 
     quartz.switch(body.output, body.input)
 
+    version = next_version(db)
     route = db.query(StateRouting).filter(StateRouting.output == body.output).first()
+    changed = route is None or route.input != body.input
+    old_input = route.input if route else None
     if route:
         route.input = body.input
+        route.version = version
         route.updated_at = datetime.now(timezone.utc)
     else:
-        route = StateRouting(output=body.output, input=body.input)
+        route = StateRouting(output=body.output, input=body.input, version=version)
         db.add(route)
+    if changed:
+        routing_journal.record(db, version, {body.output: (old_input, body.input)}, routing_journal.ORIGIN_API, user.id)
+    publish_state_change(db, "routing")
     db.commit()
 
     return {"ok": True}
+
+
+def _check_salvo_access(user: User, switches: list[SwitchRequest], db: Session):
+    """Operators may only route their sources to outputs of their MVs (output = nexx_index * 16 + window + 1)."""
+    if user.role == "admin":
+        return
+    access = get_user_access(db, user.id)
+    mv_indices = {nexx_index for (nexx_index,) in db.query(Multiviewer.nexx_index).filter(
+        Multiviewer.id.in_(access.mv_ids))}
+    inputs = {quartz_input for (quartz_input,) in db.query(Source.quartz_input).filter(
+        Source.id.in_(access.source_ids))}
+    for s in switches:
+        if (s.output - 1) // 16 not in mv_indices:
+            raise HTTPException(status_code=403, detail=f"No access to output {s.output}")
+        if s.input not in inputs:
+            raise HTTPException(status_code=403, detail=f"No access to input {s.input}")
+
+
+async def _switch_all(quartz: AsyncQuartzClient, switches: list[SwitchRequest]) -> list[tuple[Exception | None, float]]:
+    async def switch(s: SwitchRequest) -> tuple[Exception | None, float]:
+        started = time.monotonic()
+        try:
+            await quartz.switch(s.output, s.input)
+            error = None
+        except Exception as e:
+            error = e
+        return error, (time.monotonic() - started) * 1000
+
+    return await asyncio.gather(*(switch(s) for s in switches))
+
+
+@router.post("/salvo")
+def switch_salvo(body: SalvoRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Switch many crosspoints at once.
+
+    All commands go out together over the pooled Quartz connections, so the outputs
+    change over within a few milliseconds of each other. The ones that succeeded are
+    applied to the routing state in one transaction. Access is checked for the whole
+    list before anything is sent.
+    """
+    outputs = [s.output for s in body.switches]
+    if len(set(outputs)) != len(outputs):
+        raise HTTPException(status_code=400, detail="Each output may appear only once")
+    _check_salvo_access(user, body.switches, db)
+    quartz = get_async_quartz_client(db)
+    if not quartz:
+        raise HTTPException(status_code=503, detail="Quartz not configured")
+    quartz.check_available()
+
+    started = time.monotonic()
+    # On the device loop, so the connections stay open for the next salvo
+    outcomes = device_loop.run_sync(_switch_all(quartz, body.switches))
+    switched_ms = (time.monotonic() - started) * 1000
+
+    results = []
+    switched = {}
+    for s, (error, duration_ms) in zip(body.switches, outcomes):
+        if error is None:
+            switched[s.output] = s.input
+        results.append({"output": s.output, "input": s.input, "ok": error is None,
+                        "error": str(error) if error else None, "duration_ms": round(duration_ms, 1)})
+    apply_routing_updates(db, switched, routing_journal.ORIGIN_API, user.id)
+    db.commit()
+
+    return {
+        "ok": len(switched) == len(body.switches),
+        "switched": len(switched),
+        "failed": len(body.switches) - len(switched),
+        "switch_ms": round(switched_ms, 1),
+        "duration_ms": round((time.monotonic() - started) * 1000, 1),
+        "results": results,
+    }
+
+
+@router.get("/history", response_model=list[RoutingEventEntry])
+def routing_history(since: int | None = None, output: int | None = None, limit: int = 1000,
+                    _admin=Depends(require_admin), db: Session = Depends(get_db)):
+    """Journaled crosspoint changes after state version `since`, oldest first, optionally for one output.
+
+    Entries are written shortly after their switch commits, so the newest may not be here yet.
+    """
+    query = db.query(RoutingEvent)
+    if since is not None:
+        query = query.filter(RoutingEvent.version > since)
+    if output is not None:
+        query = query.filter(RoutingEvent.output == output)
+    events = query.order_by(RoutingEvent.version, RoutingEvent.id).limit(min(max(limit, 1), 10000)).all()
+    return [
+        {"id": e.id, "version": e.version, "output": e.output, "old_input": e.old_input, "new_input": e.new_input,
+         "origin": e.origin, "user_id": e.user_id, "created_at": e.created_at}
+        for e in events
+    ]
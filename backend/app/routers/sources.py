@@ -1,20 +1,34 @@
-from fastapi import APIRouter, Depends
+import json
+
+from fastapi import APIRouter, Depends, Request
 from sqlalchemy.orm import Session
 
 from app.database import get_db
 from app.dependencies import get_current_user
 from app.models.user import User
-from app.models.source import Source, UserAccessSource
+from app.models.source import Source
 from app.schemas.mv import SourceResponse
+from app.responses import state_response
+from app.services.state_cache import CachedState, cache, current_version, get_user_access
 
 router = APIRouter(prefix="/api/sources", tags=["sources"])
 
 
 @router.get("", response_model=list[SourceResponse])
-def list_sources(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    if user.role == "admin":
+def list_sources(request: Request, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    def load_all() -> list[dict]:
         sources = db.query(Source).order_by(Source.quartz_input).all()
-    else:
-        allowed = db.query(UserAccessSource.source_id).filter(UserAccessSource.user_id == user.id).subquery()
-        sources = db.query(Source).filter(Source.id.in_(allowed)).order_by(Source.quartz_input).all()
-    return [SourceResponse(id=s.id, quartz_input=s.quartz_input, label=s.label) for s in sources]
+        return [{"id": s.id, "quartz_input": s.quartz_input, "label": s.label} for s in sources]
+
+    def load() -> CachedState:
+        version = current_version(db)
+        sources = cache.get("sources", "all", load_all)
+        if user.role != "admin":
+            allowed = get_user_access(db, user.id).source_ids
+            sources = [s for s in sources if s["id"] in allowed]
+        return CachedState(json.dumps(sources).encode(), version)
+
+    # Serialized per user, since the list is filtered by access
+    key = "admin" if user.role == "admin" else user.id
+    state = cache.get("sources", key, load)
+    return state_response(request, state.body, state.version)
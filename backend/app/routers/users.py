@@ -8,6 +8,7 @@ from app.models.source import UserAccessSource
 from app.models.multiviewer import UserAccessMV
 from app.schemas.user import CreateUserRequest, UpdateUserRequest, UserResponse, AccessUpdate
 from app.services.auth import hash_password
+from app.services.state_cache import publish_state_change
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
@@ -54,6 +55,8 @@ def delete_user(user_id: int, _admin=Depends(require_admin), db: Session = Depen
     db.query(UserAccessSource).filter(UserAccessSource.user_id == user_id).delete()
     db.query(UserAccessMV).filter(UserAccessMV.user_id == user_id).delete()
     db.delete(user)
+    publish_state_change(db, "access", user_id)
+    publish_state_change(db, "sources", user_id)
     db.commit()
     return {"ok": True}
 
@@ -81,5 +84,8 @@ def set_access(user_id: int, body: AccessUpdate, _admin=Depends(require_admin),
         for mid in body.mv_ids:
             db.add(UserAccessMV(user_id=user_id, mv_id=mid))
 
+    # Cached access and the user's filtered source list
+    publish_state_change(db, "access", user_id)
+    publish_state_change(db, "sources", user_id)
     db.commit()
     return {"ok": True}
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from datetime import datetime
+
+from pydantic import BaseModel, Field
 
 
 class SourceResponse(BaseModel):
@@ -47,6 +49,21 @@ class SwitchRequest(BaseModel):
     input: int
 
 
+class SalvoRequest(BaseModel):
+    switches: list[SwitchRequest] = Field(min_length=1, max_length=1024)
+
+
 class RoutingEntry(BaseModel):
     output: int
     input: int | None
+
+
+class RoutingEventEntry(BaseModel):
+    id: int
+    version: int
+    output: int
+    old_input: int | None
+    new_input: int | None
+    origin: str
+    user_id: int | None
+    created_at: datetime
@@ -22,3 +22,4 @@ class PresetDetail(BaseModel):
 class ApplyPresetRequest(BaseModel):
     categories: list[str]
     targets: dict[str, int]  # saved mv nexx_index (str) → target mv_id
+    dry_run: bool = False
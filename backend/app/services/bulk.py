@@ -0,0 +1,77 @@
+"""
+Bulk persistence for device state.
+
+`bulk_upsert` writes many rows in a few statements: INSERT ... ON CONFLICT DO UPDATE
+on PostgreSQL and SQLite, a single preload plus ORM updates elsewhere. Rows whose
+values already match the table are left untouched.
+"""
+from datetime import datetime, timezone
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+BATCH_SIZE = 1000
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def bulk_upsert(db: Session, model, rows: list[dict], key: tuple[str, ...], stamp: dict | None = None) -> int:
+    """Insert or update `rows` of `model`, matched on the unique columns `key`.
+
+    Every row must have the same columns. `updated_at` is bumped on changed rows if
+    the model has it; `stamp` values (e.g. a version) are written with inserted and
+    changed rows without taking part in the comparison. Returns the number of rows
+    inserted or changed (caller commits).
+    """
+    if not rows:
+        return 0
+    stamp = stamp or {}
+    insert = _INSERTS.get(db.get_bind().dialect.name)
+    if insert is None:
+        return _upsert_orm(db, model, rows, key, stamp)
+
+    table = model.__table__
+    columns = [c for c in rows[0] if c not in key]
+    changed = 0
+    for start in range(0, len(rows), BATCH_SIZE):
+        stmt = insert(table).values([{**row, **stamp} for row in rows[start:start + BATCH_SIZE]])
+        if columns:
+            set_ = {c: stmt.excluded[c] for c in [*columns, *stamp]}
+            if "updated_at" in table.c:
+                set_["updated_at"] = func.now()
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key),
+                set_=set_,
+                where=or_(*(table.c[c].is_distinct_from(stmt.excluded[c]) for c in columns)),
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(key))
+        changed += db.execute(stmt).rowcount
+    return changed
+
+
+def _upsert_orm(db: Session, model, rows: list[dict], key: tuple[str, ...], stamp: dict) -> int:
+    first = getattr(model, key[0])
+    existing = {tuple(getattr(obj, k) for k in key): obj
+                for obj in db.query(model).filter(first.in_({row[key[0]] for row in rows})).all()}
+    now = datetime.now(timezone.utc)
+    changed = 0
+    for row in rows:
+        obj = existing.get(tuple(row[k] for k in key))
+        if obj is None:
+            db.add(model(**row, **stamp))
+            changed += 1
+            continue
+        dirty = False
+        for column, value in row.items():
+            if getattr(obj, column) != value:
+                setattr(obj, column, value)
+                dirty = True
+        if dirty:
+            if hasattr(obj, "updated_at"):
+                obj.updated_at = now
+            for column, value in stamp.items():
+                setattr(obj, column, value)
+            changed += 1
+    return changed
@@ -0,0 +1,172 @@
+"""
+Change events for the push channel.
+
+The hub follows the global state version: when a state change is published (and
+every POLL_INTERVAL in case a notification was missed) it reads the rows stamped
+after the last version it has seen and turns them into typed events. An event's
+sequence number is the version of the change, so a client that knows the version of
+the state it loaded can resume from there. Recent events are buffered for that; a
+client that has fallen behind the buffer is told to resync instead.
+"""
+import itertools
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.multiviewer import Multiviewer
+from app.models.source import Source
+from app.models.state import StateMV, StateRouting, StateUMD, StateWindow
+from app.models.user import User
+from app.services import notify
+from app.services.state_cache import STATE_CHANNEL, current_version, get_user_access
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 20000
+POLL_INTERVAL = 5.0
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    seq: int
+    type: str  # "mv", "window", "routing" or "source"
+    data: dict
+    mv_id: int | None = None
+    source_id: int | None = None
+
+    def visible_to(self, user: User, db: Session) -> bool:
+        if user.role == "admin":
+            return True
+        access = get_user_access(db, user.id)
+        if self.source_id is not None:
+            return self.source_id in access.source_ids
+        return self.mv_id in access.mv_ids
+
+    def to_sse(self) -> str:
+        return f"event: {self.type}\ndata: {json.dumps({'seq': self.seq, **self.data})}\n\n"
+
+
+def _read_changes(db: Session, after: int, upto: int) -> list[ChangeEvent]:
+    """Events for the state rows stamped with a version in (after, upto]."""
+    def changed(model):
+        return db.query(model).filter(model.version > after, model.version <= upto)
+
+    events = []
+    for s in changed(StateMV):
+        events.append(ChangeEvent(s.version, "mv", {
+            "mv_id": s.mv_id, "layout": s.layout, "font": s.font, "outer_border": s.outer_border,
+            "inner_border": s.inner_border, "output_format": s.output_format,
+        }, mv_id=s.mv_id))
+
+    # A window event carries the whole window, so a change to any of its rows sends all of them
+    windows: dict[tuple[int, int], int] = {}
+    for w in changed(StateWindow):
+        windows[(w.mv_id, w.window_index)] = w.version
+    for u in changed(StateUMD):
+        key = (u.mv_id, u.window_index)
+        windows[key] = max(windows.get(key, 0), u.version)
+    if windows:
+        mv_ids = list({mv_id for mv_id, _ in windows})
+        pcm = {(w.mv_id, w.window_index): w.pcm_bars
+               for w in db.query(StateWindow).filter(StateWindow.mv_id.in_(mv_ids))}
+        umd: dict[tuple[int, int], list[dict]] = {}
+        for u in db.query(StateUMD).filter(StateUMD.mv_id.in_(mv_ids)):
+            layers = umd.setdefault((u.mv_id, u.window_index), [{}, {}, {}])
+            if u.layer < len(layers):
+                layers[u.layer] = u.to_varids()
+        for (mv_id, win_idx), version in windows.items():
+            events.append(ChangeEvent(version, "window", {
+                "mv_id": mv_id, "window_index": win_idx,
+                "pcm_bars": pcm.get((mv_id, win_idx)), "umd": umd.get((mv_id, win_idx), []),
+            }, mv_id=mv_id))
+
+    routes = changed(StateRouting).all()
+    if routes:
+        mv_by_index = {mv.nexx_index: mv.id for mv in db.query(Multiviewer)}
+        for r in routes:
+            # Outputs map to MV windows as nexx_index * 16 + window + 1
+            mv_id = mv_by_index.get((r.output - 1) // 16)
+            events.append(ChangeEvent(r.version, "routing", {
+                "output": r.output, "input": r.input, "mv_id": mv_id, "window_index": (r.output - 1) % 16,
+            }, mv_id=mv_id))
+
+    for s in changed(Source):
+        events.append(ChangeEvent(s.version, "source", {
+            "id": s.id, "quartz_input": s.quartz_input, "label": s.label,
+        }, source_id=s.id))
+
+    events.sort(key=lambda e: e.seq)
+    return events
+
+
+class EventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: deque[ChangeEvent] = deque()
+        # Every event with a seq above the floor is still buffered
+        self._floor = 0
+        self.version = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        with SessionLocal() as db:
+            self.version = self._floor = current_version(db)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="event-hub", daemon=True)
+        self._thread.start()
+        logger.info(f"[Events] Hub started at version {self.version}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def wake(self, _payload: str | None = None) -> None:
+        self._wake.set()
+
+    def since(self, seq: int) -> list[ChangeEvent] | None:
+        """Events after `seq`, or None if some of them are no longer buffered."""
+        with self._lock:
+            if seq < self._floor:
+                return None
+            newer = list(itertools.takewhile(lambda e: e.seq > seq, reversed(self._events)))
+        newer.reverse()
+        return newer
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self._collect()
+            except Exception as e:
+                logger.error(f"[Events] Failed to read changes: {e}", exc_info=True)
+
+    def _collect(self) -> None:
+        with SessionLocal() as db:
+            version = current_version(db)
+            if version <= self.version:
+                return
+            events = _read_changes(db, self.version, version)
+        with self._lock:
+            self._events.extend(events)
+            while len(self._events) > BUFFER_SIZE:
+                self._floor = self._events.popleft().seq
+            self.version = version
+
+
+hub = EventHub()
+notify.subscribe(STATE_CHANNEL, hub.wake)
@@ -1,19 +1,159 @@
+import logging
+import threading
+from dataclasses import dataclass
+
 from sqlalchemy.orm import Session
 
-from app.clients.quartz import QuartzClient
+from app.clients import device_loop
+from app.clients.quartz import QuartzClient, AsyncQuartzClient
 from app.clients.nexx import NEXXClient
+from app.config import settings
 from app.models.integration import Integration
+from app.services import notify
+
+logger = logging.getLogger(__name__)
+
+INTEGRATIONS_CHANNEL = "integrations_changed"
+
+
+@dataclass(frozen=True)
+class IntegrationConfig:
+    protocol: str
+    host: str
+    port: int | None
+    api_key: str | None
+    max_inputs: int | None
+    max_outputs: int | None
+
+
+class _Entry:
+    def __init__(self, config: IntegrationConfig):
+        self.config = config
+        self.quartz: QuartzClient | None = None
+        self.async_quartz: AsyncQuartzClient | None = None
+        self.nexx: NEXXClient | None = None
+
+
+class ClientRegistry:
+    """Device clients cached per protocol.
+
+    The integration row is read once; the entry (including "not configured") is kept
+    until an integration change is published on INTEGRATIONS_CHANNEL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[str, _Entry | None] = {}
+        self._generation = 0
+
+    def _entry(self, db: Session, protocol: str) -> _Entry | None:
+        with self._lock:
+            if protocol in self._entries:
+                return self._entries[protocol]
+            generation = self._generation
+
+        integration = db.query(Integration).filter(Integration.protocol == protocol).first()
+        entry = _Entry(IntegrationConfig(
+            protocol=protocol,
+            host=integration.host,
+            port=integration.port,
+            api_key=integration.api_key,
+            max_inputs=integration.max_inputs,
+            max_outputs=integration.max_outputs,
+        )) if integration else None
+
+        with self._lock:
+            # Don't cache a row read before an invalidation that raced with us
+            if generation == self._generation:
+                self._entries.setdefault(protocol, entry)
+                return self._entries[protocol]
+        return entry
+
+    def config(self, db: Session, protocol: str) -> IntegrationConfig | None:
+        entry = self._entry(db, protocol)
+        return entry.config if entry else None
+
+    def quartz(self, db: Session) -> QuartzClient | None:
+        entry = self._entry(db, "quartz")
+        if not entry:
+            return None
+        with self._lock:
+            if entry.quartz is None:
+                entry.quartz = QuartzClient(host=entry.config.host, port=entry.config.port or 6543)
+            return entry.quartz
+
+    def async_quartz(self, db: Session) -> AsyncQuartzClient | None:
+        entry = self._entry(db, "quartz")
+        if not entry:
+            return None
+        with self._lock:
+            if entry.async_quartz is None:
+                entry.async_quartz = AsyncQuartzClient(
+                    host=entry.config.host,
+                    port=entry.config.port or 6543,
+                    max_in_flight=settings.quartz_max_in_flight,
+                    connections=settings.quartz_connections,
+                )
+            return entry.async_quartz
+
+    def nexx(self, db: Session) -> NEXXClient | None:
+        entry = self._entry(db, "nexx")
+        if not entry:
+            return None
+        with self._lock:
+            if entry.nexx is None:
+                entry.nexx = NEXXClient(host=entry.config.host, api_key=entry.config.api_key, jwt=None)
+            return entry.nexx
+
+    def invalidate(self, protocol: str | None = None) -> None:
+        with self._lock:
+            self._generation += 1
+            if protocol:
+                dropped = [self._entries.pop(protocol, None)]
+            else:
+                dropped = list(self._entries.values())
+                self._entries.clear()
+        for entry in dropped:
+            if entry and entry.quartz:
+                entry.quartz.close()
+            if entry and entry.async_quartz:
+                # Its pooled connections live on the device loop (salvo); refreshes close their own
+                device_loop.submit(entry.async_quartz.aclose())
+        logger.info(f"[Integrations] Client cache invalidated ({protocol or 'all'})")
+
+    async def aclose(self) -> None:
+        """Close every cached client, waiting for the pooled async ones on the device loop (shutdown)."""
+        with self._lock:
+            self._generation += 1
+            dropped = list(self._entries.values())
+            self._entries.clear()
+        for entry in dropped:
+            if entry and entry.quartz:
+                entry.quartz.close()
+            if entry and entry.async_quartz:
+                await device_loop.run_async(entry.async_quartz.aclose())
+
+
+registry = ClientRegistry()
+notify.subscribe(INTEGRATIONS_CHANNEL, lambda protocol: registry.invalidate(protocol or None))
+
+
+def publish_integration_change(db: Session, protocol: str) -> None:
+    """Drop cached clients for `protocol` in every worker once `db` commits."""
+    notify.publish(db, INTEGRATIONS_CHANNEL, protocol)
+
+
+def get_integration_config(db: Session, protocol: str) -> IntegrationConfig | None:
+    return registry.config(db, protocol)
 
 
 def get_quartz_client(db: Session) -> QuartzClient | None:
-    integration = db.query(Integration).filter(Integration.protocol == "quartz").first()
-    if not integration:
-        return None
-    return QuartzClient(host=integration.host, port=integration.port or 6543)
+    return registry.quartz(db)
+
+
+def get_async_quartz_client(db: Session) -> AsyncQuartzClient | None:
+    return registry.async_quartz(db)
 
 
 def get_nexx_client(db: Session) -> NEXXClient | None:
-    integration = db.query(Integration).filter(Integration.protocol == "nexx").first()
-    if not integration:
-        return None
-    return NEXXClient(host=integration.host, api_key=integration.api_key, jwt=None)
+    return registry.nexx(db)
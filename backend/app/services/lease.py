@@ -0,0 +1,109 @@
+"""
+Leases shared between worker processes.
+
+A lease is a row in `leases` owned by one process until it expires. The holder keeps
+it alive with a heartbeat; if the holder dies, the lease simply runs out and another
+process can take it, so nothing stays locked after a crash.
+"""
+import logging
+import threading
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.state import Lease
+from app.services import notify
+from app.services.bulk import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def active_lease(db: Session, name: str) -> Lease | None:
+    """The lease row if someone currently holds it."""
+    lease = db.query(Lease).filter(Lease.name == name).first()
+    if lease and lease.owner and lease.expires_at and lease.expires_at > _utcnow():
+        return lease
+    return None
+
+
+class LeaseHolder:
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{notify.PROCESS_TOKEN}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._heartbeat: threading.Thread | None = None
+
+    def acquire(self, db: Session) -> bool:
+        """Take the lease if it is free or expired (commits)."""
+        bulk_upsert(db, Lease, [{"name": self.name}], key=("name",))
+        now = _utcnow()
+        result = db.execute(
+            update(Lease)
+            .where(Lease.name == self.name)
+            .where(or_(Lease.owner.is_(None), Lease.expires_at < now, Lease.owner == self.owner))
+            .values(owner=self.owner, expires_at=now + timedelta(seconds=self.ttl))
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def renew(self, db: Session) -> bool:
+        """Extend the lease; False if it was lost to another owner (commits)."""
+        result = db.execute(
+            update(Lease)
+            .where(Lease.name == self.name, Lease.owner == self.owner)
+            .values(expires_at=_utcnow() + timedelta(seconds=self.ttl))
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def release(self, db: Session) -> None:
+        self.stop_heartbeat()
+        db.execute(
+            update(Lease)
+            .where(Lease.name == self.name, Lease.owner == self.owner)
+            .values(owner=None, expires_at=None)
+        )
+        db.commit()
+
+    def start_heartbeat(self, on_lost: Callable[[], None] | None = None) -> None:
+        """Renew every ttl/3 from a background thread until released."""
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, args=(on_lost,),
+                                           name=f"lease-{self.name}", daemon=True)
+        self._heartbeat.start()
+
+    def stop_heartbeat(self) -> None:
+        self._stop.set()
+        if self._heartbeat and self._heartbeat is not threading.current_thread():
+            self._heartbeat.join(timeout=5)
+        self._heartbeat = None
+
+    def _beat(self, on_lost: Callable[[], None] | None) -> None:
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                with SessionLocal() as db:
+                    held = self.renew(db)
+            except Exception as e:
+                logger.warning(f"[Lease] Heartbeat for {self.name} failed: {e}")
+                continue
+            if not held:
+                logger.warning(f"[Lease] Lost {self.name}")
+                if on_lost:
+                    on_lost()
+                return
+
+
+def device_lease(protocol: str) -> LeaseHolder:
+    """Lease held while refreshing `protocol`'s device, manually or on schedule, so
+    only one sync per device runs at a time."""
+    return LeaseHolder(f"refresh:{protocol}", settings.refresh_lease_ttl)
@@ -0,0 +1,131 @@
+"""
+Change notifications between worker processes.
+
+`publish()` delivers a payload to subscribers of a channel once the session commits:
+directly in this process, and to every other process through PostgreSQL NOTIFY.
+Handlers also receive `None` after the LISTEN connection (re)connects, meaning that
+notifications may have been missed and cached state should be dropped.
+"""
+import json
+import logging
+import select
+import threading
+import uuid
+from collections.abc import Callable
+
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[str | None], None]
+
+# Identifies this process so it can skip its own NOTIFYs (already delivered locally)
+PROCESS_TOKEN = uuid.uuid4().hex[:12]
+
+_handlers: dict[str, list[Handler]] = {}
+_handlers_lock = threading.Lock()
+_listener: "_Listener | None" = None
+
+
+def subscribe(channel: str, handler: Handler) -> None:
+    with _handlers_lock:
+        _handlers.setdefault(channel, []).append(handler)
+
+
+def unsubscribe(channel: str, handler: Handler) -> None:
+    with _handlers_lock:
+        if handler in _handlers.get(channel, []):
+            _handlers[channel].remove(handler)
+
+
+def _dispatch(channel: str, payload: str | None) -> None:
+    with _handlers_lock:
+        handlers = list(_handlers.get(channel, []))
+    for handler in handlers:
+        try:
+            handler(payload)
+        except Exception as e:
+            logger.error(f"[Notify] Handler for {channel} failed: {e}", exc_info=True)
+
+
+def publish(db: Session, channel: str, payload: str = "") -> None:
+    """Notify subscribers of `channel` when `db` commits."""
+    if engine.dialect.name == "postgresql":
+        message = json.dumps({"origin": PROCESS_TOKEN, "payload": payload})
+        db.execute(text("SELECT pg_notify(:channel, :message)"), {"channel": channel, "message": message})
+    event.listen(db, "after_commit", lambda _session: _dispatch(channel, payload), once=True)
+
+
+class _Listener(threading.Thread):
+    def __init__(self):
+        super().__init__(name="pg-listener", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        delay = 1.0
+        while not self._stop_event.is_set():
+            try:
+                self._listen()
+                delay = 1.0
+            except Exception as e:
+                logger.warning(f"[Notify] LISTEN connection lost: {e}")
+            self._stop_event.wait(delay)
+            delay = min(delay * 2, 30.0)
+
+    def _listen(self) -> None:
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        conn = psycopg2.connect(dsn)
+        try:
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            listening: set[str] = set()
+            first = True
+            while not self._stop_event.is_set():
+                with _handlers_lock:
+                    channels = set(_handlers)
+                with conn.cursor() as cur:
+                    for channel in channels - listening:
+                        cur.execute(f'LISTEN "{channel}"')
+                listening |= channels
+                if first:
+                    # Anything published while we were not listening is lost
+                    for channel in listening:
+                        _dispatch(channel, None)
+                    first = False
+
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    n = conn.notifies.pop(0)
+                    try:
+                        message = json.loads(n.payload)
+                    except ValueError:
+                        message = {"payload": n.payload}
+                    if message.get("origin") != PROCESS_TOKEN:
+                        _dispatch(n.channel, message.get("payload"))
+        finally:
+            conn.close()
+
+
+def start() -> None:
+    global _listener
+    if engine.dialect.name != "postgresql" or _listener is not None:
+        return
+    _listener = _Listener()
+    _listener.start()
+
+
+def stop() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.join(timeout=5)
+        _listener = None
@@ -0,0 +1,222 @@
+"""
+Latest-wins write queue for NEXX parameters.
+
+Interactive edits (UMD controls, typing) arrive faster than the frame takes writes.
+Each frame gets a queue of pending writes keyed by varid: a new value for a varid that
+has not been sent yet replaces the old one, so only the latest value goes out. One
+sender per frame takes everything pending as a single set_parameters batch and waits
+for it before sending the next, so writes to the same varid reach the frame in order.
+
+Queues are per process. Across workers, writes are ordered by the stamp they get
+when submitted. Before a batch goes out, a short transaction reserves each varid's
+stamp and value in param_stamps, dropping writes older than the last one reserved.
+No lock is held while the frame is written. Afterwards, if another worker reserved a
+newer value in the meantime, it may have reached the frame first, so that value is
+sent again; whichever send lands last, the frame ends up with the newest value.
+
+Failed writes are retried a few times with backoff.
+
+Handlers return once their writes are queued. When a batch is acknowledged the values
+are recorded in the cached state, which bumps its version and reaches clients through
+the state endpoints and the event stream. When it fails for good, the rows are
+re-stamped unchanged so clients drop the values they showed optimistically.
+"""
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass, field, replace
+
+from sqlalchemy import inspect
+
+from app.clients import device_loop
+from app.clients.breaker import backoff_delay
+from app.clients.nexx import AsyncNEXXClient, NEXXClient
+from app.database import SessionLocal
+from app.models.state import ParamStamp
+from app.services.bulk import bulk_upsert
+from app.services.state_cache import next_version, publish_state_change
+
+logger = logging.getLogger(__name__)
+
+# Further attempts at a write after the frame rejected it or could not be reached
+WRITE_RETRIES = 2
+
+_stamp_lock = threading.Lock()
+_last_stamp = 0
+
+
+def _next_stamp() -> int:
+    """Wall clock in ns, strictly increasing within the process."""
+    global _last_stamp
+    with _stamp_lock:
+        _last_stamp = max(time.time_ns(), _last_stamp + 1)
+        return _last_stamp
+
+
+@dataclass(frozen=True)
+class ParamWrite:
+    """A NEXX varid write and the cached state column it sets, e.g. StateUMD (mv_id, window, layer).box_x."""
+    varid: str
+    value: str
+    model: type
+    key: tuple
+    column: str
+    typed: object
+    stamp: int = field(default_factory=_next_stamp)
+    attempt: int = 0
+    # Re-send of another worker's newer value; that worker records it in the cached state
+    echo: bool = False
+
+
+class ParamQueue:
+    def __init__(self, client: AsyncNEXXClient):
+        self.client = client
+        self._lock = threading.Lock()
+        self._pending: dict[str, ParamWrite] = {}
+        # varid → latest value queued or in flight, until its batch is recorded
+        self._outstanding: dict[str, str] = {}
+        self._sending = False
+
+    def outstanding(self) -> dict[str, str]:
+        """Values not yet recorded in the cached state.
+
+        Read it before the cached state: a batch is recorded before it leaves here.
+        """
+        with self._lock:
+            return dict(self._outstanding)
+
+    def submit(self, writes: list[ParamWrite]) -> None:
+        if not writes:
+            return
+        with self._lock:
+            for w in writes:
+                # Re-inserting moves the varid to the end, keeping the batch in submission order
+                self._pending.pop(w.varid, None)
+                self._pending[w.varid] = w
+                self._outstanding[w.varid] = w.value
+            if self._sending:
+                return
+            self._sending = True
+        device_loop.submit(self._send())
+
+    async def _send(self) -> None:
+        while True:
+            with self._lock:
+                batch = list(self._pending.values())
+                self._pending.clear()
+                if not batch:
+                    self._sending = False
+                    return
+            frame = self.client.base_url
+            try:
+                fresh = await asyncio.to_thread(_reserve, frame, batch)
+            except Exception as e:
+                logger.error(f"[Param Queue] Failed to reserve {len(batch)} params: {e}", exc_info=True)
+                self._settle(batch)
+                continue
+            ok = True
+            if fresh:
+                try:
+                    await self.client.set_parameters([w.varid for w in fresh], [w.value for w in fresh])
+                except Exception as e:
+                    ok = False
+                    logger.warning(f"[Param Queue] Writing {len(fresh)} params to {frame} failed: {e}")
+            retry = [] if ok else [w for w in fresh if w.attempt < WRITE_RETRIES]
+            if retry:
+                self._requeue([replace(w, attempt=w.attempt + 1) for w in retry])
+                fresh = [w for w in fresh if w.attempt >= WRITE_RETRIES]
+            try:
+                newer = await asyncio.to_thread(_record, frame, fresh, ok)
+            except Exception as e:
+                logger.error(f"[Param Queue] Failed to record {len(batch)} params: {e}", exc_info=True)
+                newer = []
+            self._requeue(newer)
+            self._settle(batch)
+            if retry:
+                await asyncio.sleep(backoff_delay(min(w.attempt for w in retry)))
+
+    def _requeue(self, writes: list[ParamWrite]) -> None:
+        """Queue `writes` again unless a newer write to the same varid is pending."""
+        with self._lock:
+            for w in writes:
+                pending = self._pending.get(w.varid)
+                if pending is None or pending.stamp < w.stamp:
+                    self._pending[w.varid] = w
+
+    def _settle(self, batch: list[ParamWrite]) -> None:
+        with self._lock:
+            for w in batch:
+                # An echo replaced the local write to its varid, which is settled with it
+                if w.varid not in self._pending and (w.echo or self._outstanding.get(w.varid) == w.value):
+                    del self._outstanding[w.varid]
+
+
+def _reserve(frame: str, batch: list[ParamWrite]) -> list[ParamWrite]:
+    """Return the writes at least as new as the last ones reserved for their varids on
+    `frame`, and reserve their stamps and values."""
+    with SessionLocal() as db:
+        varids = sorted({w.varid for w in batch})
+        bulk_upsert(db, ParamStamp, [{"frame": frame, "varid": v} for v in varids],
+                    key=("frame", "varid"), stamp={"stamp": 0})
+        reserved = dict(db.query(ParamStamp.varid, ParamStamp.stamp)
+                        .filter(ParamStamp.frame == frame, ParamStamp.varid.in_(varids))
+                        .order_by(ParamStamp.varid).with_for_update())
+        fresh = [w for w in batch if w.stamp >= reserved.get(w.varid, 0)]
+        bulk_upsert(db, ParamStamp, [{"frame": frame, "varid": w.varid, "stamp": w.stamp, "value": w.value}
+                                     for w in fresh], key=("frame", "varid"))
+        db.commit()
+        return fresh
+
+
+def _record(frame: str, batch: list[ParamWrite], ok: bool) -> list[ParamWrite]:
+    """Write acknowledged values to the cached state, or only re-stamp the rows after a failure.
+
+    Returns the newer values other workers reserved for these varids meanwhile, to send
+    again; those workers record them.
+    """
+    if not batch:
+        return []
+    with SessionLocal() as db:
+        newer = []
+        if ok:
+            reserved = {r.varid: r for r in db.query(ParamStamp).filter(
+                ParamStamp.frame == frame, ParamStamp.varid.in_([w.varid for w in batch]))}
+            for w in batch:
+                r = reserved.get(w.varid)
+                if r is not None and r.stamp > w.stamp:
+                    newer.append(replace(w, value=r.value, stamp=r.stamp, attempt=0, echo=True))
+        # Superseded values stay out of the cached state; the newer ones are recorded by their worker
+        superseded = {w.varid for w in newer}
+        own = [w for w in batch if not w.echo and w.varid not in superseded]
+        version = next_version(db) if own else None
+        mv_ids = set()
+        for w in own:
+            row = db.get(w.model, w.key)
+            if row is None:
+                if not ok:
+                    continue
+                row = w.model(**{c.key: v for c, v in zip(inspect(w.model).primary_key, w.key)})
+                db.add(row)
+            if ok:
+                setattr(row, w.column, w.typed)
+            row.version = version
+            mv_ids.add(w.key[0])
+        for mv_id in mv_ids:
+            publish_state_change(db, "mv", mv_id)
+        db.commit()
+        return newer
+
+
+_queues: dict[str, ParamQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def queue_for(nexx: NEXXClient) -> ParamQueue:
+    """The queue of the frame `nexx` talks to; it sends with the latest client (credentials)."""
+    with _queues_lock:
+        q = _queues.get(nexx.base_url)
+        if q is None:
+            q = _queues[nexx.base_url] = ParamQueue(nexx.aio)
+        q.client = nexx.aio
+        return q
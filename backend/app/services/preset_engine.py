@@ -0,0 +1,282 @@
+"""
+Preset application.
+
+A preset payload is compiled into a plan of NEXX parameter writes per target MV and
+Quartz crosspoint switches. Values that already match the cached state are dropped
+from the plan; the rest run concurrently on the device loop (NEXX in 40-parameter
+batches, Quartz over the pooled connections shared with salvos) and the cached state
+is updated for what succeeded, batch by batch.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from sqlalchemy.orm import Session
+
+from app.clients import device_loop
+from app.clients.nexx import NEXXClient
+from app.clients.quartz import AsyncQuartzClient
+from app.models.multiviewer import Multiviewer
+from app.models.state import UMD_COLUMNS, StateMV, StateWindow, StateUMD, StateRouting
+from app.protocol_mappings import (
+    VARID_MV_LAYOUT, VARID_MV_FONT, VARID_MV_OUTPUT_FORMAT,
+    VARID_MV_OUTER_BORDER, VARID_MV_INNER_BORDER,
+    VARID_PCM_BARS, MAX_BATCH_PARAMS, pcm_value_to_index,
+)
+from app.services import routing_journal
+from app.services.state import apply_routing_updates, umd_columns
+from app.services.state_cache import next_version, publish_state_change
+
+logger = logging.getLogger(__name__)
+
+# StateMV attribute → varid, per preset category
+MV_PARAM_VARIDS = {
+    "layout": {"layout": VARID_MV_LAYOUT},
+    "mv_params": {
+        "font": VARID_MV_FONT,
+        "output_format": VARID_MV_OUTPUT_FORMAT,
+        "outer_border": VARID_MV_OUTER_BORDER,
+        "inner_border": VARID_MV_INNER_BORDER,
+    },
+}
+
+
+@dataclass
+class MVPlan:
+    mv_id: int
+    nexx_index: int
+    mv_params: dict[str, int] = field(default_factory=dict)  # StateMV attr → value
+    pcm: dict[int, int] = field(default_factory=dict)  # window → pcm_bars
+    umd: dict[tuple[int, int], dict[str, str]] = field(default_factory=dict)  # (window, layer) → varid → value
+
+    def writes(self) -> dict[str, str]:
+        writes = {}
+        for category in MV_PARAM_VARIDS.values():
+            for attr, varid in category.items():
+                if attr in self.mv_params:
+                    writes[f"{varid}.{self.nexx_index}"] = str(self.mv_params[attr])
+        for win_idx, pcm_bars in self.pcm.items():
+            writes[f"{VARID_PCM_BARS}.{self.nexx_index}.{win_idx}"] = str(pcm_value_to_index(pcm_bars))
+        for (win_idx, layer_idx), layer in self.umd.items():
+            for varid_base, value in layer.items():
+                writes[f"{varid_base}.{self.nexx_index}.{win_idx}.{layer_idx}"] = value
+        return writes
+
+    def only(self, varids: set[str]) -> "MVPlan":
+        """The part of this plan whose writes are in `varids`."""
+        part = MVPlan(mv_id=self.mv_id, nexx_index=self.nexx_index)
+        for category in MV_PARAM_VARIDS.values():
+            for attr, varid in category.items():
+                if attr in self.mv_params and f"{varid}.{self.nexx_index}" in varids:
+                    part.mv_params[attr] = self.mv_params[attr]
+        for win_idx, pcm_bars in self.pcm.items():
+            if f"{VARID_PCM_BARS}.{self.nexx_index}.{win_idx}" in varids:
+                part.pcm[win_idx] = pcm_bars
+        for (win_idx, layer_idx), layer in self.umd.items():
+            written = {varid_base: value for varid_base, value in layer.items()
+                       if f"{varid_base}.{self.nexx_index}.{win_idx}.{layer_idx}" in varids}
+            if written:
+                part.umd[(win_idx, layer_idx)] = written
+        return part
+
+
+@dataclass
+class PresetPlan:
+    mvs: list[MVPlan] = field(default_factory=list)
+    switches: dict[int, int] = field(default_factory=dict)  # output → input
+    skipped: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "nexx": [{"mv_id": mv.mv_id, "nexx_index": mv.nexx_index, "writes": mv.writes()} for mv in self.mvs],
+            "switches": [{"output": out, "input": inp} for out, inp in self.switches.items()],
+            "skipped": self.skipped,
+        }
+
+
+def _same(cached, value) -> bool:
+    return cached is not None and str(cached) == str(value)
+
+
+def compile_plan(db: Session, payload: dict, categories: set[str], targets: dict[str, int]) -> PresetPlan:
+    """Turn a preset payload into the writes that differ from the cached state."""
+    # Support both old format (single MV) and new format (multi-MV)
+    mvs_data = payload.get("mvs")
+    if mvs_data is None:
+        # Legacy single-MV format
+        mvs_data = [{"mv_nexx_index": payload.get("mv_nexx_index"), **payload.get("params", {})}]
+
+    target_ids = [mv_id for mv_id in (targets.get(str(m.get("mv_nexx_index"))) for m in mvs_data) if mv_id is not None]
+    mv_by_id = {mv.id: mv for mv in db.query(Multiviewer).filter(Multiviewer.id.in_(target_ids)).all()}
+    state_mv_by_id = {s.mv_id: s for s in db.query(StateMV).filter(StateMV.mv_id.in_(list(mv_by_id))).all()}
+    state_win_by_key = {(s.mv_id, s.window_index): s for s in db.query(StateWindow).filter(
+        StateWindow.mv_id.in_(list(mv_by_id))
+    ).all()}
+    state_umd_by_key = {(s.mv_id, s.window_index, s.layer): s for s in db.query(StateUMD).filter(
+        StateUMD.mv_id.in_(list(mv_by_id))
+    ).all()} if "umd" in categories else {}
+
+    plan = PresetPlan()
+    requested_switches = {}
+    for saved_mv in mvs_data:
+        target_mv = mv_by_id.get(targets.get(str(saved_mv.get("mv_nexx_index"))))
+        if not target_mv:
+            continue
+        mv_plan = MVPlan(mv_id=target_mv.id, nexx_index=target_mv.nexx_index)
+
+        state = state_mv_by_id.get(target_mv.id)
+        for category, attrs in MV_PARAM_VARIDS.items():
+            if category not in categories:
+                continue
+            for attr in attrs:
+                if attr not in saved_mv:
+                    continue
+                if state and _same(getattr(state, attr), saved_mv[attr]):
+                    plan.skipped += 1
+                else:
+                    mv_plan.mv_params[attr] = saved_mv[attr]
+
+        for win in saved_mv.get("windows", []):
+            win_idx = win.get("index")
+            if win_idx is None:
+                continue
+            win_state = state_win_by_key.get((target_mv.id, win_idx))
+
+            if "pcm" in categories and "pcm_bars" in win:
+                if win_state and _same(win_state.pcm_bars, win["pcm_bars"]):
+                    plan.skipped += 1
+                else:
+                    mv_plan.pcm[win_idx] = win["pcm_bars"]
+
+            if "umd" in categories:
+                for layer_idx, layer_data in enumerate(win.get("umd", [])):
+                    cached_layer = state_umd_by_key.get((target_mv.id, win_idx, layer_idx))
+                    for varid_base, value in layer_data.items():
+                        column = UMD_COLUMNS.get(varid_base)
+                        if column is None:
+                            continue
+                        if cached_layer and _same(getattr(cached_layer, column), value):
+                            plan.skipped += 1
+                        else:
+                            mv_plan.umd.setdefault((win_idx, layer_idx), {})[varid_base] = str(value)
+
+            if "sources" in categories and win.get("source_input") is not None:
+                output = target_mv.nexx_index * 16 + win_idx + 1
+                requested_switches[output] = win["source_input"]
+
+        if mv_plan.writes():
+            plan.mvs.append(mv_plan)
+
+    if requested_switches:
+        cached_routing = {r.output: r.input for r in db.query(StateRouting).filter(
+            StateRouting.output.in_(list(requested_switches))
+        ).all()}
+        for output, inp in requested_switches.items():
+            if cached_routing.get(output) == inp:
+                plan.skipped += 1
+            else:
+                plan.switches[output] = inp
+
+    return plan
+
+
+def _batches(mv: MVPlan) -> list[dict[str, str]]:
+    items = list(mv.writes().items())
+    return [dict(items[i:i + MAX_BATCH_PARAMS]) for i in range(0, len(items), MAX_BATCH_PARAMS)]
+
+
+async def _execute(batches: list[tuple[MVPlan, dict[str, str]]], nexx: NEXXClient | None,
+                   quartz: AsyncQuartzClient | None, switches: dict[int, int]) -> tuple[list, list]:
+    nexx_jobs = [nexx.aio.set_parameters(list(writes), list(writes.values())) for _, writes in batches]
+    switch_jobs = [quartz.switch(out, inp) for out, inp in switches.items()] if quartz else []
+    return await asyncio.gather(
+        asyncio.gather(*nexx_jobs, return_exceptions=True),
+        asyncio.gather(*switch_jobs, return_exceptions=True),
+    )
+
+
+def execute_plan(db: Session, plan: PresetPlan, nexx: NEXXClient | None,
+                 quartz: AsyncQuartzClient | None, user_id: int | None = None) -> dict:
+    """Run the plan and record what succeeded in the cached state (commits).
+
+    `quartz` should be the registry's pooled client. Each NEXX batch succeeds or fails
+    on its own: an MV is written in part when only some of its batches went through.
+    """
+    started = time.monotonic()
+    batches = [(mv, writes) for mv in plan.mvs for writes in _batches(mv)] if nexx else []
+    switches = plan.switches if quartz else {}
+    nexx_results, switch_results = device_loop.run_sync(_execute(batches, nexx, quartz, switches))
+    results = {"mvs_written": 0, "mvs_partial": 0, "params_written": 0, "params_failed": 0,
+               "switches": 0, "skipped": plan.skipped, "errors": []}
+
+    written: dict[int, set[str]] = {}
+    failed: dict[int, int] = {}
+    for (mv, writes), outcome in zip(batches, nexx_results):
+        if isinstance(outcome, Exception):
+            failed[mv.mv_id] = failed.get(mv.mv_id, 0) + len(writes)
+            results["errors"].append(f"MV {mv.nexx_index}: {len(writes)} params failed "
+                                     f"({', '.join(writes)}): {outcome}")
+        else:
+            written.setdefault(mv.mv_id, set()).update(writes)
+
+    now = datetime.now(timezone.utc)
+    for mv in plan.mvs if nexx else []:
+        if mv.mv_id in written:
+            results["mvs_partial" if mv.mv_id in failed else "mvs_written"] += 1
+            results["params_written"] += len(written[mv.mv_id])
+            _update_cached_mv(db, mv.only(written[mv.mv_id]), now)
+        results["params_failed"] += failed.get(mv.mv_id, 0)
+
+    switched = {}
+    for (output, inp), outcome in zip(switches.items(), switch_results):
+        if isinstance(outcome, Exception):
+            results["errors"].append(f"Output {output}: {outcome}")
+        else:
+            switched[output] = inp
+    apply_routing_updates(db, switched, routing_journal.ORIGIN_PRESET, user_id)
+    results["switches"] = len(switched)
+
+    db.commit()
+    results["duration_ms"] = round((time.monotonic() - started) * 1000, 1)
+    logger.info(f"[Presets] Applied {results['params_written']} params on {results['mvs_written']} MVs "
+                f"({results['mvs_partial']} in part, {results['params_failed']} params failed), "
+                f"{results['switches']} switches, skipped {plan.skipped} in {results['duration_ms']} ms")
+    return results
+
+
+def _update_cached_mv(db: Session, mv: MVPlan, now: datetime) -> None:
+    version = next_version(db)
+    publish_state_change(db, "mv", mv.mv_id)
+    if mv.mv_params:
+        state = db.query(StateMV).filter(StateMV.mv_id == mv.mv_id).first()
+        if state:
+            for attr, value in mv.mv_params.items():
+                setattr(state, attr, value)
+            state.version = version
+            state.updated_at = now
+
+    if mv.pcm:
+        for win_state in db.query(StateWindow).filter(
+            StateWindow.mv_id == mv.mv_id, StateWindow.window_index.in_(list(mv.pcm))
+        ).all():
+            win_state.pcm_bars = mv.pcm[win_state.window_index]
+            win_state.version = version
+            win_state.updated_at = now
+
+    if not mv.umd:
+        return
+    umd_rows = {(r.window_index, r.layer): r for r in db.query(StateUMD).filter(
+        StateUMD.mv_id == mv.mv_id, StateUMD.window_index.in_(list({w for w, _ in mv.umd}))
+    ).all()}
+    for (win_idx, layer_idx), data in mv.umd.items():
+        changes = umd_columns(data)
+        row = umd_rows.get((win_idx, layer_idx))
+        if row:
+            for column, value in changes.items():
+                setattr(row, column, value)
+            row.version = version
+            row.updated_at = now
+        else:
+            db.add(StateUMD(mv_id=mv.mv_id, window_index=win_idx, layer=layer_idx, version=version, **changes))
@@ -0,0 +1,46 @@
+import threading
+
+
+class RefreshCancelled(Exception):
+    pass
+
+
+class Progress:
+    """Per-phase counters of a running refresh, updated from worker threads.
+
+    `version` increases on every change so readers can poll cheaply. Device work
+    calls `check()` between steps and stops with RefreshCancelled once cancelled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases: dict[str, dict[str, int]] = {}
+        self._cancelled = threading.Event()
+        self.version = 0
+
+    def set_total(self, phase: str, total: int) -> None:
+        with self._lock:
+            self._phases.setdefault(phase, {"done": 0, "errors": 0})["total"] = total
+            self.version += 1
+
+    def advance(self, phase: str, done: int = 1, errors: int = 0) -> None:
+        with self._lock:
+            counts = self._phases.setdefault(phase, {"done": 0, "errors": 0})
+            counts["done"] += done
+            counts["errors"] += errors
+            self.version += 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        with self._lock:
+            return {phase: dict(counts) for phase, counts in self._phases.items()}
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def check(self) -> None:
+        if self._cancelled.is_set():
+            raise RefreshCancelled("Refresh cancelled")
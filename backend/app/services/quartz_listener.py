@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import re
+import time
+
+from sqlalchemy.orm import Session
+
+from app.clients.quartz import AsyncQuartzClient, QuartzFramer
+from app.config import settings
+from app.database import SessionLocal
+from app.services import notify, routing_journal
+from app.services.integration import INTEGRATIONS_CHANNEL, get_integration_config
+from app.services.lease import LeaseHolder, active_lease
+from app.services.state import apply_routing_updates
+
+logger = logging.getLogger(__name__)
+
+# .U{levels}{dest},{src} — unsolicited crosspoint change, e.g. ".UV12,34"
+UPDATE_RE = re.compile(r"^\.U([A-Z]+)(\d+),(\d+)$")
+
+FLUSH_INTERVAL = 0.05
+RECONNECT_MIN = 1.0
+RECONNECT_MAX = 30.0
+STABLE_SESSION_SECONDS = 60
+# One process follows the router; the others wait for the lease
+LEASE_NAME = "quartz-listener"
+LEASE_TTL = 30.0
+# Held while a session is connected and resynced; the scheduled crosspoint poll is skipped meanwhile
+LIVE_LEASE_NAME = "quartz-listener:live"
+
+
+def parse_update(line: str) -> tuple[int, int] | None:
+    """Return (output, input) for a video-level .U update, None for anything else."""
+    m = UPDATE_RE.match(line)
+    if not m or "V" not in m.group(1):
+        return None
+    return int(m.group(2)), int(m.group(3))
+
+
+def listener_live(db: Session) -> bool:
+    """Whether a listener is following the router's crosspoint updates."""
+    return active_lease(db, LIVE_LEASE_NAME) is not None
+
+
+def _load_integration() -> tuple[str, int, int] | None:
+    with SessionLocal() as db:
+        qi = get_integration_config(db, "quartz")
+        if not qi:
+            return None
+        return qi.host, qi.port or 6543, qi.max_outputs or 960
+
+
+def _persist(routing: dict[int, int]) -> None:
+    with SessionLocal() as db:
+        apply_routing_updates(db, routing, routing_journal.ORIGIN_LISTENER)
+        db.commit()
+
+
+class QuartzListener:
+    """Keeps a connection to the router open and applies .U crosspoint updates to StateRouting.
+
+    Every (re)connect starts with a full .IV poll so changes missed while disconnected are
+    picked up; after that the state follows the router's update messages. A change of
+    the Quartz integration drops the session and reconnects with the new settings.
+
+    Every web worker starts a listener, but only the one holding the quartz-listener
+    lease connects; the others stand by and take over if the holder goes away. While
+    its session is up it also holds the quartz-listener:live lease (see listener_live).
+    """
+
+    def __init__(self):
+        self._task: asyncio.Task | None = None
+        self._session: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._lease = LeaseHolder(LEASE_NAME, LEASE_TTL)
+        self._live = LeaseHolder(LIVE_LEASE_NAME, LEASE_TTL)
+        self._holding = False
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        notify.subscribe(INTEGRATIONS_CHANNEL, self._on_integration_change)
+
+    def _on_integration_change(self, protocol: str | None) -> None:
+        # Called from request or LISTEN threads
+        if protocol in (None, "quartz") and self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._reconnect)
+
+    def _reconnect(self) -> None:
+        self._wake.set()
+        if self._session and not self._session.done():
+            self._session.cancel()
+
+    async def stop(self) -> None:
+        notify.unsubscribe(INTEGRATIONS_CHANNEL, self._on_integration_change)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._holding:
+            self._holding = False
+            await asyncio.to_thread(self._release_lease)
+
+    async def _take_lease(self) -> bool:
+        if self._holding:
+            return True
+        if not await asyncio.to_thread(self._acquire_lease):
+            return False
+        self._holding = True
+        self._lease.start_heartbeat(on_lost=self._on_lease_lost)
+        logger.info("[Quartz Listener] Took the listener lease")
+        return True
+
+    def _acquire_lease(self) -> bool:
+        with SessionLocal() as db:
+            return self._lease.acquire(db)
+
+    def _release_lease(self) -> None:
+        with SessionLocal() as db:
+            self._lease.release(db)
+
+    def _mark_live(self) -> None:
+        with SessionLocal() as db:
+            if self._live.acquire(db):
+                self._live.start_heartbeat()
+            else:
+                # A dead holder's marker; it expires within LEASE_TTL
+                logger.debug("[Quartz Listener] Live lease still held elsewhere")
+
+    def _unmark_live(self) -> None:
+        try:
+            with SessionLocal() as db:
+                self._live.release(db)
+        except Exception as e:
+            logger.warning(f"[Quartz Listener] Failed to release the live lease, it will expire: {e}")
+
+    def _on_lease_lost(self) -> None:
+        # Called from the heartbeat thread
+        if self._loop and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._lease_lost)
+
+    def _lease_lost(self) -> None:
+        self._holding = False
+        if self._session and not self._session.done():
+            self._session.cancel()
+
+    async def _run(self) -> None:
+        delay = RECONNECT_MIN
+        while True:
+            started = time.monotonic()
+            try:
+                config = await asyncio.to_thread(_load_integration)
+                if not config:
+                    delay = RECONNECT_MAX
+                elif not await self._take_lease():
+                    delay = LEASE_TTL
+                else:
+                    self._session = asyncio.create_task(self._listen(*config))
+                    await self._session
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                if self._holding:
+                    logger.info("[Quartz Listener] Integration changed, reconnecting")
+                else:
+                    logger.warning("[Quartz Listener] Lost the listener lease, standing by")
+                delay = 0
+            except Exception as e:
+                logger.warning(f"[Quartz Listener] {e}")
+
+            if time.monotonic() - started > STABLE_SESSION_SECONDS:
+                delay = RECONNECT_MIN
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            delay = min(max(delay * 2, RECONNECT_MIN), RECONNECT_MAX)
+
+    async def _listen(self, host: str, port: int, max_outputs: int) -> None:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 5)
+        logger.info(f"[Quartz Listener] Connected to {host}:{port}")
+        try:
+            # Updates that arrive during the resync wait in the socket buffer and are applied after it
+            await self._resync(host, port, max_outputs)
+            await asyncio.to_thread(self._mark_live)
+
+            loop = asyncio.get_running_loop()
+            framer = QuartzFramer()
+            pending: dict[int, int] = {}
+            flush_at = 0.0
+            while True:
+                timeout = max(flush_at - loop.time(), 0) if pending else None
+                try:
+                    data = await asyncio.wait_for(reader.read(4096), timeout)
+                except asyncio.TimeoutError:
+                    data = None
+
+                if data == b"":
+                    logger.info("[Quartz Listener] Connection closed by router")
+                    break
+                if data:
+                    framer.feed(data)
+                    while (line := framer.next_line()) is not None:
+                        update = parse_update(line)
+                        if update:
+                            if not pending:
+                                flush_at = loop.time() + FLUSH_INTERVAL
+                            out, inp = update
+                            pending[out] = inp
+
+                if pending and loop.time() >= flush_at:
+                    batch, pending = pending, {}
+                    await asyncio.to_thread(_persist, batch)
+                    logger.debug(f"[Quartz Listener] Applied {len(batch)} crosspoint updates")
+
+            if pending:
+                await asyncio.to_thread(_persist, pending)
+        finally:
+            writer.close()
+            await asyncio.shield(asyncio.to_thread(self._unmark_live))
+
+    async def _resync(self, host: str, port: int, max_outputs: int) -> None:
+        quartz = AsyncQuartzClient(host=host, port=port,
+                                   max_in_flight=settings.quartz_max_in_flight,
+                                   connections=settings.quartz_connections)
+        async with quartz:
+            routes = await quartz.read_routings(list(range(1, max_outputs + 1)))
+        routing = {out: inp for out, inp in routes.items() if not isinstance(inp, Exception)}
+        await asyncio.to_thread(_persist, routing)
+        logger.info(f"[Quartz Listener] Resynced {len(routing)}/{max_outputs} routes")
@@ -0,0 +1,367 @@
+"""
+Manual refresh jobs.
+
+A refresh runs in a background thread of the web worker; the request that starts it
+only gets the job id. Progress is read from the job while it runs and the final
+result is also stored in RefreshStatus for /api/refresh/status.
+
+Requests are single-flight: one whose scope the running job already covers joins
+it, and the rest are merged into one queued job over the union of their scopes,
+which starts as soon as the running one ends.
+
+Across workers, the job holding the refresh lease keeps a snapshot of itself in
+RefreshStatus, next to those of the last few jobs. A request on another worker that the job covers joins it there and
+polls that snapshot, which carries status and requesters but not live progress; any
+other request gets a local job that waits for the lease.
+
+Each device is refreshed under its device lease, shared with the scheduled syncs, so
+a manual refresh waits for a scheduled sync of the same device to finish, however
+long it takes; a holder that dies stops renewing and its lease expires.
+
+A job in which some devices failed ends "partial", or "failed" if none was refreshed.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.state import RefreshStatus
+from app.services.integration import get_async_quartz_client, get_integration_config, get_nexx_client
+from app.services.lease import LeaseHolder, active_lease, device_lease
+from app.services.progress import Progress, RefreshCancelled
+from app.services.state import refresh_nexx_state, refresh_quartz_state
+
+logger = logging.getLogger(__name__)
+
+# Finished jobs kept for late progress readers
+MAX_FINISHED_JOBS = 20
+
+# Job snapshots kept in RefreshStatus for readers on other workers
+MAX_SHARED_JOBS = 5
+
+# Held by whichever worker process runs a manual refresh
+REFRESH_LEASE = "refresh"
+LEASE_POLL = 0.5
+
+
+def _union(a: list[int] | None, b: list[int] | None) -> list[int] | None:
+    if a is None or b is None:
+        return None
+    return sorted(set(a) | set(b))
+
+
+def _covers(a: list[int] | None, b: list[int] | None) -> bool:
+    return a is None or (b is not None and set(b) <= set(a))
+
+
+@dataclass(frozen=True)
+class RefreshScope:
+    """What to refresh; None means everything."""
+    mv_indices: list[int] | None = None
+    source_inputs: list[int] | None = None
+    output_range: list[int] | None = None
+
+    def covers(self, other: "RefreshScope") -> bool:
+        return (_covers(self.mv_indices, other.mv_indices)
+                and _covers(self.source_inputs, other.source_inputs)
+                and _covers(self.output_range, other.output_range))
+
+    def union(self, other: "RefreshScope") -> "RefreshScope":
+        return RefreshScope(
+            mv_indices=_union(self.mv_indices, other.mv_indices),
+            source_inputs=_union(self.source_inputs, other.source_inputs),
+            output_range=_union(self.output_range, other.output_range),
+        )
+
+
+class RefreshJob:
+    def __init__(self, started_by: str, scope: RefreshScope, status: str = "running"):
+        self.id = uuid.uuid4().hex
+        self.started_by = started_by
+        self.requested_by = [started_by]
+        self.scope = scope
+        self.status = status
+        self.progress = Progress()
+        self.result: dict | None = None
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at: datetime | None = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in ("queued", "running")
+
+    def add_requester(self, login: str) -> None:
+        if login not in self.requested_by:
+            self.requested_by.append(login)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "started_by": self.started_by,
+            "requested_by": list(self.requested_by),
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "scope": asdict(self.scope),
+            "cancel_requested": self.progress.cancelled,
+            "phases": self.progress.snapshot(),
+            "result": self.result,
+        }
+
+
+@contextmanager
+def _device_refresh(protocol: str, progress: Progress | None):
+    """Hold the device lease of `protocol`, waiting out a scheduled sync that has it."""
+    lease = device_lease(protocol)
+    while True:
+        with SessionLocal() as db:
+            if lease.acquire(db):
+                break
+        if progress:
+            progress.check()
+        time.sleep(LEASE_POLL)
+    lease.start_heartbeat(on_lost=progress.cancel if progress else None)
+    try:
+        yield
+    finally:
+        with SessionLocal() as db:
+            lease.release(db)
+
+
+def run_refresh(db: Session, scope: RefreshScope, progress: Progress | None = None) -> dict:
+    """Refresh NEXX and Quartz state for `scope`. Raises RefreshCancelled if cancelled."""
+    results = {"nexx": None, "quartz": None, "timestamp": datetime.now(timezone.utc).isoformat(), "errors": []}
+
+    nexx = get_nexx_client(db)
+    if nexx:
+        try:
+            with _device_refresh("nexx", progress):
+                results["nexx"] = refresh_nexx_state(db, nexx, mv_indices=scope.mv_indices, progress=progress)
+        except RefreshCancelled:
+            raise
+        except Exception as e:
+            db.rollback()
+            results["errors"].append(f"NEXX error: {str(e)}")
+            results["nexx"] = {"error": str(e)}
+
+    quartz = get_async_quartz_client(db)
+    if quartz:
+        try:
+            qi = get_integration_config(db, "quartz")
+            max_inputs = qi.max_inputs if qi and qi.max_inputs else 960
+            max_outputs = qi.max_outputs if qi and qi.max_outputs else 960
+            with _device_refresh("quartz", progress):
+                results["quartz"] = refresh_quartz_state(
+                    db, quartz, max_sources=max_inputs, max_outputs=max_outputs,
+                    source_inputs=scope.source_inputs, output_range=scope.output_range, progress=progress,
+                )
+        except RefreshCancelled:
+            raise
+        except Exception as e:
+            db.rollback()
+            results["errors"].append(f"Quartz error: {str(e)}")
+            results["quartz"] = {"error": str(e)}
+
+    return results
+
+
+def _outcome(result: dict) -> str:
+    if not result["errors"]:
+        return "completed"
+    refreshed = any(isinstance(r, dict) and "error" not in r for r in (result["nexx"], result["quartz"]))
+    return "partial" if refreshed else "failed"
+
+
+def _shared_jobs(status: RefreshStatus | None) -> dict[str, dict]:
+    return json.loads(status.jobs_json) if status and status.jobs_json else {}
+
+
+def _save_job(db: Session, job: RefreshJob, status_value: str | None = None) -> RefreshStatus:
+    """Write the job's snapshot to RefreshStatus, keeping requesters other workers added
+    to it (caller commits)."""
+    status = db.query(RefreshStatus).filter(RefreshStatus.id == 1).with_for_update().first()
+    if not status:
+        status = RefreshStatus(id=1)
+        db.add(status)
+    shared = _shared_jobs(status)
+    for login in shared.pop(job.id, {}).get("requested_by", []):
+        job.add_requester(login)
+    view = job.to_dict()
+    if status_value:
+        view["status"] = status_value
+    shared[job.id] = view
+    status.job_id = job.id
+    status.jobs_json = json.dumps(dict(list(shared.items())[-MAX_SHARED_JOBS:]))
+    return status
+
+
+def _mark_started(db: Session, job: RefreshJob) -> None:
+    status = _save_job(db, job)
+    status.is_running = True
+    status.started_at = datetime.now(timezone.utc)
+    status.started_by = ", ".join(job.requested_by)
+    db.commit()
+
+
+class RefreshJobManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: dict[str, RefreshJob] = {}
+        self._running: RefreshJob | None = None
+        self._queued: RefreshJob | None = None
+
+    def join(self, login: str, scope: RefreshScope) -> RefreshJob | None:
+        """Attach to the running or queued job if there is one; None if idle."""
+        with self._lock:
+            return self._join(login, scope)
+
+    def _join(self, login: str, scope: RefreshScope) -> RefreshJob | None:
+        if self._running is None:
+            return None
+        if self._running.scope.covers(scope):
+            self._running.add_requester(login)
+            return self._running
+        if self._queued is None:
+            self._queued = RefreshJob(login, scope, status="queued")
+            self._jobs[self._queued.id] = self._queued
+        else:
+            self._queued.scope = self._queued.scope.union(scope)
+            self._queued.add_requester(login)
+        return self._queued
+
+    def recent(self, scope: RefreshScope, max_age: float) -> RefreshJob | None:
+        """A job completed within `max_age` seconds whose scope covers `scope`."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            for job in self._jobs.values():
+                if (job.status == "completed" and job.scope.covers(scope)
+                        and (now - job.finished_at).total_seconds() < max_age):
+                    return job
+        return None
+
+    def join_remote(self, db: Session, login: str, scope: RefreshScope, max_age: float) -> dict | None:
+        """Join the job another worker runs, or completed within `max_age` seconds, if it
+        covers `scope`; returns its snapshot."""
+        status = db.query(RefreshStatus).filter(RefreshStatus.id == 1).with_for_update().first()
+        shared = _shared_jobs(status)
+        view = shared.get(status.job_id) if status else None
+        if view is None or not RefreshScope(**view["scope"]).covers(scope):
+            db.rollback()
+            return None
+        if view["status"] in ("queued", "running"):
+            # The snapshot outlives a worker that died mid-refresh; its lease doesn't
+            usable = active_lease(db, REFRESH_LEASE) is not None
+        else:
+            finished = datetime.fromisoformat(view["finished_at"]) if view["finished_at"] else None
+            usable = (view["status"] == "completed" and finished is not None
+                      and (datetime.now(timezone.utc) - finished).total_seconds() < max_age)
+        if not usable:
+            db.rollback()
+            return None
+        if login not in view["requested_by"]:
+            view["requested_by"].append(login)
+            status.jobs_json = json.dumps(shared)
+        db.commit()
+        return view
+
+    def view(self, db: Session, job_id: str) -> dict | None:
+        """The job as seen from this worker: live if it runs here, else its RefreshStatus snapshot."""
+        job = self.get(job_id)
+        if job:
+            return job.to_dict()
+        return _shared_jobs(db.query(RefreshStatus).filter(RefreshStatus.id == 1).first()).get(job_id)
+
+    def start(self, started_by: str, scope: RefreshScope, lease: LeaseHolder, acquired: bool = True) -> RefreshJob:
+        """Run a refresh under `lease`; the job keeps it alive and releases it. If another
+        worker holds the lease (`acquired` False) the job is queued until it is free."""
+        with self._lock:
+            joined = self._join(started_by, scope)
+            if joined is None:
+                job = self._running = RefreshJob(started_by, scope, status="running" if acquired else "queued")
+                self._jobs[job.id] = job
+        if joined is not None:
+            # Another request got here first; ours is served by its job
+            with SessionLocal() as db:
+                lease.release(db)
+            return joined
+        self._spawn(job, lease)
+        return job
+
+    def _spawn(self, job: RefreshJob, lease: LeaseHolder) -> None:
+        threading.Thread(target=self._run, args=(job, lease), name=f"refresh-{job.id[:8]}", daemon=True).start()
+        logger.info(f"[Refresh] Job {job.id} started for {', '.join(job.requested_by)}")
+
+    def get(self, job_id: str) -> RefreshJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job: RefreshJob, lease: LeaseHolder) -> None:
+        outcome = "failed"
+        started = False
+        try:
+            with SessionLocal() as db:
+                try:
+                    # Renews our own lease at once; waits while another worker's refresh holds it
+                    while not lease.acquire(db):
+                        job.progress.check()
+                        time.sleep(LEASE_POLL)
+                    # Another worker may take over an expired lease; stop device work if that happens
+                    lease.start_heartbeat(on_lost=job.progress.cancel)
+                    job.status = "running"
+                    _mark_started(db, job)
+                    started = True
+                    job.result = run_refresh(db, job.scope, job.progress)
+                    outcome = _outcome(job.result)
+                except RefreshCancelled:
+                    db.rollback()
+                    job.result = {"errors": ["Refresh cancelled"]}
+                    outcome = "cancelled"
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"[Refresh] Job {job.id} failed: {e}", exc_info=True)
+                    job.result = {"errors": [str(e)]}
+                    outcome = "failed"
+                finally:
+                    job.finished_at = datetime.now(timezone.utc)
+                    # A job cancelled while waiting for the lease never owned RefreshStatus
+                    if started:
+                        status = _save_job(db, job, outcome)
+                        status.is_running = False
+                        status.finished_at = job.finished_at
+                        status.result_json = json.dumps(job.result)
+                        db.commit()
+        finally:
+            with self._lock:
+                queued, self._queued = self._queued, None
+                self._running = queued
+            lease.stop_heartbeat()
+            if queued is None:
+                try:
+                    with SessionLocal() as db:
+                        lease.release(db)
+                except Exception as e:
+                    logger.warning(f"[Refresh] Failed to release lease, it will expire: {e}")
+            # Only report the job finished once the lease is free for the next one
+            job.status = outcome
+        logger.info(f"[Refresh] Job {job.id} {job.status}")
+        self._prune()
+        if queued is not None:
+            # The queued job inherits the lease, so no other worker can slip in between
+            self._spawn(queued, lease)
+
+    def _prune(self) -> None:
+        with self._lock:
+            finished = sorted((j for j in self._jobs.values() if j.finished and j.finished_at),
+                              key=lambda j: j.finished_at)
+            for job in finished[:-MAX_FINISHED_JOBS]:
+                del self._jobs[job.id]
+
+
+jobs = RefreshJobManager()
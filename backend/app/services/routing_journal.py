@@ -0,0 +1,135 @@
+"""
+Append-only journal of routing changes (routing_events).
+
+Writers call `record()` with the crosspoints their transaction changed. Once the
+session commits the entries are queued, and a background thread inserts them in
+batches, so the switch path pays for neither the insert nor its round trip. Entries
+still queued when the process dies are lost; StateRouting stays authoritative.
+
+Each entry carries the state version of its transaction, which orders entries across
+workers: "changes since N" is `version > N`, "history of output X" is the
+(output, version) index. `purge()` drops entries past the retention period and runs
+as a scheduler job.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.state import RoutingEvent
+
+logger = logging.getLogger(__name__)
+
+ORIGIN_API = "api"
+ORIGIN_PRESET = "preset"
+ORIGIN_REFRESH = "refresh"
+ORIGIN_LISTENER = "listener"
+
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 1000
+# Beyond this many unwritten entries (database down) the oldest are dropped
+MAX_QUEUED = 100_000
+PURGE_CHUNK = 10_000
+
+_PENDING = "routing_journal"
+
+
+def record(db: Session, version: int, changes: dict[int, tuple[int | None, int | None]],
+           origin: str, user_id: int | None = None) -> None:
+    """Journal `changes` (output → (old input, new input)) once `db` commits."""
+    if not changes:
+        return
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"version": version, "output": output, "old_input": old, "new_input": new,
+         "origin": origin, "user_id": user_id, "created_at": now}
+        for output, (old, new) in changes.items()
+    ]
+    if not event.contains(db, "after_commit", _on_commit):
+        event.listen(db, "after_commit", _on_commit)
+        event.listen(db, "after_rollback", _on_rollback)
+    db.info.setdefault(_PENDING, []).extend(rows)
+
+
+def _on_commit(session: Session) -> None:
+    writer.enqueue(session.info.pop(_PENDING, []))
+
+
+def _on_rollback(session: Session) -> None:
+    session.info.pop(_PENDING, None)
+
+
+class JournalWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue: list[dict] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def enqueue(self, rows: list[dict]) -> None:
+        if not rows:
+            return
+        with self._lock:
+            self._queue.extend(rows)
+            if len(self._queue) > MAX_QUEUED:
+                dropped = len(self._queue) - MAX_QUEUED
+                del self._queue[:dropped]
+                logger.warning(f"[Routing Journal] Queue full, dropped {dropped} oldest entries")
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="routing-journal", daemon=True)
+                self._thread.start()
+            if len(self._queue) >= BATCH_SIZE:
+                self._wake.set()
+
+    def stop(self) -> None:
+        """Stop the writer thread and write whatever is still queued."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        self._stop.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout=5)
+        self.flush()
+
+    def flush(self) -> None:
+        while True:
+            with self._lock:
+                batch, self._queue = self._queue[:BATCH_SIZE], self._queue[BATCH_SIZE:]
+            if not batch:
+                return
+            try:
+                with SessionLocal() as db:
+                    db.execute(insert(RoutingEvent), batch)
+                    db.commit()
+            except Exception as e:
+                logger.error(f"[Routing Journal] Failed to write {len(batch)} entries: {e}")
+                with self._lock:
+                    self._queue[:0] = batch
+                return
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+
+writer = JournalWriter()
+
+
+def purge(db: Session, retention_days: int) -> int:
+    """Delete entries older than `retention_days` in chunks (commits) and return how many."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = select(RoutingEvent.id).where(RoutingEvent.created_at < cutoff).limit(PURGE_CHUNK)
+        count = db.execute(delete(RoutingEvent).where(RoutingEvent.id.in_(ids))).rowcount
+        db.commit()
+        deleted += count
+        if count < PURGE_CHUNK:
+            return deleted
@@ -0,0 +1,153 @@
+"""
+Periodic state refresh.
+
+Each subsystem (Quartz labels, Quartz crosspoints, NEXX MV params, NEXX windows/UMD)
+is refreshed on its own interval. First runs are staggered so jobs don't start
+together; jobs run one at a time, so at most one device sync is in flight. Purging
+old routing journal entries runs as a job too.
+
+Every job claims a lease for one interval before running. With several worker
+processes each run happens once; the others stand by and take over if the
+holder stops renewing. Device syncs also take the device lease shared with manual
+refreshes; a run that finds the device being refreshed is skipped.
+
+The crosspoint poll is skipped while the Quartz listener follows the router's
+updates; the listener resyncs all crosspoints on every reconnect.
+"""
+import logging
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services import routing_journal
+from app.services.integration import get_async_quartz_client, get_integration_config, get_nexx_client
+from app.services.lease import LeaseHolder, device_lease
+from app.services.quartz_listener import listener_live
+from app.services.state import refresh_nexx_state, refresh_quartz_state
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    name: str
+    interval: float
+    run: Callable[[Session], dict | None]
+    # Protocol whose device the job talks to, for the shared device lease
+    device: str | None = None
+    # Skips a due run while it returns True
+    skip: Callable[[Session], bool] | None = None
+    next_run: float = 0.0
+    lease: LeaseHolder | None = field(default=None, repr=False)
+
+
+def _quartz_job(labels: bool, routing: bool) -> Callable[[Session], dict | None]:
+    def run(db: Session) -> dict | None:
+        quartz = get_async_quartz_client(db)
+        if not quartz:
+            return None
+        qi = get_integration_config(db, "quartz")
+        return refresh_quartz_state(
+            db, quartz,
+            max_sources=qi.max_inputs or 960, max_outputs=qi.max_outputs or 960,
+            labels=labels, routing=routing,
+        )
+    return run
+
+
+def _nexx_job(mv_params: bool, windows: bool) -> Callable[[Session], dict | None]:
+    def run(db: Session) -> dict | None:
+        nexx = get_nexx_client(db)
+        if not nexx:
+            return None
+        return refresh_nexx_state(db, nexx, mv_params=mv_params, windows=windows)
+    return run
+
+
+def _purge_routing_journal(db: Session) -> dict:
+    return {"routing_events_purged": routing_journal.purge(db, settings.routing_journal_retention_days)}
+
+
+def default_jobs() -> list[Job]:
+    """Jobs with a positive interval in settings; 0 disables a subsystem."""
+    jobs = [
+        Job("quartz_routing", settings.refresh_quartz_routing_interval, _quartz_job(labels=False, routing=True), "quartz",
+            skip=listener_live),
+        Job("nexx_params", settings.refresh_nexx_params_interval, _nexx_job(mv_params=True, windows=False), "nexx"),
+        Job("quartz_labels", settings.refresh_quartz_labels_interval, _quartz_job(labels=True, routing=False), "quartz"),
+        Job("nexx_windows", settings.refresh_nexx_windows_interval, _nexx_job(mv_params=False, windows=True), "nexx"),
+    ]
+    if settings.routing_journal_retention_days > 0:
+        jobs.append(Job("routing_journal_purge", settings.routing_journal_purge_interval, _purge_routing_journal))
+    return [job for job in jobs if job.interval > 0]
+
+
+class RefreshScheduler:
+    def __init__(self, jobs: list[Job], stagger: float):
+        self.jobs = jobs
+        self.stagger = stagger
+        self._stop = threading.Event()
+        for job in jobs:
+            # Not released after a run: it expires one interval later, when the job is due again
+            job.lease = LeaseHolder(f"scheduler:{job.name}", ttl=job.interval)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        if not self.jobs:
+            logger.warning("[Scheduler] No refresh jobs enabled")
+            return
+        now = time.monotonic()
+        for i, job in enumerate(self.jobs):
+            job.next_run = now + i * self.stagger
+        logger.info(f"[Scheduler] Started: {', '.join(f'{j.name} every {j.interval:g}s' for j in self.jobs)}")
+
+        while not self._stop.is_set():
+            job = min(self.jobs, key=lambda j: j.next_run)
+            if self._stop.wait(max(0.0, job.next_run - time.monotonic())):
+                break
+            self._run_job(job)
+            # Keep the cadence; if a run overran its interval, start again from now
+            job.next_run = max(job.next_run + job.interval, time.monotonic())
+        logger.info("[Scheduler] Stopped")
+
+    def _run_job(self, job: Job) -> None:
+        started = time.monotonic()
+        try:
+            with SessionLocal() as db:
+                if not job.lease.acquire(db):
+                    logger.debug(f"[Scheduler] {job.name}: running in another worker")
+                    return
+                if job.skip and job.skip(db):
+                    logger.debug(f"[Scheduler] {job.name}: not needed now, skipping this run")
+                    return
+                device = device_lease(job.device) if job.device else None
+                if device and not device.acquire(db):
+                    logger.info(f"[Scheduler] {job.name}: {job.device} is being refreshed, skipping this run")
+                    return
+                job.lease.start_heartbeat()
+                if device:
+                    device.start_heartbeat()
+                try:
+                    result = job.run(db)
+                finally:
+                    job.lease.stop_heartbeat()
+                    if device:
+                        with SessionLocal() as lease_db:
+                            device.release(lease_db)
+        except Exception as e:
+            logger.error(f"[Scheduler] {job.name} failed: {e}", exc_info=True)
+            return
+        elapsed = time.monotonic() - started
+        if result is None:
+            logger.debug(f"[Scheduler] {job.name}: integration not configured")
+            return
+        changed = {k: v for k, v in result.items() if k.endswith(("_changed", "_purged"))}
+        errors = len(result.get("errors", []))
+        logger.info(f"[Scheduler] {job.name} done in {elapsed:.2f}s: {changed}, {errors} errors")
@@ -1,13 +1,21 @@
-import json
-from datetime import datetime, timezone
+import asyncio
+import queue
+from collections.abc import Callable, Iterator
 
 from sqlalchemy.orm import Session
 
+from app.clients import device_loop
 from app.clients.nexx import NEXXClient
-from app.clients.quartz import QuartzClient
+from app.config import settings
+from app.clients.ratelimit import Priority
+from app.clients.quartz import AsyncQuartzClient, QuartzUnavailableError
 from app.models.multiviewer import Multiviewer
 from app.models.source import Source
-from app.models.state import StateMV, StateWindow, StateRouting
+from app.models.state import UMD_COLUMNS, StateMV, StateWindow, StateUMD, StateRouting
+from app.services import routing_journal
+from app.services.bulk import bulk_upsert
+from app.services.progress import Progress
+from app.services.state_cache import next_version, publish_state_change
 from app.protocol_mappings import (
     VARID_ENABLED_MVS,
     VARID_MV_ENABLE,
@@ -23,10 +31,14 @@ from app.protocol_mappings import (
 )
 
 
-def refresh_nexx_state(db: Session, nexx: NEXXClient, mv_indices: list[int] | None = None) -> dict:
+def refresh_nexx_state(db: Session, nexx: NEXXClient, mv_indices: list[int] | None = None,
+                       mv_params: bool = True, windows: bool = True, progress: Progress | None = None) -> dict:
     import logging
     logger = logging.getLogger(__name__)
 
+    # Refresh reads yield to operator edits at the NEXX rate limiter
+    nexx = nexx.with_priority(Priority.BACKGROUND)
+
     try:
         raw_count = nexx.get_parameter(VARID_ENABLED_MVS)
     except Exception as e:
@@ -47,7 +59,7 @@ def refresh_nexx_state(db: Session, nexx: NEXXClient, mv_indices: list[int] | No
     max_mv_count = min(max_mv_count, 120)
     logger.info(f"[NEXX Sync] Max MV count from API: {max_mv_count}")
 
-    results = {"mvs_synced": 0, "errors": []}
+    results = {"mvs_synced": 0, "mvs_changed": 0, "windows_changed": 0, "umd_changed": 0, "errors": []}
 
     enabled_flags = {}
     try:
@@ -73,162 +85,250 @@ def refresh_nexx_state(db: Session, nexx: NEXXClient, mv_indices: list[int] | No
     if mv_indices is not None:
         enabled_indices = [idx for idx in enabled_indices if idx in mv_indices]
 
-    # Pre-load all DB objects (3 queries instead of 18 per MV)
     mv_by_idx = {mv.nexx_index: mv for mv in db.query(Multiviewer).filter(
         Multiviewer.nexx_index.in_(enabled_indices)
     ).all()}
-    mv_ids = [mv.id for mv in mv_by_idx.values()]
-    state_mv_by_id = {s.mv_id: s for s in db.query(StateMV).filter(
-        StateMV.mv_id.in_(mv_ids)
-    ).all()} if mv_ids else {}
-    state_win_by_key = {(s.mv_id, s.window_index): s for s in db.query(StateWindow).filter(
-        StateWindow.mv_id.in_(mv_ids)
-    ).all()} if mv_ids else {}
-
-    for mv_idx in enabled_indices:
-        logger.info(f"[NEXX Sync] Syncing MV {mv_idx}...")
+    mv_rows, window_rows, umd_rows = [], [], []
+    mvs_created = 0
+    if progress:
+        progress.set_total("mvs", len(enabled_indices))
+
+    def varids_for(mv_idx: int) -> list[str]:
+        return (_mv_varids(mv_idx) if mv_params else []) + (_window_varids(mv_idx) if windows else [])
+
+    # MVs are fetched concurrently on the device loop while this thread applies finished ones
+    for mv_idx, params in _fetch_mvs(nexx, enabled_indices, varids_for, settings.nexx_sync_concurrency):
+        if progress:
+            # Leaving the loop cancels the fetches still in flight; nothing is written
+            progress.check()
         try:
+            if isinstance(params, Exception):
+                raise params
+
             mv = mv_by_idx.get(mv_idx)
             if not mv:
                 mv = Multiviewer(nexx_index=mv_idx, label=f"MV {mv_idx + 1}", enabled=True)
                 db.add(mv)
                 db.flush()
                 mv_by_idx[mv_idx] = mv
-
-            params = nexx.get_parameters([
-                f"{VARID_MV_LAYOUT}.{mv_idx}",
-                f"{VARID_MV_FONT}.{mv_idx}",
-                f"{VARID_MV_OUTPUT_FORMAT}.{mv_idx}",
-                f"{VARID_MV_OUTER_BORDER}.{mv_idx}",
-                f"{VARID_MV_INNER_BORDER}.{mv_idx}",
-            ])
-
-            state = state_mv_by_id.get(mv.id)
-            if not state:
-                state = StateMV(mv_id=mv.id)
-                db.add(state)
-                state_mv_by_id[mv.id] = state
-
-            state.layout = int(params.get(f"{VARID_MV_LAYOUT}.{mv_idx}", 0) or 0)
-            state.font = int(params.get(f"{VARID_MV_FONT}.{mv_idx}", 0) or 0)
-            state.output_format = int(params.get(f"{VARID_MV_OUTPUT_FORMAT}.{mv_idx}", 0) or 0)
-            state.outer_border = int(params.get(f"{VARID_MV_OUTER_BORDER}.{mv_idx}", 0) or 0)
-            state.inner_border = int(params.get(f"{VARID_MV_INNER_BORDER}.{mv_idx}", 0) or 0)
-            state.updated_at = datetime.now(timezone.utc)
-
-            _sync_all_windows_batched(db, nexx, mv.id, mv_idx, state_win_by_key)
+                mvs_created += 1
+
+            if mv_params:
+                mv_rows.append({
+                    "mv_id": mv.id,
+                    "layout": int(params.get(f"{VARID_MV_LAYOUT}.{mv_idx}", 0) or 0),
+                    "font": int(params.get(f"{VARID_MV_FONT}.{mv_idx}", 0) or 0),
+                    "output_format": int(params.get(f"{VARID_MV_OUTPUT_FORMAT}.{mv_idx}", 0) or 0),
+                    "outer_border": int(params.get(f"{VARID_MV_OUTER_BORDER}.{mv_idx}", 0) or 0),
+                    "inner_border": int(params.get(f"{VARID_MV_INNER_BORDER}.{mv_idx}", 0) or 0),
+                })
+
+            if windows:
+                window_rows.extend(_window_rows(params, mv.id, mv_idx))
+                umd_rows.extend(_umd_rows(params, mv.id, mv_idx))
 
             results["mvs_synced"] += 1
+            if progress:
+                progress.advance("mvs")
         except Exception as e:
             logger.error(f"[NEXX Sync] Failed to sync MV {mv_idx}: {e}", exc_info=True)
             results["errors"].append(f"MV {mv_idx}: {e}")
-
+            if progress:
+                progress.advance("mvs", errors=1)
+
+    if mv_rows or window_rows:
+        stamp = {"version": next_version(db)}
+        results["mvs_changed"] = bulk_upsert(db, StateMV, mv_rows, key=("mv_id",), stamp=stamp)
+        results["windows_changed"] = bulk_upsert(db, StateWindow, window_rows, key=("mv_id", "window_index"),
+                                                 stamp=stamp)
+        results["umd_changed"] = bulk_upsert(db, StateUMD, umd_rows, key=("mv_id", "window_index", "layer"),
+                                             stamp=stamp)
+    if results["mvs_changed"] or results["windows_changed"] or results["umd_changed"] or mvs_created:
+        publish_state_change(db, "mv")
     db.commit()
     return results
 
 
-def _sync_all_windows_batched(db: Session, nexx: NEXXClient, mv_id: int, mv_idx: int,
-                              state_win_by_key: dict):
-    pcm_varids = [f"{VARID_PCM_BARS}.{mv_idx}.{win_idx}" for win_idx in range(16)]
-    pcm_params = nexx.get_parameters(pcm_varids)
+def _fetch_mvs(nexx: NEXXClient, mv_indices: list[int], varids_for: Callable[[int], list[str]],
+               concurrency: int) -> Iterator[tuple[int, dict | Exception]]:
+    """Yield (mv_idx, params or error) in completion order, keeping `concurrency` MVs in flight."""
+    done: queue.Queue = queue.Queue()
+
+    async def fetch(mv_idx: int, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                params = await nexx.aio.get_parameters(varids_for(mv_idx))
+            except Exception as e:
+                params = e
+        done.put((mv_idx, params))
 
-    # NEXX API limit: max 40 params per request. 10 UMD VarIDs × 4 windows = 40.
-    umd_params_by_layer = {0: {}, 1: {}, 2: {}}
-    for layer in range(3):
-        for group_start in range(0, 16, 4):
-            varids = []
-            for win_idx in range(group_start, group_start + 4):
-                for vid in UMD_VARIDS:
-                    varids.append(f"{vid}.{mv_idx}.{win_idx}.{layer}")
-            chunk_result = nexx.get_parameters(varids)
-            umd_params_by_layer[layer].update(chunk_result)
+    async def fetch_all() -> None:
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        await asyncio.gather(*(fetch(mv_idx, semaphore) for mv_idx in mv_indices))
+
+    future = device_loop.submit(fetch_all())
+    try:
+        for _ in mv_indices:
+            yield done.get()
+    finally:
+        future.cancel()
 
-    now = datetime.now(timezone.utc)
-    for win_idx in range(16):
-        pcm_key = f"{VARID_PCM_BARS}.{mv_idx}.{win_idx}"
-        pcm_param = pcm_params.get(pcm_key, 0)
 
-        umd_data = []
+def _mv_varids(mv_idx: int) -> list[str]:
+    return [
+        f"{VARID_MV_LAYOUT}.{mv_idx}",
+        f"{VARID_MV_FONT}.{mv_idx}",
+        f"{VARID_MV_OUTPUT_FORMAT}.{mv_idx}",
+        f"{VARID_MV_OUTER_BORDER}.{mv_idx}",
+        f"{VARID_MV_INNER_BORDER}.{mv_idx}",
+    ]
+
+
+def _window_varids(mv_idx: int) -> list[str]:
+    varids = [f"{VARID_PCM_BARS}.{mv_idx}.{win_idx}" for win_idx in range(16)]
+    for win_idx in range(16):
         for layer in range(3):
-            umd_layer = {}
-            for vid in UMD_VARIDS:
-                key = f"{vid}.{mv_idx}.{win_idx}.{layer}"
-                umd_layer[vid] = umd_params_by_layer[layer].get(key, "")
-            umd_data.append(umd_layer)
-
-        key = (mv_id, win_idx)
-        state = state_win_by_key.get(key)
-        if not state:
-            state = StateWindow(mv_id=mv_id, window_index=win_idx)
-            db.add(state)
-            state_win_by_key[key] = state
+            varids.extend(f"{vid}.{mv_idx}.{win_idx}.{layer}" for vid in UMD_VARIDS)
+    return varids
 
+
+def _window_rows(params: dict, mv_id: int, mv_idx: int) -> list[dict]:
+    rows = []
+    for win_idx in range(16):
+        pcm_param = params.get(f"{VARID_PCM_BARS}.{mv_idx}.{win_idx}", 0)
         pcm_index = int(pcm_param) if pcm_param not in (None, "") else 0
-        state.pcm_bars = pcm_index_to_value(pcm_index)
-        state.umd_json = json.dumps(umd_data)
-        state.updated_at = now
+        rows.append({
+            "mv_id": mv_id,
+            "window_index": win_idx,
+            "pcm_bars": pcm_index_to_value(pcm_index),
+        })
+    return rows
 
 
-def refresh_quartz_state(db: Session, quartz: QuartzClient, max_sources: int, max_outputs: int,
-                         source_inputs: list[int] | None = None, output_range: list[int] | None = None) -> dict:
-    from concurrent.futures import ThreadPoolExecutor, as_completed
+def _umd_rows(params: dict, mv_id: int, mv_idx: int) -> list[dict]:
+    rows = []
+    for win_idx in range(16):
+        for layer in range(3):
+            layer_data = {vid: params.get(f"{vid}.{mv_idx}.{win_idx}.{layer}") for vid in UMD_VARIDS}
+            rows.append({"mv_id": mv_id, "window_index": win_idx, "layer": layer, **umd_columns(layer_data)})
+    return rows
+
+
+def umd_value(column: str, value):
+    """Typed value for a StateUMD column; unparsable numbers become None."""
+    if column == "text":
+        return None if value is None else str(value)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def umd_columns(layer_data: dict) -> dict:
+    """StateUMD column values for a {varid: value} layer; unknown varids are dropped."""
+    return {UMD_COLUMNS[vid]: umd_value(UMD_COLUMNS[vid], value)
+            for vid, value in layer_data.items() if vid in UMD_COLUMNS}
+
+
+async def fetch_quartz_state(quartz: AsyncQuartzClient, source_ids: list[int], output_ids: list[int],
+                             progress: Progress | None = None) -> tuple[dict, dict]:
+    """Read source labels and crosspoints concurrently; per-item failures are returned as QuartzError."""
+    # NOTE: Quartz server has RD/RS swapped - use read_output_name(s) to get actual sources
+    async with quartz:
+        return await asyncio.gather(
+            _read_tracked(quartz, quartz.read_output_names, source_ids, "sources", progress),
+            _read_tracked(quartz, quartz.read_routings, output_ids, "routes", progress),
+        )
+
+
+async def _read_tracked(quartz: AsyncQuartzClient, read, ids: list[int], phase: str,
+                        progress: Progress | None) -> dict:
+    if progress is None:
+        return await read(ids)
+    # Read in windows of max_in_flight so progress and cancellation are seen between them
+    progress.set_total(phase, len(ids))
+    results = {}
+    for start in range(0, len(ids), quartz.max_in_flight):
+        progress.check()
+        part = await read(ids[start:start + quartz.max_in_flight])
+        results.update(part)
+        progress.advance(phase, len(part), errors=sum(isinstance(v, Exception) for v in part.values()))
+    return results
+
+
+def refresh_quartz_state(db: Session, quartz: AsyncQuartzClient, max_sources: int, max_outputs: int,
+                         source_inputs: list[int] | None = None, output_range: list[int] | None = None,
+                         labels: bool = True, routing: bool = True, progress: Progress | None = None) -> dict:
     import logging
 
     logger = logging.getLogger(__name__)
-    results = {"sources_synced": 0, "routes_synced": 0, "errors": []}
+    results = {"sources_synced": 0, "sources_changed": 0, "routes_synced": 0, "routes_changed": 0, "errors": []}
+
+    try:
+        quartz.check_available()
+    except QuartzUnavailableError as e:
+        # Rather than one immediate error per source and output
+        results["errors"].append(str(e))
+        return results
 
     source_ids_to_fetch = source_inputs if source_inputs is not None else list(range(1, max_sources + 1))
+    output_ids_to_fetch = output_range if output_range is not None else list(range(1, max_outputs + 1))
+    if not labels:
+        source_ids_to_fetch = []
+    if not routing:
+        output_ids_to_fetch = []
 
-    # Parallel fetch of source names (max 10 concurrent connections)
-    # NOTE: Quartz server has RD/RS swapped - use read_output_name to get actual sources
-    logger.info(f"[Quartz Sync] Fetching {len(source_ids_to_fetch)} source names...")
-    input_data = {}
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_input = {executor.submit(quartz.read_output_name, i): i for i in source_ids_to_fetch}
-        for future in as_completed(future_to_input):
-            i = future_to_input[future]
-            try:
-                label = future.result()
-                input_data[i] = label
-            except Exception as e:
-                results["errors"].append(f"Source {i}: {e}")
+    logger.info(f"[Quartz Sync] Fetching {len(source_ids_to_fetch)} source names "
+                f"and {len(output_ids_to_fetch)} routing states...")
+    names, routes = asyncio.run(fetch_quartz_state(quartz, source_ids_to_fetch, output_ids_to_fetch, progress))
 
-    for i, label in input_data.items():
-        source = db.query(Source).filter(Source.quartz_input == i).first()
-        if not source:
-            source = Source(quartz_input=i, label=label)
-            db.add(source)
+    input_data = {}
+    for i, label in names.items():
+        if isinstance(label, Exception):
+            results["errors"].append(f"Source {i}: {label}")
         else:
-            source.label = label
-        results["sources_synced"] += 1
+            input_data[i] = label
 
-    logger.info(f"[Quartz Sync] Synced {results['sources_synced']} sources")
+    routing_data = {}
+    for out, inp in routes.items():
+        if isinstance(inp, Exception):
+            results["errors"].append(f"Routing out {out}: {inp}")
+        else:
+            routing_data[out] = inp
 
-    output_ids_to_fetch = output_range if output_range is not None else list(range(1, max_outputs + 1))
+    results["sources_synced"] = len(input_data)
+    if input_data:
+        results["sources_changed"] = bulk_upsert(
+            db, Source, [{"quartz_input": i, "label": label} for i, label in input_data.items()],
+            key=("quartz_input",), stamp={"version": next_version(db)},
+        )
 
-    logger.info(f"[Quartz Sync] Fetching {len(output_ids_to_fetch)} routing states...")
-    routing_data = {}
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_output = {executor.submit(quartz.read_routing, out): out for out in output_ids_to_fetch}
-        for future in as_completed(future_to_output):
-            out = future_to_output[future]
-            try:
-                inp = future.result()
-                routing_data[out] = inp
-            except Exception as e:
-                results["errors"].append(f"Routing out {out}: {e}")
+    if results["sources_changed"]:
+        publish_state_change(db, "sources")
+    logger.info(f"[Quartz Sync] Synced {results['sources_synced']} sources ({results['sources_changed']} changed)")
 
     # Save routing to DB
-    for out, inp in routing_data.items():
-        route = db.query(StateRouting).filter(StateRouting.output == out).first()
-        if not route:
-            route = StateRouting(output=out, input=inp)
-            db.add(route)
-        else:
-            route.input = inp
-            route.updated_at = datetime.now(timezone.utc)
-        results["routes_synced"] += 1
+    results["routes_synced"] = len(routing_data)
+    results["routes_changed"] = apply_routing_updates(db, routing_data, routing_journal.ORIGIN_REFRESH)
 
-    logger.info(f"[Quartz Sync] Synced {results['routes_synced']} routes")
+    logger.info(f"[Quartz Sync] Synced {results['routes_synced']} routes ({results['routes_changed']} changed)")
     db.commit()
     return results
+
+
+def apply_routing_updates(db: Session, routing: dict[int, int], origin: str, user_id: int | None = None) -> int:
+    """Write output → input crosspoints into StateRouting, journal the changed ones and return
+    how many changed (caller commits)."""
+    if not routing:
+        return 0
+    version = next_version(db)
+    # Read under the version lock, so no other writer changes these rows until we commit
+    current = dict(db.query(StateRouting.output, StateRouting.input).filter(StateRouting.output.in_(list(routing))))
+    changes = {out: (current.get(out), inp) for out, inp in routing.items() if out not in current or current[out] != inp}
+    if not changes:
+        return 0
+    bulk_upsert(db, StateRouting, [{"output": out, "input": new} for out, (_, new) in changes.items()],
+                key=("output",), stamp={"version": version})
+    routing_journal.record(db, version, changes, origin, user_id)
+    publish_state_change(db, "routing")
+    return len(changes)
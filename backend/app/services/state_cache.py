@@ -0,0 +1,140 @@
+"""
+Read-through cache for the state endpoints every operator browser polls.
+
+Entries are grouped in families ("mv", "routing", "sources", "access") and keyed
+within a family, e.g. the serialized state of one MV. Each family has a version that
+increases whenever any of its entries is invalidated. Writers call
+`publish_state_change()`; every worker drops the affected entries once the session
+commits, and everything after the notification connection reconnects.
+
+Rows of the state tables carry the global state version of the transaction that last
+wrote them. Writers take it from `next_version()`, which keeps the counter row locked
+until they commit, so versions become visible in order: a reader that sees version N
+has every change up to N. Clients pass it back as `since` to fetch only newer rows.
+"""
+import logging
+import threading
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from typing import TypeVar
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.models.multiviewer import UserAccessMV
+from app.models.source import UserAccessSource
+from app.models.state import StateVersion
+from app.services import notify
+from app.services.bulk import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+STATE_CHANNEL = "state_changed"
+
+FAMILIES = ("mv", "routing", "sources", "access")
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class CachedState:
+    """Serialized body of a state endpoint at `version`; `unchanged` is the body of an empty delta."""
+    body: bytes
+    version: int
+    unchanged: bytes = b"[]"
+
+
+class StateCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: dict[tuple[str, Hashable], object] = {}
+        self._versions = {family: 0 for family in FAMILIES}
+
+    def version(self, family: str) -> int:
+        with self._lock:
+            return self._versions[family]
+
+    def get(self, family: str, key: Hashable, load: Callable[[], T]) -> T:
+        """Cached value for (family, key); `load` builds it on a miss. None is not cached."""
+        with self._lock:
+            if (family, key) in self._entries:
+                return self._entries[(family, key)]
+            version = self._versions[family]
+
+        value = load()
+
+        with self._lock:
+            # Don't cache a value read before an invalidation that raced with us
+            if value is not None and version == self._versions[family]:
+                return self._entries.setdefault((family, key), value)
+        return value
+
+    def invalidate(self, family: str | None = None, key: Hashable | None = None) -> None:
+        """Drop one entry, a whole family, or everything."""
+        with self._lock:
+            for f in [family] if family else FAMILIES:
+                self._versions[f] += 1
+            if family and key is not None:
+                self._entries.pop((family, key), None)
+            else:
+                for entry in [e for e in self._entries if family is None or e[0] == family]:
+                    del self._entries[entry]
+
+
+cache = StateCache()
+
+
+def _on_change(payload: str | None) -> None:
+    if payload is None:
+        cache.invalidate()
+        return
+    family, _, key = payload.partition(":")
+    if family not in FAMILIES:
+        logger.warning(f"[State Cache] Unknown family in change notification: {payload}")
+        return
+    cache.invalidate(family, (int(key) if key.isdigit() else key) if key else None)
+
+
+notify.subscribe(STATE_CHANNEL, _on_change)
+
+
+@dataclass(frozen=True)
+class UserAccess:
+    mv_ids: frozenset[int]
+    source_ids: frozenset[int]
+
+
+def get_user_access(db: Session, user_id: int) -> UserAccess:
+    """MV and source ids granted to a (non-admin) user."""
+    def load() -> UserAccess:
+        return UserAccess(
+            mv_ids=frozenset(r.mv_id for r in db.query(UserAccessMV.mv_id).filter(UserAccessMV.user_id == user_id)),
+            source_ids=frozenset(r.source_id for r in db.query(UserAccessSource.source_id).filter(
+                UserAccessSource.user_id == user_id
+            )),
+        )
+    return cache.get("access", user_id, load)
+
+
+def publish_state_change(db: Session, family: str, key: int | None = None) -> None:
+    """Invalidate cached `family` state (or one `key` of it) in every worker once `db` commits."""
+    notify.publish(db, STATE_CHANNEL, family if key is None else f"{family}:{key}")
+
+
+def next_version(db: Session) -> int:
+    """Reserve the version for the state rows this transaction writes.
+
+    Call it before changing any rows: the counter stays locked until `db` commits,
+    and taking it first keeps writers from deadlocking on each other.
+    """
+    stmt = (update(StateVersion).where(StateVersion.id == 1)
+            .values(value=StateVersion.value + 1).returning(StateVersion.value))
+    value = db.execute(stmt).scalar_one_or_none()
+    if value is None:
+        bulk_upsert(db, StateVersion, [{"id": 1}], key=("id",))
+        value = db.execute(stmt).scalar_one()
+    return value
+
+
+def current_version(db: Session) -> int:
+    return db.execute(select(StateVersion.value).where(StateVersion.id == 1)).scalar_one_or_none() or 0
@@ -0,0 +1,42 @@
+"""
+Background sync worker: keeps cached device state fresh without blocking web workers.
+
+    python -m app.worker
+"""
+import asyncio
+import logging
+import signal
+
+from app.clients import device_loop
+from app.clients.nexx import close_transport as close_nexx_transport, set_rate_share as set_nexx_rate_share
+from app.config import settings
+from app.services import notify, routing_journal
+from app.services.integration import registry as client_registry
+from app.services.scheduler import RefreshScheduler, default_jobs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+
+def main() -> None:
+    # The web app uses the rest of each NEXX frame's request budget
+    set_nexx_rate_share(settings.nexx_worker_rate_share)
+    scheduler = RefreshScheduler(default_jobs(), stagger=settings.refresh_stagger_seconds)
+    signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+    signal.signal(signal.SIGINT, lambda *_: scheduler.stop())
+
+    notify.start()
+    try:
+        scheduler.run()
+    finally:
+        asyncio.run(client_registry.aclose())
+        asyncio.run(close_nexx_transport())
+        device_loop.stop()
+        routing_journal.writer.stop()
+        notify.stop()
+
+
+if __name__ == "__main__":
+    main()
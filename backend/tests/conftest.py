@@ -0,0 +1,208 @@
+"""
+Shared fixtures: a throwaway SQLite database, and fake devices (a Quartz router over
+TCP and a NEXX frame over HTTP) running in background threads.
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+# Settings are read on import of app.config, so configure them first
+_tmp = tempfile.mkdtemp(prefix="mvcontrol-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ["QUARTZ_LISTENER_ENABLED"] = "false"
+os.environ["DEVICE_RETRY_BACKOFF"] = "0.01"
+os.environ["NEXX_RATE_LIMIT"] = "1000"
+os.environ["NEXX_RATE_BURST"] = "100"
+
+import pytest  # noqa: E402
+
+from app.clients import breaker  # noqa: E402
+from app.database import Base, engine  # noqa: E402
+from app.models import integration, multiviewer, preset, source, state, user  # noqa: E402, F401
+from app.services import routing_journal  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _reset_breakers():
+    # Breakers are per device and process-wide; don't let one test's failures open another's
+    breaker._breakers.clear()
+    yield
+    breaker._breakers.clear()
+
+
+@pytest.fixture
+def db_tables():
+    Base.metadata.create_all(engine)
+    yield
+    # Write the journal entries still queued while their table exists
+    routing_journal.writer.stop()
+    Base.metadata.drop_all(engine)
+
+
+class FakeRouter:
+    """Quartz router on 127.0.0.1 answering .IV, .RS, .RD and .SV like a real one.
+
+    Tests shape its behaviour through the attributes: `silent` commands get no reply,
+    `sv_reply` is how takes are confirmed (".A", ".U" for the resulting update, ".E",
+    ".B" or "close"), `oneshot` closes the connection after every reply and `updates`
+    are unsolicited lines sent before the next reply.
+    """
+
+    def __init__(self):
+        self.routes: dict[int, int] = {}
+        self.names: dict[int, str] = {}
+        self.silent: set[str] = set()
+        self.sv_reply = ".A"
+        self.oneshot = False
+        self.updates: list[str] = []
+        self.commands: list[str] = []
+        self.connections = 0
+        self._conns: list[socket.socket] = []
+        self._server = socket.create_server(("127.0.0.1", 0))
+        self.port = self._server.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def route(self, output: int) -> int:
+        return self.routes.get(output, output + 100)
+
+    def reply(self, command: str) -> str | None:
+        if command in self.silent:
+            return None
+        number = command[3:]
+        if command.startswith(".IV"):
+            return f".AV{number},{self.route(int(number))}"
+        if command.startswith(".RS"):
+            return f".RAS{number},{self.names.get(int(number), f'OUT {number}')}"
+        if command.startswith(".RD"):
+            return f".RAD{number},{self.names.get(int(number), f'IN {number}')}"
+        if command.startswith(".SV"):
+            output, input_number = (int(n) for n in number.split(","))
+            if self.sv_reply in (".A", ".U"):
+                self.routes[output] = input_number
+            if self.sv_reply == ".U":
+                return f".UV{output},{input_number}"
+            return None if self.sv_reply == "close" else self.sv_reply
+        return ".E"
+
+    def push(self, line: str) -> None:
+        """Send an unsolicited line to every open connection."""
+        for conn in list(self._conns):
+            try:
+                conn.sendall(f"{line}\r\n".encode("ascii"))
+            except OSError:
+                pass
+
+    def close(self) -> None:
+        self._server.close()
+        for conn in list(self._conns):
+            conn.close()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            self.connections += 1
+            self._conns.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        buf = b""
+        with conn:
+            while True:
+                try:
+                    data = conn.recv(4096)
+                except OSError:
+                    return
+                if not data:
+                    return
+                buf += data
+                out = []
+                while b"\r\n" in buf:
+                    line, buf = buf.split(b"\r\n", 1)
+                    command = line.decode("ascii")
+                    self.commands.append(command)
+                    out.extend(self.updates)
+                    self.updates = []
+                    response = self.reply(command)
+                    if response is not None:
+                        out.append(response)
+                    if self.oneshot:
+                        break
+                if out:
+                    conn.sendall("".join(f"{line}\r\n" for line in out).encode("ascii"))
+                if self.oneshot:
+                    return
+
+
+@pytest.fixture
+def fake_router():
+    router = FakeRouter()
+    yield router
+    router.close()
+
+
+class FakeNEXX:
+    """NEXX frame answering EV/GET and EV/SET parameter requests from `store`.
+
+    `fail` is the number of SET requests still to answer with HTTP 500; `hook(varids,
+    values)` runs before a SET is applied (e.g. to delay it).
+    """
+
+    def __init__(self):
+        self.store: dict[str, str] = {}
+        self.sets: list[tuple[str, str]] = []
+        self.fail = 0
+        self.hook = None
+        frame = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                # /v.api/apis/EV/{GET|SET}/{parameter|parameters}/{varids}[/{values}]
+                parts = self.path.split("/")
+                op, varids = parts[4], parts[6].split(",")
+                if op == "SET":
+                    values = [unquote(v) for v in parts[7].split(",")]
+                    if frame.hook:
+                        frame.hook(varids, values)
+                    if frame.fail > 0:
+                        frame.fail -= 1
+                        self.send_error(500)
+                        return
+                    for varid, value in zip(varids, values):
+                        frame.store[varid] = value
+                        frame.sets.append((varid, value))
+                    body = {"status": "success"}
+                else:
+                    body = [{"id": f"{v}@i", "value": frame.store.get(v, 0)} for v in varids]
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.host = f"127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def fake_nexx():
+    frame = FakeNEXX()
+    yield frame
+    frame.close()
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from app.clients.nexx import AsyncNEXXClient
+from app.database import SessionLocal
+from app.models.state import StateUMD
+from app.services.param_queue import ParamQueue, ParamWrite
+
+VARID = "2709.0.5.1"
+
+
+def _write(value: str) -> ParamWrite:
+    return ParamWrite(VARID, value, StateUMD, (1, 5, 1), "text", value)
+
+
+def _queue(frame) -> ParamQueue:
+    return ParamQueue(AsyncNEXXClient(frame.host))
+
+
+def _settle(*queues: ParamQueue, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while any(q._sending or q.outstanding() for q in queues):
+        assert time.monotonic() < deadline, "param queue did not drain"
+        time.sleep(0.02)
+
+
+def _cached_text() -> str | None:
+    with SessionLocal() as db:
+        row = db.get(StateUMD, (1, 5, 1))
+        return row.text if row else None
+
+
+class Gate:
+    def __init__(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def hold(self, varids: list[str], values: list[str]) -> None:
+        if "slow" in values:
+            self.entered.set()
+            self.release.wait(5)
+
+
+@pytest.fixture
+def gate(fake_nexx):
+    """Holds SETs of the value "slow" at the frame until released."""
+    gate = Gate()
+    fake_nexx.hook = gate.hold
+    yield gate
+    gate.release.set()
+
+
+def test_latest_value_wins(db_tables, fake_nexx, gate):
+    queue = _queue(fake_nexx)
+    queue.submit([_write("slow")])
+    assert gate.entered.wait(5)
+    for n in range(20):
+        queue.submit([_write(str(n))])
+    gate.release.set()
+    _settle(queue)
+    # The first write was in flight; the ones queued behind it collapsed into the last
+    assert fake_nexx.sets == [(VARID, "slow"), (VARID, "19")]
+    assert _cached_text() == "19"
+
+
+def test_older_write_from_another_worker_is_dropped(db_tables, fake_nexx):
+    a, b = _queue(fake_nexx), _queue(fake_nexx)
+    older = _write("older")
+    a.submit([_write("newer")])
+    _settle(a)
+    b.submit([older])
+    _settle(b)
+    assert fake_nexx.sets == [(VARID, "newer")]
+    assert fake_nexx.store[VARID] == "newer"
+    assert _cached_text() == "newer"
+
+
+def test_newer_write_overtaken_by_older_one_is_sent_again(db_tables, fake_nexx, gate):
+    a, b = _queue(fake_nexx), _queue(fake_nexx)
+    a.submit([_write("slow")])
+    assert gate.entered.wait(5)
+    # Reserved after "slow", but written to the frame before it
+    b.submit([_write("fast")])
+    _settle(b)
+    gate.release.set()
+    _settle(a)
+    assert fake_nexx.sets == [(VARID, "fast"), (VARID, "slow"), (VARID, "fast")]
+    assert fake_nexx.store[VARID] == "fast"
+    assert _cached_text() == "fast"
+
+
+def test_failed_write_is_retried(db_tables, fake_nexx):
+    fake_nexx.fail = 2
+    queue = _queue(fake_nexx)
+    queue.submit([_write("x")])
+    _settle(queue)
+    assert fake_nexx.sets == [(VARID, "x")]
+    assert _cached_text() == "x"
+
+
+def test_write_given_up_after_retries_leaves_cached_state(db_tables, fake_nexx):
+    queue = _queue(fake_nexx)
+    queue.submit([_write("kept")])
+    _settle(queue)
+    fake_nexx.fail = 10
+    queue.submit([_write("lost")])
+    _settle(queue)
+    assert fake_nexx.store[VARID] == "kept"
+    assert _cached_text() == "kept"
@@ -0,0 +1,229 @@
+import asyncio
+
+import pytest
+
+from app.clients.quartz import AsyncQuartzClient, QuartzClient, QuartzError, QuartzFramer
+
+
+def _lines(framer: QuartzFramer) -> list[str]:
+    lines = []
+    while (line := framer.next_line()) is not None:
+        lines.append(line)
+    return lines
+
+
+def test_framer_accepts_cr_lf_and_crlf():
+    framer = QuartzFramer()
+    framer.feed(b".AV1,2\r.AV2,3\n.AV3,4\r\n\r\n.AV4,5\r\n")
+    assert _lines(framer) == [".AV1,2", ".AV2,3", ".AV3,4", ".AV4,5"]
+
+
+def test_framer_joins_lines_split_across_reads():
+    framer = QuartzFramer()
+    framer.feed(b".AV1")
+    assert framer.next_line() is None
+    framer.feed(b"2,34\r")
+    framer.feed(b"\n.UV5,6\r\n")
+    assert _lines(framer) == [".AV12,34", ".UV5,6"]
+
+
+def test_framer_splits_bare_ack_from_following_reply():
+    framer = QuartzFramer()
+    framer.feed(b".A.AV1,2\r\n")
+    assert _lines(framer) == [".A", ".AV1,2"]
+
+
+# Sync client
+
+def _client(router, **kwargs) -> QuartzClient:
+    return QuartzClient("127.0.0.1", router.port, timeout=0.3, **kwargs)
+
+
+@pytest.mark.parametrize("sv_reply", [".A", ".U"])
+def test_switch_confirmed(fake_router, sv_reply):
+    fake_router.sv_reply = sv_reply
+    client = _client(fake_router)
+    try:
+        assert client.switch(3, 7) is True
+        assert fake_router.routes[3] == 7
+        # The connection is still in step: the next reply is not the take's
+        assert client.read_routing(4) == 104
+    finally:
+        client.close()
+
+
+def test_switch_error_reply_raises(fake_router):
+    fake_router.sv_reply = ".E"
+    client = _client(fake_router)
+    try:
+        with pytest.raises(QuartzError, match="Switch failed"):
+            client.switch(3, 7)
+    finally:
+        client.close()
+
+
+def test_switch_locked_output_raises(fake_router):
+    fake_router.sv_reply = ".B"
+    client = _client(fake_router)
+    try:
+        with pytest.raises(QuartzError, match="locked"):
+            client.switch(3, 7)
+    finally:
+        client.close()
+
+
+def test_switch_acknowledged_by_close_switches_to_oneshot(fake_router):
+    fake_router.sv_reply = "close"
+    fake_router.oneshot = True
+    client = _client(fake_router)
+    try:
+        assert client.switch(3, 7) is True
+        assert client._keepalive is False
+        assert client.read_routing(4) == 104
+    finally:
+        client.close()
+
+
+def test_silent_read_raises_and_client_recovers(fake_router):
+    fake_router.silent = {".IV5"}
+    client = _client(fake_router)
+    try:
+        with pytest.raises(QuartzError, match="no reply"):
+            client.read_routing(5)
+        assert client.read_routing(6) == 106
+    finally:
+        client.close()
+
+
+def test_unsolicited_updates_are_not_taken_as_replies(fake_router):
+    client = _client(fake_router)
+    try:
+        fake_router.updates = [".UV9,1", ".UV10,2"]
+        assert client.read_routing(3) == 103
+        assert client.read_routing(4) == 104
+    finally:
+        client.close()
+
+
+def test_pipelined_reads_of_960_outputs(fake_router):
+    fake_router.routes = {n: 961 - n for n in range(1, 961)}
+    client = _client(fake_router)
+    try:
+        routes = client.read_routings(list(range(1, 961)))
+    finally:
+        client.close()
+    assert routes == {n: 961 - n for n in range(1, 961)}
+    assert fake_router.connections == 1
+
+
+def test_skipped_read_does_not_shift_later_replies(fake_router):
+    fake_router.silent = {".IV7"}
+    client = _client(fake_router)
+    try:
+        routes = client.read_routings(list(range(1, 11)))
+    finally:
+        client.close()
+    assert isinstance(routes.pop(7), QuartzError)
+    assert routes == {n: n + 100 for n in range(1, 11) if n != 7}
+
+
+def test_oneshot_router_reads(fake_router):
+    fake_router.oneshot = True
+    client = _client(fake_router)
+    try:
+        assert client.read_routings(list(range(1, 21))) == {n: n + 100 for n in range(1, 21)}
+    finally:
+        client.close()
+
+
+def test_read_names(fake_router):
+    fake_router.names = {2: "CAM 2"}
+    client = _client(fake_router)
+    try:
+        assert client.read_input_name(2) == "CAM 2"
+        assert client.read_output_names([1, 2]) == {1: "OUT 1", 2: "CAM 2"}
+    finally:
+        client.close()
+
+
+# Async client
+
+def _run(router, scenario, **kwargs):
+    async def main():
+        async with AsyncQuartzClient("127.0.0.1", router.port, timeout=0.3, **kwargs) as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("sv_reply", [".A", ".U"])
+def test_async_switch_confirmed(fake_router, sv_reply):
+    fake_router.sv_reply = sv_reply
+
+    async def scenario(client):
+        await client.switch(3, 7)
+        return await client.read_routing(3)
+
+    assert _run(fake_router, scenario) == 7
+
+
+@pytest.mark.parametrize("sv_reply, error", [(".E", "Switch failed"), (".B", "locked")])
+def test_async_switch_rejected(fake_router, sv_reply, error):
+    fake_router.sv_reply = sv_reply
+
+    async def scenario(client):
+        with pytest.raises(QuartzError, match=error):
+            await client.switch(3, 7)
+
+    _run(fake_router, scenario)
+
+
+def test_async_switch_acknowledged_by_close(fake_router):
+    fake_router.sv_reply = "close"
+    fake_router.oneshot = True
+
+    async def scenario(client):
+        assert await client.switch(3, 7) is True
+        return await client.read_routing(4)
+
+    assert _run(fake_router, scenario) == 104
+
+
+def test_async_pipelined_reads_of_960_outputs(fake_router):
+    fake_router.routes = {n: 961 - n for n in range(1, 961)}
+
+    async def scenario(client):
+        return await client.read_routings(list(range(1, 961)))
+
+    assert _run(fake_router, scenario, connections=4) == {n: 961 - n for n in range(1, 961)}
+    assert fake_router.connections <= 4
+
+
+def test_async_skipped_read_does_not_shift_later_replies(fake_router):
+    fake_router.silent = {".IV7"}
+
+    async def scenario(client):
+        return await client.read_routings(list(range(1, 11)))
+
+    routes = _run(fake_router, scenario, connections=1)
+    assert isinstance(routes.pop(7), QuartzError)
+    assert routes == {n: n + 100 for n in range(1, 11) if n != 7}
+
+
+def test_async_unsolicited_updates_are_not_taken_as_replies(fake_router):
+    fake_router.updates = [".UV9,1"]
+
+    async def scenario(client):
+        return [await client.read_routing(3), await client.read_routing(4)]
+
+    assert _run(fake_router, scenario) == [103, 104]
+
+
+def test_async_silent_read_raises(fake_router):
+    fake_router.silent = {".IV5"}
+
+    async def scenario(client):
+        with pytest.raises(QuartzError, match="no reply"):
+            await client.read_routing(5)
+        return await client.read_routing(6)
+
+    assert _run(fake_router, scenario) == 106
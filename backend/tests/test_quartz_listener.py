@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from app.database import SessionLocal
+from app.models.integration import Integration
+from app.models.state import StateRouting
+from app.services import quartz_listener
+from app.services.quartz_listener import QuartzListener, parse_update
+
+
+@pytest.mark.parametrize("line, update", [
+    (".UV12,34", (12, 34)),
+    (".UVA5,6", (5, 6)),
+    (".UAV7,8", (7, 8)),
+    (".UA5,6", None),
+    (".AV12,34", None),
+    (".UV12", None),
+    (".A", None),
+    ("", None),
+])
+def test_parse_update(line, update):
+    assert parse_update(line) == update
+
+
+def test_listener_resyncs_and_applies_updates(db_tables, fake_router, monkeypatch):
+    monkeypatch.setattr(quartz_listener, "FLUSH_INTERVAL", 0.01)
+    with SessionLocal() as db:
+        db.add(Integration(protocol="quartz", host="127.0.0.1", port=fake_router.port, max_outputs=8))
+        db.commit()
+
+    async def main():
+        listener = QuartzListener()
+        listener.start()
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.05)
+                if quartz_listener.listener_live(SessionLocal()):
+                    break
+            fake_router.push(".UV3,42")
+            fake_router.push(".UA4,43")
+            await asyncio.sleep(0.3)
+        finally:
+            await listener.stop()
+
+    asyncio.run(main())
+    with SessionLocal() as db:
+        routes = dict(db.query(StateRouting.output, StateRouting.input))
+        assert not quartz_listener.listener_live(db)
+    # Resync read every output, then the video update was applied and the audio one ignored
+    assert routes == {n: (42 if n == 3 else n + 100) for n in range(1, 9)}
@@ -13,6 +13,18 @@ async function request(path: string, options?: RequestInit) {
   return res.json()
 }
 
+// State GETs also return the state version to pass back as `since` for deltas
+async function requestState(path: string, since?: number | null) {
+  const url = since != null ? `${path}?since=${since}` : path
+  const res = await fetch(`${BASE}${url}`, { credentials: 'include' })
+  if (!res.ok) {
+    const err = await res.json().catch(() => ({ detail: res.statusText }))
+    throw new Error(err.detail || res.statusText)
+  }
+  const version = res.headers.get('X-State-Version')
+  return { data: await res.json(), version: version ? parseInt(version, 10) : null }
+}
+
 export const api = {
   // Auth
   login: (login: string, password: string) =>
@@ -35,7 +47,7 @@ export const api = {
   // Sources & MVs
   getSources: () => request('/api/sources'),
   getMultiviewers: () => request('/api/multiviewers'),
-  getMultiviewer: (id: number) => request(`/api/multiviewers/${id}`),
+  getMultiviewer: (id: number, since?: number | null) => requestState(`/api/multiviewers/${id}`, since),
   setLayout: (id: number, layout: number) =>
     request(`/api/multiviewers/${id}/layout`, { method: 'POST', body: JSON.stringify({ layout }) }),
   setMVParams: (id: number, data: { font?: number; outer_border?: number; inner_border?: number; output_format?: number }) =>
@@ -44,13 +56,17 @@ export const api = {
     request(`/api/multiviewers/${id}/windows/${windowIndex}`, { method: 'POST', body: JSON.stringify(data) }),
 
   // Routing
-  getRouting: () => request('/api/routing'),
+  getRouting: (since?: number | null) => requestState('/api/routing', since),
   switchRoute: (output: number, input: number) =>
     request('/api/routing/switch', { method: 'POST', body: JSON.stringify({ output, input }) }),
+  salvo: (switches: { output: number; input: number }[]) =>
+    request('/api/routing/salvo', { method: 'POST', body: JSON.stringify({ switches }) }),
 
   // Refresh
   refresh: () => request('/api/refresh', { method: 'POST' }),
   refreshStatus: () => request('/api/refresh/status'),
+  refreshJob: (id: string) => request(`/api/refresh/jobs/${id}`),
+  cancelRefresh: (id: string) => request(`/api/refresh/jobs/${id}/cancel`, { method: 'POST' }),
 
   // Integrations
   getIntegrations: () => request('/api/integrations'),
@@ -69,3 +85,13 @@ export const api = {
     request(`/api/presets/${id}/apply`, { method: 'POST', body: JSON.stringify(body) }),
   exportPreset: (id: number) => `${BASE}/api/presets/${id}/export`,
 }
+
+// Poll a refresh job until it finishes; returns the final job
+export async function waitForRefresh(jobId: string, onProgress?: (job: any) => void) {
+  for (;;) {
+    const job = await api.refreshJob(jobId)
+    onProgress?.(job)
+    if (job.status !== 'running' && job.status !== 'queued') return job
+    await new Promise((resolve) => setTimeout(resolve, 1000))
+  }
+}
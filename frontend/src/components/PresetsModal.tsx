@@ -64,7 +64,7 @@ function PresetsModal({ mvId, multiviewers, routing, onClose }: Props) {
       const mvs: any[] = []
 
       for (const id of selectedMVs) {
-        const mv = await api.getMultiviewer(id)
+        const { data: mv } = await api.getMultiviewer(id)
         const mvData: any = {
           mv_id: id,
           mv_nexx_index: mv.nexx_index,
@@ -23,7 +23,13 @@ interface Props {
 
 function WindowInspector({ mvId, windowIndex, windowData, sources, mvNexxIndex, routing, onUpdate }: Props) {
   const [saving, setSaving] = useState(false)
+  const [pcmBars, setPcmBars] = useState(windowData?.pcm_bars ?? 0)
   const output = mvNexxIndex * 16 + windowIndex + 1
+
+  // Writes are confirmed by the window events pushed once NEXX has taken them
+  useEffect(() => {
+    setPcmBars(windowData?.pcm_bars ?? 0)
+  }, [windowData?.pcm_bars])
   const currentRoute = routing.find((r: any) => r.output === output)
 
   const handleSourceChange = async (inputId: number) => {
@@ -37,10 +43,10 @@ function WindowInspector({ mvId, windowIndex, windowData, sources, mvNexxIndex,
   }
 
   const handlePcmChange = async (value: number) => {
+    setPcmBars(value)
     setSaving(true)
     try {
       await api.setWindow(mvId, windowIndex, { pcm_bars: value })
-      onUpdate()
     } finally {
       setSaving(false)
     }
@@ -73,7 +79,7 @@ function WindowInspector({ mvId, windowIndex, windowData, sources, mvNexxIndex,
         <div>
           <label className="block text-neutral-400 text-sm mb-1">PCM Audio Bars</label>
           <select
-            value={windowData?.pcm_bars ?? 0}
+            value={pcmBars}
             onChange={(e) => handlePcmChange(Number(e.target.value))}
             disabled={saving}
             className="w-full px-2 py-1.5 bg-neutral-700 border border-neutral-600 rounded text-neutral-100 text-sm"
@@ -89,15 +95,15 @@ function WindowInspector({ mvId, windowIndex, windowData, sources, mvNexxIndex,
         <h4 className="text-neutral-400 text-sm mb-2">UMD Layers</h4>
         {[0, 1, 2].map((idx) => {
           const layer = windowData?.umd?.[idx] || {}
-          return <UMDLayer key={`${mvId}-${windowIndex}-${idx}`} layer={layer} layerIndex={idx} mvId={mvId} windowIndex={windowIndex} onUpdate={onUpdate} />
+          return <UMDLayer key={`${mvId}-${windowIndex}-${idx}`} layer={layer} layerIndex={idx} mvId={mvId} windowIndex={windowIndex} />
         })}
       </div>
     </div>
   )
 }
 
-function UMDLayer({ layer, layerIndex, mvId, windowIndex, onUpdate }: {
-  layer: any; layerIndex: number; mvId: number; windowIndex: number; onUpdate: () => void
+function UMDLayer({ layer, layerIndex, mvId, windowIndex }: {
+  layer: any; layerIndex: number; mvId: number; windowIndex: number
 }) {
   const [saving, setSaving] = useState(false)
 
@@ -129,7 +135,6 @@ function UMDLayer({ layer, layerIndex, mvId, windowIndex, onUpdate }: {
     const fullUmd: any[] = [{}, {}, {}]
     fullUmd[layerIndex] = data
     await api.setWindow(mvId, windowIndex, { umd: fullUmd })
-    onUpdate()
   }
 
   const sendImmediate = async (varid: string, val: number, setter: (v: number) => void) => {
@@ -1,7 +1,7 @@
 import { useEffect, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { useAuthStore } from '../stores/authStore'
-import { api } from '../api/client'
+import { api, waitForRefresh } from '../api/client'
 
 type Tab = 'users' | 'access' | 'integrations' | 'status'
 
@@ -377,6 +377,7 @@ function IntegrationsTab() {
 function StatusTab() {
   const [status, setStatus] = useState<any>(null)
   const [localRefreshing, setLocalRefreshing] = useState(false)
+  const [job, setJob] = useState<any>(null)
   const [error, setError] = useState('')
 
   const loadStatus = () => {
@@ -395,15 +396,22 @@ function StatusTab() {
     setLocalRefreshing(true)
     setError('')
     try {
-      await api.refresh()
+      const { job_id } = await api.refresh()
+      const finished = await waitForRefresh(job_id, setJob)
+      if (finished.status === 'failed' || finished.status === 'partial') setError(finished.result?.errors?.[0] || 'Refresh failed')
       loadStatus()
     } catch (err: any) {
       setError(err.message || 'Refresh failed')
     } finally {
       setLocalRefreshing(false)
+      setJob(null)
     }
   }
 
+  const cancelRefresh = async () => {
+    if (job) await api.cancelRefresh(job.id).catch(() => {})
+  }
+
   const refreshResult = status?.result
 
   return (
@@ -431,8 +439,32 @@ function StatusTab() {
         >
           {isRunning ? 'Refreshing...' : 'Refresh State from Equipment'}
         </button>
+        {job && job.status === 'running' && (
+          <button
+            onClick={cancelRefresh}
+            disabled={job.cancel_requested}
+            className="ml-2 px-4 py-2 bg-neutral-700 hover:bg-neutral-600 disabled:cursor-not-allowed rounded text-white text-sm"
+          >
+            {job.cancel_requested ? 'Cancelling...' : 'Cancel'}
+          </button>
+        )}
       </div>
 
+      {job && job.status === 'queued' && (
+        <p className="text-neutral-400 text-sm">Queued behind the refresh in progress...</p>
+      )}
+
+      {job && job.status === 'running' && (
+        <div className="text-neutral-400 text-sm space-y-1">
+          {Object.entries(job.phases as Record<string, { done: number; total?: number; errors: number }>).map(([phase, p]) => (
+            <p key={phase}>
+              {phase}: {p.done}{p.total !== undefined && ` / ${p.total}`}
+              {p.errors > 0 && <span className="text-red-400"> ({p.errors} errors)</span>}
+            </p>
+          ))}
+        </div>
+      )}
+
       {error && (
         <div className="p-3 bg-red-900/20 border border-red-700 rounded">
           <p className="text-red-400 text-sm">{error}</p>
@@ -2,7 +2,7 @@ import { useEffect, useState } from 'react'
 import { useNavigate } from 'react-router-dom'
 import { useAuthStore } from '../stores/authStore'
 import { useMVStore } from '../stores/mvStore'
-import { api } from '../api/client'
+import { api, waitForRefresh } from '../api/client'
 import { OUTPUT_FORMAT_LABELS, TEXT_FONT_LABELS, BORDER_PIXEL_VALUES, BORDER_PIXEL_LABELS } from '../protocol-mappings'
 import { getLayoutById } from '../data/layouts'
 import LayoutCanvas from '../components/LayoutCanvas'
@@ -12,7 +12,7 @@ import PresetsModal from '../components/PresetsModal'
 
 function Main() {
   const { user, logout, checkAuth } = useAuthStore()
-  const { multiviewers, sources, routing, currentMV, selectedWindow, loadMultiviewers, loadSources, loadRouting, selectMV, selectWindow } = useMVStore()
+  const { multiviewers, sources, routing, currentMV, selectedWindow, loadMultiviewers, loadSources, loadRouting, selectMV, selectWindow, connectEvents } = useMVStore()
   const navigate = useNavigate()
   const [showLayoutModal, setShowLayoutModal] = useState(false)
   const [showPresetsModal, setShowPresetsModal] = useState(false)
@@ -26,7 +26,13 @@ function Main() {
     })
     loadMultiviewers()
     loadSources()
-    loadRouting()
+    let disconnect: (() => void) | undefined
+    let unmounted = false
+    loadRouting().finally(() => { if (!unmounted) disconnect = connectEvents() })
+    return () => {
+      unmounted = true
+      disconnect?.()
+    }
   }, [])
 
   useEffect(() => {
@@ -45,7 +51,8 @@ function Main() {
   const handleRefresh = async () => {
     setRefreshing(true)
     try {
-      await api.refresh()
+      const { job_id } = await api.refresh()
+      await waitForRefresh(job_id)
       await loadMultiviewers()
       await loadSources()
       await loadRouting()
@@ -6,19 +6,30 @@ interface MVState {
   sources: any[]
   routing: any[]
   currentMV: any | null
+  routingVersion: number | null
+  mvVersion: number | null
   selectedWindow: number | null
   loadMultiviewers: () => Promise<void>
   loadSources: () => Promise<void>
   loadRouting: () => Promise<void>
   selectMV: (id: number) => Promise<void>
   selectWindow: (index: number | null) => void
+  connectEvents: () => () => void
 }
 
-export const useMVStore = create<MVState>((set) => ({
+function mergeBy(items: any[], key: string, item: any) {
+  const merged = items.filter((i) => i[key] !== item[key])
+  merged.push(item)
+  return merged.sort((a, b) => a[key] - b[key])
+}
+
+export const useMVStore = create<MVState>((set, get) => ({
   multiviewers: [],
   sources: [],
   routing: [],
   currentMV: null,
+  routingVersion: null,
+  mvVersion: null,
   selectedWindow: null,
   loadMultiviewers: async () => {
     const mvs = await api.getMultiviewers()
@@ -29,12 +40,60 @@ export const useMVStore = create<MVState>((set) => ({
     set({ sources })
   },
   loadRouting: async () => {
-    const routing = await api.getRouting()
-    set({ routing })
+    // After the first load only crosspoints changed since the last seen version come back
+    const { routing, routingVersion } = get()
+    const { data, version } = await api.getRouting(routingVersion)
+    const byOutput = new Map(routing.map((r): [number, any] => [r.output, r]))
+    for (const r of data) byOutput.set(r.output, r)
+    set({ routing: [...byOutput.values()].sort((a, b) => a.output - b.output), routingVersion: version })
   },
   selectMV: async (id) => {
-    const mv = await api.getMultiviewer(id)
-    set({ currentMV: mv })
+    // Reloading the current MV only fetches the windows changed since the last seen version
+    const { currentMV, mvVersion } = get()
+    const since = currentMV?.id === id ? mvVersion : null
+    const { data, version } = await api.getMultiviewer(id, since)
+    if (since != null) {
+      const windows = new Map(currentMV.windows.map((w: any) => [w.window_index, w]))
+      for (const w of data.windows) windows.set(w.window_index, w)
+      data.windows = [...windows.values()].sort((a: any, b: any) => a.window_index - b.window_index)
+    }
+    set({ currentMV: data, mvVersion: version })
   },
   selectWindow: (index) => set({ selectedWindow: index }),
+  connectEvents: () => {
+    // Resume from the routing state already loaded; the browser resumes by itself on reconnect
+    const { routingVersion } = get()
+    const since = routingVersion != null ? `?since=${routingVersion}` : ''
+    const events = new EventSource(`/api/events${since}`, { withCredentials: true })
+    const on = (type: string, handler: (data: any) => void) =>
+      events.addEventListener(type, (e) => handler(JSON.parse((e as MessageEvent).data)))
+
+    on('routing', (r) => {
+      set({ routing: mergeBy(get().routing, 'output', { output: r.output, input: r.input }) })
+    })
+    on('window', (w) => {
+      const { currentMV } = get()
+      if (currentMV?.id !== w.mv_id) return
+      const window = { window_index: w.window_index, pcm_bars: w.pcm_bars, umd: w.umd }
+      set({ currentMV: { ...currentMV, windows: mergeBy(currentMV.windows, 'window_index', window) } })
+    })
+    on('mv', (m) => {
+      const { currentMV } = get()
+      if (currentMV?.id !== m.mv_id) return
+      const { layout, font, outer_border, inner_border, output_format } = m
+      set({ currentMV: { ...currentMV, layout, font, outer_border, inner_border, output_format } })
+    })
+    on('source', (s) => {
+      set({ sources: mergeBy(get().sources, 'id', { id: s.id, quartz_input: s.quartz_input, label: s.label }) })
+    })
+    on('resync', () => {
+      // Missed events are gone: reload everything in full
+      const { currentMV, loadSources, loadRouting, selectMV } = get()
+      set({ routingVersion: null, mvVersion: null })
+      loadSources()
+      loadRouting()
+      if (currentMV) selectMV(currentMV.id)
+    })
+    return () => events.close()
+  },
 }))